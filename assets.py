@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Image assets of the viewer: PNG sizes and scaled images with a disk cache.
+
+The layout of the viewer only needs the size of the images, which png_size
+reads from the PNG header without decoding the file. Scaled images are
+decoded and scaled once, then stored as raw pixels (RGBA, or RGB for opaque
+images) in the cache directory, keyed by the size and modification time of the
+source image and the target size; later runs read them back without decoding
+or scaling.
+
+Once a display mode is set, loaded images are converted to the display's pixel
+format (convert_alpha for images with transparency), so blitting them, and the
+rotations and scalings derived from them, needs no per-pixel conversion.
+"""
+import hashlib
+import os
+import struct
+
+import pygame
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+CACHE_VERSION = 1
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def png_size(filename):
+    """(width, height) of a PNG image, read from its IHDR chunk."""
+    with open(filename, "rb") as f:
+        header = f.read(24)
+    if len(header) < 24 or header[:8] != PNG_SIGNATURE or header[12:16] != b"IHDR":
+        raise ValueError("{}: not a PNG image".format(filename))
+    return struct.unpack(">II", header[16:24])
+
+
+def _cache_path(filename, size, cache_dir):
+    stat = os.stat(filename)
+    key = "{}:{}:{}:{}:{}x{}".format(CACHE_VERSION, os.path.abspath(filename), stat.st_size, stat.st_mtime_ns,
+                                     size[0], size[1])
+    return os.path.join(cache_dir, "image_{}.raw".format(hashlib.sha1(key.encode()).hexdigest()))
+
+
+def display_format(image):
+    """image in the display's pixel format, or unchanged when no display mode is set."""
+    if pygame.display.get_init() and pygame.display.get_surface() is not None:
+        return image.convert_alpha() if image.get_flags() & pygame.SRCALPHA else image.convert()
+    return image
+
+
+def load_scaled_image(filename, size, cache_dir=CACHE_DIR):
+    """Surface of an image scaled to size, from the disk cache when possible."""
+    size = (int(size[0]), int(size[1]))
+    cache_path = _cache_path(filename, size, cache_dir)
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            pixels = f.read()
+        if len(pixels) == size[0] * size[1] * 4:
+            return display_format(pygame.image.frombytes(pixels, size, "RGBA"))
+        if len(pixels) == size[0] * size[1] * 3:
+            return display_format(pygame.image.frombytes(pixels, size, "RGB"))
+
+    image = pygame.transform.scale(pygame.image.load(filename), size)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = cache_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(pygame.image.tobytes(image, "RGBA" if image.get_flags() & pygame.SRCALPHA else "RGB"))
+    os.replace(temp_path, cache_path)
+    return display_format(image)
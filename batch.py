@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Vectorized evaluation of many candidate paths at once.
+
+Paths are given as an (N_paths, N_waypoints, 8) array with the same fields as
+path_points: [x, y, angle, is_forward, v, w, a, alpha]. Shorter paths are
+padded with NaN rows. Every quantity is computed with NumPy across all paths
+together, using the same trapezoidal model as motion_profile.py.
+"""
+import numpy as np
+
+from motion_profile import (
+    X, Y, ANGLE, LINEAR_VELOCITY, ANGULAR_VELOCITY, LINEAR_ACCELERATION, ANGULAR_ACCELERATION,
+    LINEAR_VELOCITY_LEVELS, ANGULAR_VELOCITY_LEVELS, LINEAR_ACCELERATION_LEVELS, ANGULAR_ACCELERATION_LEVELS,
+)
+
+WAYPOINT_FIELDS = 8
+
+
+def pack_paths(paths):
+    """Stack a list of path_points lists into a NaN-padded (N, W, 8) array."""
+    width = max((len(path) for path in paths), default=0)
+    packed = np.full((len(paths), width, WAYPOINT_FIELDS), np.nan)
+    for i, path in enumerate(paths):
+        if len(path) > 0:
+            packed[i, :len(path)] = np.asarray(path, dtype=float)
+    return packed
+
+
+def trapezoid_durations(distance, max_velocity, max_acceleration):
+    """Vectorized duration of rest-to-rest trapezoidal profiles (see TrapezoidProfile)."""
+    distance = np.abs(distance)
+    triangular = max_velocity * max_velocity / max_acceleration >= distance
+    return np.where(triangular,
+                    2.0 * np.sqrt(distance / max_acceleration),
+                    distance / max_velocity + max_velocity / max_acceleration)
+
+
+def _levels(table, choices):
+    index = np.clip(np.nan_to_num(choices).astype(int), 0, len(table) - 1)
+    return np.asarray(table)[index]
+
+
+def _fill_padding(paths):
+    """Replace NaN padding rows by the last valid waypoint of each path."""
+    valid = ~np.isnan(paths[:, :, X])
+    index = np.where(valid, np.arange(paths.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    return np.take_along_axis(paths, index[:, :, None], axis=1), valid
+
+
+def segment_durations(current, target):
+    """Durations, lengths and rotations of the segments from current poses to target waypoints.
+
+    Both are arrays of waypoints (last axis holds the path_points fields) that
+    broadcast against each other, e.g. (N, 1, 8) and (1, N, 8) for every pair.
+    """
+    # Geometry of every segment
+    lengths = np.hypot(target[..., X] - current[..., X], target[..., Y] - current[..., Y])
+    rotations = (target[..., ANGLE] - current[..., ANGLE] + 180.0) % 360.0 - 180.0
+
+    # Limits come from the slider levels of the waypoint being driven to
+    v_max = _levels(LINEAR_VELOCITY_LEVELS, target[..., LINEAR_VELOCITY])
+    omega_max = _levels(ANGULAR_VELOCITY_LEVELS, target[..., ANGULAR_VELOCITY])
+    a_max = _levels(LINEAR_ACCELERATION_LEVELS, target[..., LINEAR_ACCELERATION])
+    alpha_max = _levels(ANGULAR_ACCELERATION_LEVELS, target[..., ANGULAR_ACCELERATION])
+
+    durations = np.maximum(trapezoid_durations(lengths, v_max, a_max),
+                           trapezoid_durations(rotations, omega_max, alpha_max))
+    return durations, lengths, rotations
+
+
+class BatchResult:
+    """Per-path metrics returned by evaluate_paths()."""
+
+    def __init__(self, total_time, distance, rotation, final_pose, segment_times):
+        self.total_time = total_time        # s, shape (N,)
+        self.distance = distance            # mm, shape (N,)
+        self.rotation = rotation            # degrees turned in total, shape (N,)
+        self.final_pose = final_pose        # (x, y, angle), shape (N, 3)
+        self.segment_times = segment_times  # s, shape (N, W - 1)
+
+    def ranking(self):
+        """Path indices sorted from fastest to slowest."""
+        return np.argsort(self.total_time, kind="stable")
+
+
+def evaluate_paths(paths, start_poses=None):
+    """Evaluate a batch of paths.
+
+    paths is an (N, W, 8) array (NaN-padded) or a list of path_points lists.
+    start_poses, if given, is an (N, 3) array of (x, y, angle) the robots start
+    from; otherwise each path starts on its first waypoint.
+    """
+    paths = np.asarray(paths, dtype=float) if not isinstance(paths, list) else pack_paths(paths)
+    if paths.ndim != 3 or paths.shape[2] < WAYPOINT_FIELDS:
+        raise ValueError("Expected an (N_paths, N_waypoints, 8) array, got shape {}".format(paths.shape))
+    paths, valid = _fill_padding(paths)
+
+    if paths.shape[1] == 0 and start_poses is None:
+        # No waypoints at all: like paths that are entirely padding
+        count = len(paths)
+        return BatchResult(np.full(count, np.nan), np.full(count, np.nan), np.full(count, np.nan),
+                           np.full((count, 3), np.nan), np.zeros((count, 0)))
+
+    if start_poses is not None:
+        start = np.zeros((len(paths), 1, paths.shape[2]))
+        start[:, 0, :3] = np.asarray(start_poses, dtype=float)
+        paths = np.concatenate([start, paths], axis=1)
+
+    segment_times, lengths, rotations = segment_durations(paths[:, :-1], paths[:, 1:])
+
+    final_pose = paths[:, -1, :3].copy()
+    if start_poses is None:
+        # Paths that are entirely padding have no pose at all
+        final_pose[~valid.any(axis=1)] = np.nan
+
+    return BatchResult(segment_times.sum(axis=1),
+                       lengths.sum(axis=1),
+                       np.abs(rotations).sum(axis=1),
+                       final_pose,
+                       segment_times)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Benchmarks of the simulation and rendering hot paths.
+
+Runs the viewer code headless (SDL dummy video driver) on synthetic paths of
+10 to 100k waypoints and reports the time per call of:
+    update_movement     Robot.update_movement, one 60 FPS frame of 1 kHz physics
+    draw_arrows         full redraw of the path arrows (Robot.draw_arrows)
+    overlay_replace     PathOverlay: remove the last waypoint and append it again
+    robot_draw          Robot.draw at a new angle / at a cached angle
+    mm_to_px, px_to_mm  get_px_coordinates / get_mm_coordinates per point, and
+                        TableFrame.mm_to_px / px_to_mm on the whole array
+    frame               a whole viewer frame: physics, then the layered renderer
+Motion and frame scenarios stop at MAX_MOTION_WAYPOINTS: longer paths compile
+into trajectory tables of millions of samples.
+
+Results are written as JSON and compared with a baseline file:
+    python benchmark.py --output bench.json --baseline baseline.json
+    python benchmark.py --save-baseline baseline.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+import pygame
+
+SCALES = (10, 100, 1000, 10000, 100000)
+MAX_MOTION_WAYPOINTS = 10000
+
+# Each measurement repeats the call for at least MIN_TIME, REPEAT times, and keeps the best
+MIN_TIME = 0.1
+REPEAT = 3
+
+# A result this many times slower than the baseline is a regression
+REGRESSION_RATIO = 1.25
+
+PHYSICS_STEPS_PER_FRAME = 16
+
+
+def measure(function, min_time=MIN_TIME, repeat=REPEAT):
+    """Best time (s) per call of function over repeat runs of at least min_time each."""
+    best = float("inf")
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < min_time:
+            function()
+            calls += 1
+            elapsed = time.perf_counter() - start
+        best = min(best, elapsed / calls)
+    return best
+
+
+def random_walk(count, step_mm=20.0, seed=0):
+    """path_points of count waypoints wandering over the table, fastest levels."""
+    rng = random.Random(seed)
+    x, y = 900.0, 600.0
+    points = []
+    for _ in range(count):
+        heading = rng.uniform(0, 2 * np.pi)
+        x = min(max(x + step_mm * np.cos(heading), 250.0), 1550.0)
+        y = min(max(y + step_mm * np.sin(heading), 250.0), 950.0)
+        points.append([x, y, 0.0, True, 3, 3, 3, 3])
+    return points
+
+
+def run(scales=SCALES):
+    import new_sim
+    from renderer import LayeredRenderer
+
+    new_sim.open_window()
+    new_sim.create_widgets()
+    robot = new_sim.robot
+    surface = pygame.Surface((new_sim.WIDTH, new_sim.HEIGHT))
+    results = {}
+
+    def record(name, seconds):
+        results[name] = seconds
+        print("{:<32} {:>12.3f} us".format(name, seconds * 1e6))
+        sys.stdout.flush()
+
+    def rewind_before_end():
+        # Loop over the run without ever completing it
+        engine = robot.engine
+        if engine.time + 2 * PHYSICS_STEPS_PER_FRAME * engine.dt >= engine.duration:
+            engine.seek(0.0)
+            engine.resume()
+
+    for count in scales:
+        points = random_walk(count)
+        new_sim.path_points = points
+
+        if count <= MAX_MOTION_WAYPOINTS:
+            robot.engine.set_path(points)
+            robot.reset_to_start()
+            robot.engine.start()
+
+            def frame_of_physics():
+                rewind_before_end()
+                robot.update_movement(PHYSICS_STEPS_PER_FRAME, 0.5)
+            record("update_movement[{}]".format(count), measure(frame_of_physics))
+
+        record("draw_arrows[{}]".format(count), measure(lambda: robot.draw_arrows(surface), repeat=1))
+
+        new_sim.path_overlay.rebuild(points[:-1], [new_sim.BLACK] * (count - 2))
+
+        def append_last():
+            new_sim.path_overlay.truncate(count - 1)
+            new_sim.path_overlay.append(points[-1], new_sim.BLACK)
+        record("overlay_replace[{}]".format(count), measure(append_last))
+
+        if count <= MAX_MOTION_WAYPOINTS:
+            renderer = LayeredRenderer(new_sim.screen, new_sim.BACKGROUND_COLOR, new_sim.scaled_map_image,
+                                       (new_sim.map_x, new_sim.map_y), (0, 0, new_sim.CONTROL_WIDTH, new_sim.HEIGHT),
+                                       new_sim.path_overlay)
+            renderer.render(lambda s: new_sim.draw_controls(0, 0, s), robot.draw, robot.get_rect(),
+                            robot.get_draw_key())
+
+            def frame():
+                rewind_before_end()
+                new_sim.update_frame([], PHYSICS_STEPS_PER_FRAME, 0.5)
+                renderer.invalidate_ui()
+                renderer.render(lambda s: new_sim.draw_controls(0, 0, s), robot.draw, robot.get_rect(),
+                                robot.get_draw_key())
+            record("frame[{}]".format(count), measure(frame))
+
+    # Rotation cost of the robot sprite: every call a new angle, then always the same one
+    angles = itertools.count(0.0, 0.37)
+
+    def draw_rotating():
+        robot.angle = next(angles) % 360.0
+        robot.draw(surface)
+    record("robot_draw[rotating]", measure(draw_rotating))
+    robot.angle = 42.0
+    record("robot_draw[cached]", measure(lambda: robot.draw(surface)))
+
+    xs = np.random.default_rng(0).uniform(0, 1800, 1000).tolist()
+    ys = np.random.default_rng(1).uniform(0, 1200, 1000).tolist()
+    record("mm_to_px[1000 points]", measure(lambda: [new_sim.get_px_coordinates(x, y) for x, y in zip(xs, ys)]))
+    pxs = [new_sim.get_px_coordinates(x, y) for x, y in zip(xs, ys)]
+    record("px_to_mm[1000 points]", measure(lambda: [new_sim.get_mm_coordinates(x, y) for x, y in pxs]))
+    mm_array = np.column_stack([xs, ys])
+    px_array = np.array(pxs)
+    record("mm_to_px[1000 points, bulk]", measure(lambda: new_sim.table_frame.mm_to_px(mm_array)))
+    record("px_to_mm[1000 points, bulk]", measure(lambda: new_sim.table_frame.px_to_mm(px_array)))
+    return results
+
+
+def compare(results, baseline, ratio=REGRESSION_RATIO):
+    """Print the change of every result against the baseline; returns the regressed names."""
+    regressions = []
+    print("\n{:<32} {:>12} {:>12} {:>8}".format("benchmark", "baseline us", "current us", "ratio"))
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        change = seconds / baseline[name] if baseline[name] > 0 else float("inf")
+        flag = ""
+        if change > ratio:
+            regressions.append(name)
+            flag = "  SLOWER"
+        elif change < 1 / ratio:
+            flag = "  faster"
+        print("{:<32} {:>12.3f} {:>12.3f} {:>7.2f}x{}".format(name, baseline[name] * 1e6, seconds * 1e6, change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation and rendering hot paths")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results in this JSON file")
+    parser.add_argument("--save-baseline", help="write the results as a new baseline")
+    parser.add_argument("--max-waypoints", type=int, default=SCALES[-1], help="largest scenario")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on a regression")
+    args = parser.parse_args()
+
+    results = run([count for count in SCALES if count <= args.max_waypoints])
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "seconds_per_call": results,
+    }
+    for filename in (args.output, args.save_baseline):
+        if filename:
+            with open(filename, "w") as f:
+                json.dump(report, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["seconds_per_call"]
+        regressions = compare(results, baseline)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Event routing for the viewer widgets.
+
+Instead of passing every event to every widget, the EventDispatcher sends:
+    mouse button presses    to the top-most widget under the cursor, found in a
+                            uniform grid index of the widget rectangles; that
+                            widget captures the pointer until the button is
+                            released, so drags keep going outside of it
+    motion and releases     to the widget holding the capture, if any
+    keys                    to the widget with the keyboard focus
+A press on a focusable widget gives it the focus (a second press takes it
+back); a press anywhere else clears it. coalesce_motion merges the runs of
+MOUSEMOTION events of a frame, so a drag costs one update per frame.
+"""
+import pygame
+
+# Size of the cells of the widget index (px)
+CELL_SIZE = 64
+
+KEY_EVENTS = (pygame.KEYDOWN, pygame.KEYUP, pygame.TEXTINPUT)
+
+
+def coalesce_motion(events):
+    """Merge consecutive MOUSEMOTION events into the last one, adding up their rel."""
+    merged = []
+    for event in events:
+        if event.type == pygame.MOUSEMOTION and merged and merged[-1].type == pygame.MOUSEMOTION:
+            previous = merged[-1]
+            attributes = dict(event.dict)
+            attributes["rel"] = (previous.rel[0] + event.rel[0], previous.rel[1] + event.rel[1])
+            merged[-1] = pygame.event.Event(pygame.MOUSEMOTION, attributes)
+        else:
+            merged.append(event)
+    return merged
+
+
+class WidgetIndex:
+    """Uniform grid of cells mapping to the widgets whose rectangle overlaps them."""
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def insert(self, entry, rect):
+        size = self.cell_size
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                self.cells.setdefault((cx, cy), []).append(entry)
+
+    def candidates(self, pos):
+        return self.cells.get((int(pos[0]) // self.cell_size, int(pos[1]) // self.cell_size), ())
+
+
+class EventDispatcher:
+    """Routes pygame events to the widget they are meant for.
+
+    Widgets have a handle_event(event) method and optionally a hit_test(pos)
+    method for a finer test than their rectangle. Widgets added later are on
+    top of the earlier ones. Focusable widgets have a set_focus(focused)
+    method; returning True from a key event (an entry committed with Return)
+    releases the focus.
+    """
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.index = WidgetIndex(cell_size)
+        self.count = 0
+        self.focus = None       # Widget receiving the keyboard events
+        self.capture = None     # Widget receiving the pointer until the button is released
+
+    def add(self, widget, rect=None, focusable=False):
+        """Register a widget over rect (defaults to widget.rect)."""
+        rect = pygame.Rect(widget.rect if rect is None else rect)
+        # (z order, widget, rect, focusable); the top-most widget has the highest z
+        self.index.insert((self.count, widget, rect, focusable), rect)
+        self.count += 1
+        return widget
+
+    def widget_at(self, pos):
+        """(widget, focusable) of the top-most widget under a screen position, or (None, False)."""
+        best = None
+        for entry in self.index.candidates(pos):
+            z, widget, rect, _ = entry
+            if (best is None or z > best[0]) and rect.collidepoint(pos):
+                hit_test = getattr(widget, "hit_test", None)
+                if hit_test is None or hit_test(pos):
+                    best = entry
+        return (best[1], best[3]) if best is not None else (None, False)
+
+    def set_focus(self, widget):
+        if widget is self.focus:
+            return
+        if self.focus is not None:
+            self.focus.set_focus(False)
+        self.focus = widget
+        if widget is not None:
+            widget.set_focus(True)
+
+    def dispatch(self, event):
+        """Send an event to its widget; returns (widget, result of its handle_event) or (None, None)."""
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            widget, focusable = self.widget_at(event.pos)
+            self.set_focus(widget if focusable and widget is not self.focus else None)
+            self.capture = widget
+        elif event.type == pygame.MOUSEBUTTONUP:
+            widget = self.capture
+            self.capture = None
+        elif event.type == pygame.MOUSEMOTION:
+            widget = self.capture
+        elif event.type in KEY_EVENTS:
+            widget = self.focus
+        else:
+            widget = None
+        if widget is None:
+            return None, None
+
+        result = widget.handle_event(event)
+        if result and widget is self.focus and event.type in KEY_EVENTS:
+            self.set_focus(None)
+        return widget, result
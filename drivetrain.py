@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""Differential-drive kinematics and wheel odometry.
+
+The viewer moves the robot along its trajectory table as if it could
+translate and rotate independently. This module simulates a differential
+drive following the same path by turning on the spot and driving straight
+between waypoints: body velocity commands
+(v mm/s, omega deg/s) become left and right wheel velocity targets, limited
+per wheel in velocity (scaled together, keeping the curvature) and in
+acceleration, and the wheel travel is counted by quantised encoders. The
+result is the true pose of the robot and the encoder counts a controller
+would read, at any fixed rate (1-10 kHz for firmware tuning).
+
+Everything is vectorized over N robots sharing one DriveConfig: a call
+integrates a block of K steps for all of them. Only the acceleration limit
+is a step by step recurrence (a loop over K of NumPy operations on N values);
+poses and encoder counts of the whole block are then integrated with
+cumulative sums. Odometry (dead reckoning from the counts) uses the same
+integration, so its error is only that of the encoders. Usage:
+    python drivetrain.py path_points.json --rate 5000 --output odometry.npz
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from motion_profile import (X, Y, ANGLE, IS_FORWARD, LINEAR_VELOCITY, ANGULAR_VELOCITY_LEVELS, TrapezoidProfile,
+                            normalize_angle, waypoint_limits)
+from trajectory import sample_trapezoid
+
+# Default drive train (mm, encoder ticks)
+WHEEL_BASE_MM = 330.0
+WHEEL_DIAMETER_MM = 60.0
+TICKS_PER_REVOLUTION = 4096                # 1024-line encoders, quadrature decoding
+MAX_WHEEL_VELOCITY = 1200.0                # mm/s
+MAX_WHEEL_ACCELERATION = 2000.0            # mm/s²
+
+# Default encoder sampling rate (Hz)
+DEFAULT_DRIVE_RATE = 1000.0
+
+# Largest end-of-run error accepted by --check-levels
+FINAL_POSE_TOLERANCE_MM = 1.0
+FINAL_ANGLE_TOLERANCE = 0.5                # deg
+
+LEFT, RIGHT = 0, 1
+
+
+class DriveConfig:
+    """Geometry and limits of a differential drive.
+
+    The wheel limits are a single value or a (left, right) pair.
+    """
+
+    def __init__(self, wheel_base_mm=WHEEL_BASE_MM, wheel_diameter_mm=WHEEL_DIAMETER_MM,
+                 ticks_per_revolution=TICKS_PER_REVOLUTION, max_wheel_velocity=MAX_WHEEL_VELOCITY,
+                 max_wheel_acceleration=MAX_WHEEL_ACCELERATION):
+        self.wheel_base_mm = float(wheel_base_mm)     # distance between the wheel contact points
+        self.wheel_diameter_mm = float(wheel_diameter_mm)
+        self.ticks_per_revolution = int(ticks_per_revolution)
+        self.max_wheel_velocity = np.broadcast_to(np.asarray(max_wheel_velocity, dtype=float), (2,))
+        self.max_wheel_acceleration = np.broadcast_to(np.asarray(max_wheel_acceleration, dtype=float), (2,))
+
+    @property
+    def mm_per_tick(self):
+        return np.pi * self.wheel_diameter_mm / self.ticks_per_revolution
+
+
+def integrate_wheels(poses, left, right, wheel_base_mm):
+    """Poses after each of K steps of wheel travel.
+
+    poses is the (N, 3) start (x mm, y mm, theta rad); left and right are the
+    (K, N) distances travelled by the wheels during every step. Each step is
+    an arc, approximated by a chord along the mean heading of the step.
+    Returns an array of shape (K, N, 3).
+    """
+    distance = 0.5 * (left + right)
+    rotation = (right - left) / wheel_base_mm
+    theta = poses[:, 2] + np.cumsum(rotation, axis=0)
+    heading = theta - 0.5 * rotation
+    result = np.empty(left.shape + (3,))
+    result[..., 0] = poses[:, 0] + np.cumsum(distance * np.cos(heading), axis=0)
+    result[..., 1] = poses[:, 1] + np.cumsum(distance * np.sin(heading), axis=0)
+    result[..., 2] = theta
+    return result
+
+
+class DriveRun:
+    """Outcome of DifferentialDrive.run: K steps of N robots.
+
+    poses are in degrees like the rest of the simulation; ticks are the
+    encoder counts read at the end of every step.
+    """
+
+    def __init__(self, times, poses, wheel_velocity, ticks):
+        self.times = times                    # s, shape (K,)
+        self.poses = poses                    # (x, y, angle), shape (K, N, 3)
+        self.wheel_velocity = wheel_velocity  # mm/s, (left, right), shape (K, N, 2)
+        self.ticks = ticks                    # int64, (left, right), shape (K, N, 2)
+
+    def __len__(self):
+        return len(self.times)
+
+
+class DifferentialDrive:
+    """Wheel-level state of N differential-drive robots, stepped together."""
+
+    def __init__(self, poses=((0.0, 0.0, 0.0),), config=None, dt=1.0 / DEFAULT_DRIVE_RATE):
+        self.config = config if config is not None else DriveConfig()
+        self.dt = dt
+        self.time = 0.0
+        poses = np.array(poses, dtype=float).reshape(-1, 3)
+        self.poses = poses.copy()           # x mm, y mm, theta rad, shape (N, 3)
+        self.poses[:, 2] = np.radians(poses[:, 2])
+        count = len(poses)
+        self.wheel_velocity = np.zeros((count, 2))
+        self.wheel_travel = np.zeros((count, 2))    # mm since the start, unquantised
+        self.ticks = np.zeros((count, 2), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.poses)
+
+    @property
+    def pose_degrees(self):
+        """Current (x, y, angle) of every robot, angle in degrees, shape (N, 3)."""
+        poses = self.poses.copy()
+        poses[:, 2] = np.degrees(poses[:, 2]) % 360.0
+        return poses
+
+    def wheel_targets(self, v, omega):
+        """(..., N, 2) wheel velocities for body velocities v (mm/s) and omega (deg/s).
+
+        A target over the velocity limit of a wheel slows both wheels by the
+        same factor, so the robot keeps its curvature.
+        """
+        half_turn = np.radians(omega) * (0.5 * self.config.wheel_base_mm)
+        targets = np.stack(np.broadcast_arrays(v - half_turn, v + half_turn), axis=-1)
+        limit = self.config.max_wheel_velocity
+        with np.errstate(divide="ignore"):
+            factor = np.min(limit / np.abs(targets), axis=-1, keepdims=True)
+        return targets * np.minimum(factor, 1.0)
+
+    def run(self, v, omega):
+        """Apply K steps of body velocity commands and return the DriveRun.
+
+        v and omega have shape (K,) (same command for every robot) or (K, N).
+        """
+        v = np.asarray(v, dtype=float)
+        omega = np.asarray(omega, dtype=float)
+        steps = len(v)
+        shape = (steps, len(self.poses))
+        if v.ndim == 1:
+            v = v[:, None]
+        if omega.ndim == 1:
+            omega = omega[:, None]
+        targets = self.wheel_targets(np.broadcast_to(v, shape), np.broadcast_to(omega, shape))
+
+        # Acceleration limit: the only step by step part
+        max_change = self.config.max_wheel_acceleration * self.dt
+        velocity = np.empty_like(targets)
+        current = self.wheel_velocity.copy()
+        change = np.empty_like(current)
+        for k in range(steps):
+            np.subtract(targets[k], current, out=change)
+            np.clip(change, -max_change, max_change, out=change)
+            current += change
+            velocity[k] = current
+
+        travel = velocity * self.dt
+        poses = integrate_wheels(self.poses, travel[..., LEFT], travel[..., RIGHT], self.config.wheel_base_mm)
+        wheel_travel = self.wheel_travel + np.cumsum(travel, axis=0)
+        ticks = np.floor(wheel_travel / self.config.mm_per_tick).astype(np.int64)
+
+        times = self.time + self.dt * np.arange(1, steps + 1)
+        if steps:
+            self.wheel_velocity = current
+            self.poses = poses[-1].copy()
+            self.wheel_travel = wheel_travel[-1].copy()
+            self.ticks = ticks[-1].copy()
+            self.time = float(times[-1])
+        poses[..., 2] = np.degrees(poses[..., 2])
+        return DriveRun(times, poses, velocity, ticks)
+
+    def step(self, v, omega):
+        """Apply one step of body velocity commands (scalars or (N,) arrays); returns the ticks."""
+        self.run(np.reshape(v, (1, -1)), np.reshape(omega, (1, -1)))
+        return self.ticks
+
+
+def dead_reckoning(ticks, start_poses, config=None, start_ticks=None):
+    """Poses (K, N, 3) estimated from encoder counts (K, N, 2), angles in degrees.
+
+    start_ticks are the counts at start_poses (default zero).
+    """
+    config = config if config is not None else DriveConfig()
+    ticks = np.asarray(ticks, dtype=np.int64)
+    start_poses = np.array(start_poses, dtype=float).reshape(-1, 3)
+    start_poses[:, 2] = np.radians(start_poses[:, 2])
+    start_ticks = np.zeros(ticks.shape[1:], dtype=np.int64) if start_ticks is None else start_ticks
+    travel = np.diff(ticks, axis=0, prepend=np.reshape(start_ticks, (1,) + ticks.shape[1:])) * config.mm_per_tick
+    poses = integrate_wheels(start_poses, travel[..., LEFT], travel[..., RIGHT], config.wheel_base_mm)
+    poses[..., 2] = np.degrees(poses[..., 2])
+    return poses
+
+
+def drive_limits(waypoint, config):
+    """(v_max, omega_max, a_max, alpha_max) of a waypoint's slider levels, within the wheel limits.
+
+    Turning on the spot at omega moves each wheel at omega * wheel_base / 2,
+    so the angular limits are capped by the slowest wheel as well. Commands
+    beyond the wheel limits would be lagged by the acceleration limit, and
+    the heading error would build up along the path.
+    """
+    v_max, omega_max, a_max, alpha_max = waypoint_limits(waypoint)
+    wheel_velocity = float(np.min(config.max_wheel_velocity))
+    wheel_acceleration = float(np.min(config.max_wheel_acceleration))
+    half_base = 0.5 * config.wheel_base_mm
+    return (min(v_max, wheel_velocity),
+            min(omega_max, math.degrees(wheel_velocity / half_base)),
+            min(a_max, wheel_acceleration),
+            min(alpha_max, math.degrees(wheel_acceleration / half_base)))
+
+
+def segment_moves(start_pose, waypoint, config=None):
+    """Trapezoid profiles (kind, profile) that drive a differential drive to a waypoint.
+
+    A differential drive cannot move sideways, so instead of translating and
+    rotating concurrently like the viewer, the robot turns on the spot to face
+    the waypoint (its back when is_forward is off), drives straight, then turns
+    to the waypoint angle. The slider levels of the waypoint set the limits,
+    capped to what the drive of config can follow (see drive_limits).
+    """
+    config = config if config is not None else DriveConfig()
+    v_max, omega_max, a_max, alpha_max = drive_limits(waypoint, config)
+    x, y, angle = start_pose
+    dx, dy = waypoint[X] - x, waypoint[Y] - y
+    length = math.hypot(dx, dy)
+    moves = []
+    if length > 0:
+        heading = math.degrees(math.atan2(dy, dx))
+        if not waypoint[IS_FORWARD]:
+            heading += 180.0
+            length = -length
+        moves.append(("turn", TrapezoidProfile(normalize_angle(heading - angle), omega_max, alpha_max)))
+        moves.append(("drive", TrapezoidProfile(length, v_max, a_max)))
+        angle = heading
+    moves.append(("turn", TrapezoidProfile(normalize_angle(waypoint[ANGLE] - angle), omega_max, alpha_max)))
+    return moves
+
+
+def path_commands(path_points, rate=DEFAULT_DRIVE_RATE, config=None):
+    """Body velocity commands (v mm/s, omega deg/s) following a path with a differential drive.
+
+    Every segment becomes the turn, drive, turn moves of segment_moves.
+    Returns (start pose, v, omega) with one command per 1 / rate.
+    """
+    dt = 1.0 / rate
+    first = path_points[0]
+    pose = (first[X], first[Y], first[ANGLE])
+    v, omega = [], []
+    for waypoint in path_points[1:]:
+        for kind, profile in segment_moves(pose, waypoint, config):
+            if profile.duration == 0:
+                continue
+            # Commands are the mean velocity over each step, so the integrated
+            # distance matches the profile
+            t = np.arange(0.0, profile.duration + dt, dt)
+            position, _ = sample_trapezoid(profile, t)
+            command = np.diff(position) / dt
+            zeros = np.zeros(len(command))
+            v.append(command if kind == "drive" else zeros)
+            omega.append(command if kind == "turn" else zeros)
+        pose = (waypoint[X], waypoint[Y], waypoint[ANGLE])
+    if not v:
+        return (first[X], first[Y], first[ANGLE]), np.zeros(0), np.zeros(0)
+    return (first[X], first[Y], first[ANGLE]), np.concatenate(v), np.concatenate(omega)
+
+
+def simulate_path(path_points, config=None, rate=DEFAULT_DRIVE_RATE):
+    """Drive the trajectory of a path; returns (DifferentialDrive, DriveRun, odometry poses)."""
+    start, v, omega = path_commands(path_points, rate, config)
+    drive = DifferentialDrive([start], config, 1.0 / rate)
+    run = drive.run(v, omega)
+    odometry = dead_reckoning(run.ticks, [start], drive.config)
+    return drive, run, odometry
+
+
+def final_pose_errors(path_points, config=None, rate=DEFAULT_DRIVE_RATE):
+    """Distance (mm) and angle (deg) from the end of the run to the last waypoint, at every slider level.
+
+    Returns {level: (distance, angle)}; all four slider choices of every
+    waypoint are set to the level.
+    """
+    last = path_points[-1]
+    errors = {}
+    for level in range(len(ANGULAR_VELOCITY_LEVELS)):
+        leveled = [list(point[:LINEAR_VELOCITY]) + [level] * 4 for point in path_points]
+        drive, run, _ = simulate_path(leveled, config, rate)
+        x, y, angle = drive.pose_degrees[0]
+        errors[level] = (math.hypot(x - last[X], y - last[Y]), abs(normalize_angle(angle - last[ANGLE])))
+    return errors
+
+
+def main():
+    from pathfile import load_path
+
+    parser = argparse.ArgumentParser(description="Differential-drive run and wheel odometry of a saved path")
+    parser.add_argument("path", nargs="?", default="path_points.json", help="path file (.json or .rpth)")
+    parser.add_argument("--rate", type=float, default=DEFAULT_DRIVE_RATE, help="encoder sampling rate (Hz)")
+    parser.add_argument("--wheel-base", type=float, default=WHEEL_BASE_MM, help="mm")
+    parser.add_argument("--wheel-diameter", type=float, default=WHEEL_DIAMETER_MM, help="mm")
+    parser.add_argument("--ticks", type=int, default=TICKS_PER_REVOLUTION, help="encoder ticks per revolution")
+    parser.add_argument("--max-velocity", type=float, nargs="+", default=[MAX_WHEEL_VELOCITY],
+                        help="wheel velocity limit (mm/s), or left and right limits")
+    parser.add_argument("--max-acceleration", type=float, nargs="+", default=[MAX_WHEEL_ACCELERATION],
+                        help="wheel acceleration limit (mm/s²), or left and right limits")
+    parser.add_argument("--output", help=".npz file for the times, true poses and encoder counts")
+    parser.add_argument("--check-levels", action="store_true",
+                        help="drive the path at every slider level and fail unless the robot ends on the last waypoint")
+    args = parser.parse_args()
+
+    path_points = load_path(args.path)
+    if len(path_points) == 0:
+        parser.error("{} is an empty path".format(args.path))
+    config = DriveConfig(args.wheel_base, args.wheel_diameter, args.ticks, args.max_velocity, args.max_acceleration)
+    if args.check_levels:
+        failed = False
+        for level, (distance, angle) in final_pose_errors(path_points, config, args.rate).items():
+            ok = distance <= FINAL_POSE_TOLERANCE_MM and angle <= FINAL_ANGLE_TOLERANCE
+            failed = failed or not ok
+            print("level {}  final pose error {:.3f} mm, {:.3f} deg  {}".format(
+                level, distance, angle, "ok" if ok else "FAILED"))
+        raise SystemExit(1 if failed else 0)
+    start = time.perf_counter()
+    drive, run, odometry = simulate_path(path_points, config, args.rate)
+    elapsed = time.perf_counter() - start
+
+    last = path_points[-1]
+    final = run.poses[-1, 0] if len(run) else drive.pose_degrees[0]
+    print("{} steps at {:g} Hz ({:.2f} s simulated) in {:.3f} s".format(len(run), args.rate, drive.time, elapsed))
+    print("final pose     x {:.1f}  y {:.1f}  angle {:.1f}".format(final[0], final[1], final[2] % 360.0))
+    print("last waypoint  x {:.1f}  y {:.1f}  angle {:.1f}".format(last[X], last[Y], last[ANGLE]))
+    if len(run):
+        error = np.hypot(*(odometry[:, 0, :2] - run.poses[:, 0, :2]).T)
+        print("odometry error max {:.3f} mm, final {:.3f} mm".format(error.max(), error[-1]))
+    if args.output:
+        np.savez(args.output, times=run.times, poses=run.poses[:, 0], ticks=run.ticks[:, 0],
+                 odometry=odometry[:, 0])
+        print("odometry stream written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""Offline export of a simulated run to a PNG sequence or a raw video stream.
+
+The run is drawn off-screen (SDL dummy video driver) with the viewer's own
+drawing code, new_sim.draw_map, at any simulation speed: the robot follows
+its path with the same fixed-rate physics as the viewer, and a frame is drawn
+every speed / fps seconds of simulated time. Frames are copied out of the
+drawing surface and handed to a worker thread through a bounded queue, so
+drawing and encoding overlap while the memory stays bounded.
+
+Raw output is packed RGB24, either written to a file or piped into an encoder
+command, e.g.:
+    python export.py path_points.json -o run.mp4 \\
+        --pipe "ffmpeg -y -f rawvideo -pix_fmt rgb24 -s {width}x{height} -r {fps} -i - {output}"
+    python export.py path_points.json -o frames/           # PNG sequence
+Raw frames cost about a millisecond each, PNG frames tens of milliseconds
+(zlib compression). Several paths are exported in parallel processes:
+    python export.py a.json b.json c.json --output-dir exports --workers 3
+"""
+import abc
+import argparse
+import os
+import queue
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+DEFAULT_FPS = 30
+# Frames waiting for the writer thread
+QUEUE_FRAMES = 32
+# Frames drawn after the end of the run, so the final pose stays visible (s)
+HOLD_TIME = 1.0
+
+
+class FrameWriter(abc.ABC):
+    """Base of the frame writers: frames are written by a worker thread.
+
+    write() copies the pixels of a surface and queues them, blocking while
+    the queue is full; subclasses implement write_frame(pixels) and finish().
+    """
+
+    def __init__(self, size, queue_size=QUEUE_FRAMES):
+        self.size = size
+        self.frames = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, surface):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(pygame.image.tobytes(surface, "RGB"))
+
+    def _run(self):
+        while True:
+            pixels = self.queue.get()
+            if pixels is None:
+                return
+            # After an error keep draining the queue so write() never blocks
+            if self.error is None:
+                try:
+                    self.write_frame(pixels)
+                    self.frames += 1
+                except Exception as error:
+                    self.error = error
+
+    def close(self):
+        """Wait for the queued frames and close the output."""
+        self.queue.put(None)
+        self.thread.join()
+        self.finish()
+        if self.error is not None:
+            raise self.error
+
+    @abc.abstractmethod
+    def write_frame(self, pixels):
+        """Write the RGB24 bytes of one frame; called by the worker thread."""
+
+    def finish(self):
+        pass
+
+
+class PngSequenceWriter(FrameWriter):
+    """Numbered PNG files frame_000000.png, frame_000001.png... in a directory."""
+
+    def __init__(self, directory, size, queue_size=QUEUE_FRAMES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        super().__init__(size, queue_size)
+
+    def write_frame(self, pixels):
+        filename = os.path.join(self.directory, "frame_{:06d}.png".format(self.frames))
+        pygame.image.save(pygame.image.frombytes(pixels, self.size, "RGB"), filename)
+
+
+class RawVideoWriter(FrameWriter):
+    """Packed RGB24 frames written to a file, or to the stdin of an encoder command.
+
+    The command is a format string with the fields width, height, fps and output.
+    """
+
+    def __init__(self, output, size, fps=DEFAULT_FPS, command=None, queue_size=QUEUE_FRAMES):
+        self.process = None
+        if command is not None:
+            arguments = shlex.split(command.format(width=size[0], height=size[1], fps=fps, output=output))
+            self.process = subprocess.Popen(arguments, stdin=subprocess.PIPE)
+            self.stream = self.process.stdin
+        else:
+            directory = os.path.dirname(output)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.stream = open(output, "wb")
+        super().__init__(size, queue_size)
+
+    def write_frame(self, pixels):
+        self.stream.write(pixels)
+
+    def finish(self):
+        try:
+            self.stream.close()
+        except BrokenPipeError as error:
+            self.error = self.error or error
+        if self.process is not None and self.process.wait() != 0 and self.error is None:
+            self.error = RuntimeError("encoder exited with status {}".format(self.process.returncode))
+
+
+def open_writer(output, size, fps=DEFAULT_FPS, pipe=None, queue_size=QUEUE_FRAMES):
+    """Frame writer for an output: a pipe command, a .rgb/.raw file or a PNG directory."""
+    if pipe is not None or os.path.splitext(output)[1].lower() in (".rgb", ".raw"):
+        return RawVideoWriter(output, size, fps, pipe, queue_size)
+    return PngSequenceWriter(output, size, queue_size)
+
+
+def export_run(path_points, output, fps=DEFAULT_FPS, speed=1.0, pipe=None, include_controls=False,
+               hold_time=HOLD_TIME, queue_size=QUEUE_FRAMES):
+    """Draw the run of a path off-screen and write it to output; returns the number of frames.
+
+    speed is the simulated time per second of video. Only the map is exported
+    unless include_controls is set.
+    """
+    import new_sim
+
+    if len(path_points) == 0:
+        raise ValueError("cannot export an empty path")
+    new_sim.create_widgets()
+    new_sim.set_path_points([list(point) for point in path_points])
+    robot = new_sim.robot
+    engine = robot.engine
+    engine.start()
+
+    surface = pygame.Surface((new_sim.WIDTH, new_sim.HEIGHT))
+    if include_controls:
+        # The buttons read the mouse position for their hover colour
+        pygame.display.init()
+        frame_surface = surface
+    else:
+        frame_surface = surface.subsurface(pygame.Rect(new_sim.table_frame.table_rect()))
+
+    frame_time = speed / fps
+    frames = int(engine.duration / frame_time) + 1 + int(round(hold_time * fps))
+    writer = open_writer(output, frame_surface.get_size(), fps, pipe, queue_size)
+    try:
+        steps_done = 0
+        for frame in range(frames):
+            # Physics steps up to the time of this frame
+            steps = int(round(frame * frame_time / engine.dt)) - steps_done
+            robot.update_movement(steps)
+            steps_done += steps
+
+            if include_controls:
+                surface.fill(new_sim.BACKGROUND_COLOR)
+                new_sim.draw_controls(0, 0, surface)
+            new_sim.draw_map(surface)
+            writer.write(frame_surface)
+    finally:
+        writer.close()
+    return frames
+
+
+def export_file(path, output, **options):
+    """Export the path saved in a file (.json or .rpth); returns (output, frames, seconds)."""
+    from pathfile import load_path
+
+    start = time.perf_counter()
+    frames = export_run(load_path(path), output, **options)
+    return output, frames, time.perf_counter() - start
+
+
+def export_batch(jobs, workers=None, **options):
+    """Export (path file, output) jobs in parallel processes; yields the results as they finish."""
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        for path, output in jobs:
+            yield export_file(path, output, **options)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(export_file, path, output, **options) for path, output in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export simulated runs to PNG sequences or raw video")
+    parser.add_argument("paths", nargs="*", default=["path_points.json"], help="path files (.json or .rpth)")
+    parser.add_argument("-o", "--output", help="output of a single path: PNG directory, .rgb file or pipe output")
+    parser.add_argument("--output-dir", default="exports", help="outputs of several paths, one per path")
+    parser.add_argument("--format", choices=("png", "raw"), default="png", help="format of the batch outputs")
+    parser.add_argument("--pipe", help="encoder command reading RGB24 frames on stdin, "
+                                       "with {width}, {height}, {fps} and {output} fields")
+    parser.add_argument("--fps", type=int, default=DEFAULT_FPS)
+    parser.add_argument("--speed", type=float, default=1.0, help="simulated seconds per video second")
+    parser.add_argument("--controls", action="store_true", help="include the control panel")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.output is not None:
+        if len(args.paths) > 1:
+            parser.error("--output takes a single path, use --output-dir for several")
+        jobs = [(args.paths[0], args.output)]
+    else:
+        extension = ".rgb" if args.format == "raw" else ""
+        jobs = [(path, os.path.join(args.output_dir, os.path.splitext(os.path.basename(path))[0] + extension))
+                for path in args.paths]
+
+    options = dict(fps=args.fps, speed=args.speed, pipe=args.pipe, include_controls=args.controls)
+    for output, frames, seconds in export_batch(jobs, args.workers, **options):
+        print("{}: {} frames in {:.2f} s ({:.0f} frames/s)".format(output, frames, seconds, frames / seconds))
+
+
+if __name__ == "__main__":
+    main()
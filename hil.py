@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""Hardware-in-the-loop bridge to the robot controller.
+
+The path is sent to the controller and its pose telemetry received over a
+framed binary protocol on any byte stream (TCP, or a serial port opened as an
+asyncio stream). Frames, little endian:
+    header   12 bytes: magic b"RB", version u8, kind u8, sequence u32,
+             payload length u32
+    payload  depends on the kind
+    crc      u32, zlib.crc32 of the header and the payload
+Kinds:
+    PATH        path_points as pathfile waypoint records (32 bytes each)
+    START       start or resume the uploaded path, no payload
+    STOP        stop the robot, no payload
+    ACK         sequence u32 of the acknowledged PATH, START or STOP frame
+    TELEMETRY   one or more TELEMETRY_DTYPE records (controller time s,
+                x mm, y mm, angle deg)
+
+RobotBridge runs the asyncio loop in a worker thread, so reading and parsing
+the telemetry never happens in the render loop. Parsed frames go through a
+bounded queue: when it is full the reader stops reading, and the transport's
+flow control slows the controller down instead of frames being dropped. Every
+sample is kept in a TelemetryLog; the viewer only asks it for the latest pose.
+
+LoopbackController stands in for the robot: it drives the uploaded path with
+the differential-drive model of drivetrain.py and streams the pose at the
+telemetry rate (1 kHz by default). Usage:
+    python hil.py --serve --port 5555                     # loopback controller
+    python hil.py path_points.json --connect localhost:5555
+    python hil.py path_points.json                        # both, in one process
+"""
+import argparse
+import asyncio
+import itertools
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from drivetrain import DriveConfig, simulate_path
+from motion_profile import X, Y, ANGLE, LINEAR_VELOCITY
+from pathfile import WAYPOINT_DTYPE, path_points_to_records, records_to_path_points
+
+MAGIC = b"RB"
+VERSION = 1
+HEADER = struct.Struct("<2sBBII")
+CRC = struct.Struct("<I")
+ACK_PAYLOAD = struct.Struct("<I")
+
+# Frame kinds
+MSG_PATH = 1
+MSG_START = 2
+MSG_STOP = 3
+MSG_ACK = 4
+MSG_TELEMETRY = 5
+
+# Largest payload accepted (bytes): a corrupted length must not allocate gigabytes
+MAX_PAYLOAD = 1 << 20
+
+TELEMETRY_DTYPE = np.dtype([("time", "<f8"), ("x", "<f8"), ("y", "<f8"), ("angle", "<f8")])
+
+DEFAULT_PORT = 5555
+DEFAULT_TELEMETRY_RATE = 1000.0     # Hz
+# Parsed frames waiting for the consumer
+QUEUE_FRAMES = 256
+# Time allowed for the controller to acknowledge a command (s)
+ACK_TIMEOUT = 2.0
+
+
+class ProtocolError(ValueError):
+    """A frame that is not valid: bad magic, version, length or checksum."""
+
+
+def encode_frame(kind, sequence, payload=b""):
+    header = HEADER.pack(MAGIC, VERSION, kind, sequence, len(payload))
+    return header + payload + CRC.pack(zlib.crc32(payload, zlib.crc32(header)))
+
+
+async def read_frame(reader):
+    """Read one frame from an asyncio.StreamReader; returns (kind, sequence, payload).
+
+    Raises asyncio.IncompleteReadError at the end of the stream.
+    """
+    header = await reader.readexactly(HEADER.size)
+    magic, version, kind, sequence, length = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError("not a bridge frame")
+    if version > VERSION:
+        raise ProtocolError("unsupported protocol version {}".format(version))
+    if length > MAX_PAYLOAD:
+        raise ProtocolError("frame payload of {} bytes".format(length))
+    payload = await reader.readexactly(length)
+    crc, = CRC.unpack(await reader.readexactly(CRC.size))
+    if crc != zlib.crc32(payload, zlib.crc32(header)):
+        raise ProtocolError("checksum mismatch in frame {}".format(sequence))
+    return kind, sequence, payload
+
+
+def encode_path(path_points):
+    return path_points_to_records(path_points).tobytes()
+
+
+def decode_path(payload):
+    if len(payload) % WAYPOINT_DTYPE.itemsize:
+        raise ProtocolError("path payload of {} bytes".format(len(payload)))
+    return records_to_path_points(np.frombuffer(payload, dtype=WAYPOINT_DTYPE))
+
+
+def decode_telemetry(payload):
+    if len(payload) % TELEMETRY_DTYPE.itemsize:
+        raise ProtocolError("telemetry payload of {} bytes".format(len(payload)))
+    return np.frombuffer(payload, dtype=TELEMETRY_DTYPE)
+
+
+def tcp_stream(host, port):
+    """Stream opener for RobotBridge: a TCP connection to the controller."""
+    return lambda: asyncio.open_connection(host, port)
+
+
+class TelemetryLog:
+    """Every telemetry sample received, in a growing array shared between threads."""
+
+    def __init__(self, capacity=1 << 16):
+        self.lock = threading.Lock()
+        self.records = np.zeros(capacity, dtype=TELEMETRY_DTYPE)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def extend(self, records):
+        with self.lock:
+            end = self.count + len(records)
+            if end > len(self.records):
+                grown = np.zeros(max(2 * len(self.records), end), dtype=TELEMETRY_DTYPE)
+                grown[:self.count] = self.records[:self.count]
+                self.records = grown
+            self.records[self.count:end] = records
+            self.count = end
+
+    def latest(self):
+        """(time, x, y, angle) of the last sample, or None."""
+        with self.lock:
+            if self.count == 0:
+                return None
+            return tuple(float(value) for value in self.records[self.count - 1].tolist())
+
+    def samples(self):
+        """Copy of all the samples so far."""
+        with self.lock:
+            return self.records[:self.count].copy()
+
+
+class RobotBridge:
+    """Connection to the robot controller, served by an asyncio loop in a worker thread.
+
+    open_stream is a coroutine function returning a (StreamReader,
+    StreamWriter) pair, e.g. tcp_stream(host, port), or for a serial port
+    lambda: serial_asyncio.open_serial_connection(url=port, baudrate=...).
+    The methods are called from the viewer's thread; the commands return a
+    concurrent.futures.Future resolved when the controller acknowledges them.
+    """
+
+    def __init__(self, open_stream, queue_size=QUEUE_FRAMES):
+        self.open_stream = open_stream
+        self.queue_size = queue_size
+        self.telemetry = TelemetryLog()
+        self.frames = 0             # telemetry frames received
+        self.error = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.connected = None       # concurrent.futures.Future of the connection
+        self.writer = None
+        self.sequence = itertools.count(1)
+        self.pending = {}           # sequence -> asyncio.Future of the ACK
+        self.tasks = []
+
+    def start(self):
+        """Start the worker thread and connect; returns the bridge."""
+        self.thread.start()
+        self.connected = asyncio.run_coroutine_threadsafe(self._connect(), self.loop)
+        return self
+
+    def run_in_loop(self, coroutine):
+        """Run a coroutine in the bridge loop (e.g. to host a LoopbackController); returns its future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def _connect(self):
+        reader, self.writer = await self.open_stream()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.tasks = [asyncio.ensure_future(self._read(reader, queue)),
+                      asyncio.ensure_future(self._consume(queue))]
+
+    async def _read(self, reader, queue):
+        try:
+            while True:
+                kind, sequence, payload = await read_frame(reader)
+                if kind == MSG_TELEMETRY:
+                    # Blocks while the queue is full: backpressure, not loss
+                    await queue.put(decode_telemetry(payload))
+                elif kind == MSG_ACK:
+                    acknowledged, = ACK_PAYLOAD.unpack(payload)
+                    future = self.pending.pop(acknowledged, None)
+                    if future is not None and not future.done():
+                        future.set_result(acknowledged)
+        except asyncio.IncompleteReadError:
+            pass
+        except Exception as error:
+            self.error = error
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("controller disconnected"))
+            self.pending.clear()
+
+    async def _consume(self, queue):
+        while True:
+            records = await queue.get()
+            self.telemetry.extend(records)
+            self.frames += 1
+
+    async def _send(self, kind, payload=b""):
+        if self.writer is None:
+            await asyncio.wrap_future(self.connected)
+        sequence = next(self.sequence)
+        acknowledged = self.loop.create_future()
+        self.pending[sequence] = acknowledged
+        try:
+            self.writer.write(encode_frame(kind, sequence, payload))
+            await self.writer.drain()
+            return await asyncio.wait_for(acknowledged, ACK_TIMEOUT)
+        finally:
+            self.pending.pop(sequence, None)
+
+    def send_path(self, path_points):
+        """Upload a path; the controller drives it from its current pose on START."""
+        return self.run_in_loop(self._send(MSG_PATH, encode_path(path_points)))
+
+    def start_run(self):
+        return self.run_in_loop(self._send(MSG_START))
+
+    def stop_run(self):
+        return self.run_in_loop(self._send(MSG_STOP))
+
+    def latest(self):
+        """(time, x, y, angle) reported last by the controller, or None."""
+        return self.telemetry.latest()
+
+    def close(self):
+        async def shutdown():
+            if self.writer is not None:
+                self.writer.close()
+            # The reader and consumer, and a hosted loopback controller's tasks
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self.thread.is_alive():
+            try:
+                self.run_in_loop(shutdown()).result(ACK_TIMEOUT)
+            finally:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self.thread.join()
+                self.loop.close()
+
+
+class LoopbackController:
+    """Stand-in for the robot controller, for testing the bridge without hardware.
+
+    The uploaded path is driven from the current pose with the
+    differential-drive model (drivetrain.simulate_path) and the pose is
+    streamed at rate Hz, one TELEMETRY frame per sample, whether the robot
+    moves or not. Writes wait for the transport to drain, so a slow reader
+    slows the stream down rather than losing samples.
+
+    PATH is acknowledged as soon as it is decoded, and the run is simulated
+    afterwards: a START received meanwhile makes the robot move as soon as
+    the run is ready.
+    """
+
+    def __init__(self, start_pose=(0.0, 0.0, 0.0), rate=DEFAULT_TELEMETRY_RATE, config=None):
+        self.pose = tuple(float(value) for value in start_pose)
+        self.rate = rate
+        self.config = config if config is not None else DriveConfig()
+        self.poses = None           # (K, 3) poses of the uploaded path, one per sample
+        self.index = 0
+        self.running = False        # START received, until STOP
+        self.uploading = None       # Task simulating the last uploaded path
+        self.server = None
+        self.port = None
+
+    async def serve(self, host="127.0.0.1", port=0):
+        """Listen for the bridge; port 0 picks a free port, stored in self.port."""
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    async def upload(self, path_points):
+        """Drive path_points from the current pose, like PathProfile.with_start.
+
+        The run is simulated in an executor thread, so the telemetry keeps
+        streaming (the robot standing still) while a long path is computed.
+        """
+        self.running = False
+        self.poses = None
+        if len(path_points) == 0:
+            return
+        approach = [self.pose[0], self.pose[1], self.pose[2], True] + list(path_points[0][LINEAR_VELOCITY:])
+        _, run, _ = await asyncio.get_running_loop().run_in_executor(
+            None, simulate_path, [approach] + list(path_points), self.config, self.rate)
+        self.poses = run.poses[:, 0]
+        self.index = 0
+
+    def advance(self, steps):
+        """Poses of the next steps samples, shape (steps, 3)."""
+        if not self.running or self.poses is None:
+            return np.tile(self.pose, (steps, 1))
+        end = self.index + steps
+        poses = self.poses[self.index:end]
+        if len(poses) < steps:
+            poses = np.concatenate([poses, np.tile(self.poses[-1], (steps - len(poses), 1))])
+        self.index = min(end, len(self.poses))
+        self.pose = tuple(poses[-1].tolist())
+        return poses
+
+    async def handle(self, reader, writer):
+        streaming = asyncio.ensure_future(self.stream(writer))
+        try:
+            while True:
+                kind, sequence, payload = await read_frame(reader)
+                if kind == MSG_PATH:
+                    path_points = decode_path(payload)
+                    if self.uploading is not None:
+                        self.uploading.cancel()
+                    self.uploading = asyncio.ensure_future(self.upload(path_points))
+                elif kind == MSG_START:
+                    self.running = True
+                elif kind == MSG_STOP:
+                    self.running = False
+                if kind in (MSG_PATH, MSG_START, MSG_STOP):
+                    writer.write(encode_frame(MSG_ACK, 0, ACK_PAYLOAD.pack(sequence)))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Returning normally also when cancelled: asyncio's stream callback
+            # reports a cancelled connection handler as an error
+            pass
+        finally:
+            streaming.cancel()
+            if self.uploading is not None:
+                self.uploading.cancel()
+            writer.close()
+
+    async def stream(self, writer):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        sent = 0
+        sequence = itertools.count(1)
+        period = 1.0 / self.rate
+        records = np.zeros(0, dtype=TELEMETRY_DTYPE)
+        while True:
+            # Send every sample due by now; sleeping is coarser than the period
+            due = int((loop.time() - start) * self.rate)
+            steps = due - sent
+            if steps > 0:
+                if len(records) < steps:
+                    records = np.zeros(steps, dtype=TELEMETRY_DTYPE)
+                batch = records[:steps]
+                batch["time"] = (sent + 1 + np.arange(steps)) * period
+                poses = self.advance(steps)
+                batch["x"], batch["y"], batch["angle"] = poses[:, 0], poses[:, 1], poses[:, 2]
+                writer.write(b"".join(encode_frame(MSG_TELEMETRY, next(sequence), record.tobytes())
+                                      for record in batch))
+                await writer.drain()
+                sent = due
+            await asyncio.sleep(period)
+
+
+def loopback_bridge(start_pose=(0.0, 0.0, 0.0), rate=DEFAULT_TELEMETRY_RATE, config=None):
+    """A started RobotBridge connected to a LoopbackController hosted in its own loop."""
+    controller = LoopbackController(start_pose, rate, config)
+
+    async def open_stream():
+        await controller.serve()
+        return await asyncio.open_connection("127.0.0.1", controller.port)
+
+    bridge = RobotBridge(open_stream).start()
+    bridge.controller = controller
+    return bridge
+
+
+def connect(address, start_pose=(0.0, 0.0, 0.0)):
+    """Started RobotBridge for "loopback" or "host:port"."""
+    if address == "loopback":
+        return loopback_bridge(start_pose)
+    host, _, port = address.rpartition(":")
+    return RobotBridge(tcp_stream(host or "localhost", int(port or DEFAULT_PORT))).start()
+
+
+def main():
+    from pathfile import load_path
+
+    parser = argparse.ArgumentParser(description="Send a path to the robot controller and receive its telemetry")
+    parser.add_argument("path", nargs="?", default="path_points.json", help="path file (.json or .rpth)")
+    parser.add_argument("--connect", default="loopback", help='"host:port" of the controller, or "loopback"')
+    parser.add_argument("--serve", action="store_true", help="run a loopback controller and wait for a bridge")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port of --serve")
+    parser.add_argument("--rate", type=float, default=DEFAULT_TELEMETRY_RATE, help="telemetry rate of --serve (Hz)")
+    parser.add_argument("--duration", type=float, help="seconds of telemetry to receive (default: until Ctrl+C)")
+    args = parser.parse_args()
+
+    if args.serve:
+        async def serve():
+            controller = LoopbackController(rate=args.rate)
+            server = await controller.serve("0.0.0.0", args.port)
+            print("loopback controller listening on port {}".format(controller.port))
+            async with server:
+                await server.serve_forever()
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    path_points = load_path(args.path)
+    if len(path_points) == 0:
+        parser.error("{} is an empty path".format(args.path))
+    first = path_points[0]
+    bridge = connect(args.connect, (first[X], first[Y], first[ANGLE]))
+    try:
+        bridge.connected.result(ACK_TIMEOUT)
+        bridge.send_path(path_points).result()
+        bridge.start_run().result()
+        start = time.perf_counter()
+        elapsed = 0.0
+        while args.duration is None or elapsed < args.duration:
+            time.sleep(0.5)
+            if bridge.error is not None:
+                raise bridge.error
+            elapsed = time.perf_counter() - start
+            pose = bridge.latest()
+            if pose is not None:
+                print("{:6.1f} s  {:7d} samples ({:6.0f}/s)  x {:7.1f}  y {:7.1f}  angle {:6.1f}".format(
+                    elapsed, len(bridge.telemetry), len(bridge.telemetry) / elapsed, pose[1], pose[2], pose[3] % 360.0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bridge.close()
+
+
+if __name__ == "__main__":
+    main()
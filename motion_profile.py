@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Motion profiles driven by the 4-level slider choices.
+
+Each waypoint stores a level (0-3) for linear velocity, angular velocity,
+linear acceleration and angular acceleration. This module maps those levels to
+physical limits and precomputes time-optimal trapezoidal profiles for every
+segment of a path, so following the path only needs a lookup per frame.
+"""
+import bisect
+import math
+
+# Slider level -> physical limit
+LINEAR_VELOCITY_LEVELS = (200.0, 400.0, 600.0, 800.0)        # mm/s
+ANGULAR_VELOCITY_LEVELS = (90.0, 180.0, 270.0, 360.0)        # deg/s
+LINEAR_ACCELERATION_LEVELS = (200.0, 400.0, 800.0, 1200.0)   # mm/s²
+ANGULAR_ACCELERATION_LEVELS = (180.0, 360.0, 720.0, 1080.0)  # deg/s²
+
+# Index of each field in a path_points waypoint
+X, Y, ANGLE, IS_FORWARD, LINEAR_VELOCITY, ANGULAR_VELOCITY, LINEAR_ACCELERATION, ANGULAR_ACCELERATION = range(8)
+
+
+def normalize_angle(angle):
+    """Wrap an angle in degrees to the range [-180, 180)."""
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+def _level(levels, choice):
+    return levels[min(max(int(choice), 0), len(levels) - 1)]
+
+
+def waypoint_limits(waypoint):
+    """Return (v_max, omega_max, a_max, alpha_max) for a waypoint's slider levels."""
+    return (_level(LINEAR_VELOCITY_LEVELS, waypoint[LINEAR_VELOCITY]),
+            _level(ANGULAR_VELOCITY_LEVELS, waypoint[ANGULAR_VELOCITY]),
+            _level(LINEAR_ACCELERATION_LEVELS, waypoint[LINEAR_ACCELERATION]),
+            _level(ANGULAR_ACCELERATION_LEVELS, waypoint[ANGULAR_ACCELERATION]))
+
+
+class TrapezoidProfile:
+    """Time-optimal rest-to-rest profile covering a signed distance.
+
+    Accelerates at max_acceleration up to max_velocity, cruises, then brakes.
+    Short moves that never reach max_velocity become a triangular profile.
+    """
+
+    def __init__(self, distance, max_velocity, max_acceleration):
+        self.distance = distance
+        self.sign = 1.0 if distance >= 0 else -1.0
+        length = abs(distance)
+        self.max_acceleration = max_acceleration
+
+        if length == 0:
+            self.peak_velocity = 0.0
+            self.accel_time = 0.0
+            self.cruise_time = 0.0
+        elif max_velocity * max_velocity / max_acceleration >= length:
+            # Triangular: braking starts before reaching max_velocity
+            self.peak_velocity = math.sqrt(length * max_acceleration)
+            self.accel_time = self.peak_velocity / max_acceleration
+            self.cruise_time = 0.0
+        else:
+            self.peak_velocity = max_velocity
+            self.accel_time = max_velocity / max_acceleration
+            self.cruise_time = (length - max_velocity * self.accel_time) / max_velocity
+
+        self.accel_distance = 0.5 * self.peak_velocity * self.accel_time
+        self.duration = 2 * self.accel_time + self.cruise_time
+
+    def sample(self, t):
+        """Return (position, velocity) at time t, both signed like the distance."""
+        if t <= 0:
+            return 0.0, 0.0
+        if t >= self.duration:
+            return self.distance, 0.0
+
+        a = self.max_acceleration
+        if t < self.accel_time:
+            position = 0.5 * a * t * t
+            velocity = a * t
+        elif t < self.accel_time + self.cruise_time:
+            position = self.accel_distance + self.peak_velocity * (t - self.accel_time)
+            velocity = self.peak_velocity
+        else:
+            remaining = self.duration - t
+            position = abs(self.distance) - 0.5 * a * remaining * remaining
+            velocity = a * remaining
+        return self.sign * position, self.sign * velocity
+
+
+class SegmentProfile:
+    """Motion from one pose to the next waypoint.
+
+    Translation and rotation run concurrently, each with its own trapezoid
+    built from the target waypoint's slider levels. The segment lasts until
+    both are finished.
+    """
+
+    def __init__(self, start_pose, waypoint):
+        self.start_x, self.start_y, self.start_angle = start_pose
+        self.end_x, self.end_y = waypoint[X], waypoint[Y]
+        self.end_angle = waypoint[ANGLE]
+
+        dx = self.end_x - self.start_x
+        dy = self.end_y - self.start_y
+        self.length = math.hypot(dx, dy)
+        self.direction = (dx / self.length, dy / self.length) if self.length > 0 else (0.0, 0.0)
+        self.rotation = normalize_angle(self.end_angle - self.start_angle)
+
+        v_max, omega_max, a_max, alpha_max = waypoint_limits(waypoint)
+        self.translation = TrapezoidProfile(self.length, v_max, a_max)
+        self.turn = TrapezoidProfile(self.rotation, omega_max, alpha_max)
+        self.duration = max(self.translation.duration, self.turn.duration)
+
+        # Sampled trajectory tables keyed by sample rate (filled by trajectory.py)
+        self.sample_cache = {}
+
+    def sample(self, t):
+        """Return (x, y, angle, v, omega) at time t since the segment start."""
+        if t >= self.duration:
+            return self.end_x, self.end_y, self.end_angle, 0.0, 0.0
+        distance, v = self.translation.sample(t)
+        rotation, omega = self.turn.sample(t)
+        return (self.start_x + self.direction[0] * distance,
+                self.start_y + self.direction[1] * distance,
+                self.start_angle + rotation,
+                v,
+                omega)
+
+
+class PathProfile:
+    """Precomputed profiles for every segment of a path.
+
+    Segments between consecutive waypoints are built once, when the path is
+    set. with_start() prepends the approach from the robot's current pose
+    without recomputing the rest of the path.
+    """
+
+    def __init__(self, path_points, segments=None):
+        self.path_points = path_points
+        if segments is None:
+            segments = [SegmentProfile(path_points[i][:3], path_points[i + 1])
+                        for i in range(len(path_points) - 1)]
+        self.segments = segments
+        self.start_times = []
+        self._update_start_times(0)
+
+    def _update_start_times(self, first):
+        """Recompute the start times of the segments from index first on, and the duration."""
+        del self.start_times[first:]
+        elapsed = self.start_times[-1] + self.segments[first - 1].duration if first > 0 else 0.0
+        for i in range(first, len(self.segments)):
+            self.start_times.append(elapsed)
+            elapsed += self.segments[i].duration
+        self.duration = elapsed
+
+    def splice(self, path_points, change):
+        """Follow a path_model.PathChange of the path of this profile, in place.
+
+        path_points is the path after the change. Only the segments whose ends
+        changed are rebuilt, and start times are only recomputed from the
+        first of them, so an edit at the end of the path costs as much as the
+        segments it touches.
+        """
+        first = change.first_segment
+        self.path_points = path_points
+        self.segments[first:change.old_segment_stop] = [SegmentProfile(path_points[i][:3], path_points[i + 1])
+                                                        for i in range(first, change.segment_stop)]
+        self._update_start_times(first)
+
+    def with_start(self, start_pose):
+        """Return a profile that first drives from start_pose to the first waypoint."""
+        if len(self.path_points) == 0:
+            return self
+        approach = SegmentProfile(start_pose, self.path_points[0])
+        return PathProfile(self.path_points, [approach] + self.segments)
+
+    def segment_index(self, t):
+        """Index of the segment active at time t."""
+        return max(bisect.bisect_right(self.start_times, t) - 1, 0)
+
+    def sample(self, t):
+        """Return (x, y, angle, v, omega) at time t since the start of the path."""
+        if len(self.segments) == 0:
+            if len(self.path_points) == 0:
+                return None
+            waypoint = self.path_points[-1]
+            return waypoint[X], waypoint[Y], waypoint[ANGLE], 0.0, 0.0
+        index = self.segment_index(t)
+        return self.segments[index].sample(t - self.start_times[index])
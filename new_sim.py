@@ -1,7 +1,23 @@
 #!/usr/bin/env python3
 import pygame
+import argparse
 import math
-import json
+import os
+import time
+
+from assets import load_scaled_image, png_size
+from dispatcher import EventDispatcher, coalesce_motion
+from occupancy import OccupancyGrid
+from path_model import PathModel
+from pathfile import load_path, save_binary, write_json_stream
+from planner import Planner
+from profiling import FrameProfiler, ProfilerHUD
+from recording import Recorder, session_filename
+from render_cache import RotatedSpriteCache, TextCache
+from renderer import LayeredRenderer, PathOverlay, PoseMarker, draw_arrow
+from simulation import SimulationClock, SimulationEngine, TIME_SCALES
+from table_frame import TableFrame
+
 # Constants
 WIDTH, HEIGHT = 1080, 720  # Total screen size (split into controls + map)
 CONTROL_WIDTH = 300        # Width of the control section
@@ -12,15 +28,19 @@ SLIDER_COLOR = (100, 100, 250)
 SLIDER_BAR_COLOR = (180, 180, 180)
 TOGGLE_ON_COLOR = (0, 255, 0)  # Green color for ON state
 TOGGLE_OFF_COLOR = (255, 0, 0)  # Red color for OFF state
+COLLISION_COLOR = (220, 0, 0)  # Path segments that hit an obstacle
+IDLE_WAIT_MS = 100  # Longest sleep between frames when nothing changes
 
-# Global variable to store path points
+# Global variable to store path points: the live list of path_model, edited through it
+path_model = None
 path_points = []
 
-# Load the map image
-map_image = pygame.image.load('ensi_map.png')
-# Scale the map image to fit the map area
-# Get the original dimensions of the image
-map_original_width, map_original_height = map_image.get_size()
+MAP_IMAGE = 'ensi_map.png'
+ROBOT_IMAGE = 'my_robot.png'
+
+# The layout only needs the image sizes, read from the PNG headers: the images
+# themselves are loaded by load_assets() when the viewer starts
+map_original_width, map_original_height = png_size(MAP_IMAGE)
 
 # Determine the maximum allowed size for the map image (MAP_WIDTH x HEIGHT)
 max_map_width = MAP_WIDTH
@@ -33,33 +53,81 @@ scale_px_to_mm=1800/MAP_WIDTH
 new_map_width = int(map_original_width * scale_factor)
 new_map_height = int(map_original_height * scale_factor)
 
-# Scale the map image
-scaled_map_image = pygame.transform.scale(map_image, (new_map_width, new_map_height))
-
 # Calculate the position to center the image within the map area
 map_x = CONTROL_WIDTH + (max_map_width - new_map_width) // 2  # Center horizontally within map area
 map_y = (max_map_height - new_map_height) // 2  # Center vertically within map area
 
-# Load the robot image
-robot_image = pygame.image.load('my_robot.png')
+# Table millimetres <-> screen pixels over the map image
+table_frame = TableFrame((map_x, map_y, new_map_width, new_map_height))
 
 # Get the original dimensions of the robot image
-robot_original_width, robot_original_height = robot_image.get_size()
+robot_original_width, robot_original_height = png_size(ROBOT_IMAGE)
 
 # Scale the robot image using a much smaller scale factor for better proportions
 robot_scale_factor = scale_factor * 0.1  # Make robot 10% of original scaled size
 new_robot_width = int(robot_original_width * robot_scale_factor)
 new_robot_height = int(robot_original_height * robot_scale_factor)
 
-# Scale the robot image
-scaled_robot_image = pygame.transform.scale(robot_image, (new_robot_width, new_robot_height))
-path_points = []
-
-# Initialize Pygame
-pygame.init()
-screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.FULLSCREEN)
-pygame.display.set_caption("Robot Path Simulation with Controls")
-font = pygame.font.Font(None, 30)
+# Robot footprint in mm (width along x, length along y at angle 0)
+robot_width_mm = new_robot_width / table_frame.px_per_mm[0]
+robot_length_mm = new_robot_height / table_frame.px_per_mm[1]
+
+# Indices i of the segments (path_points[i] -> path_points[i+1]) that hit an obstacle
+colliding_segments = set()
+
+# Assets, set by load_assets()
+scaled_map_image = None
+scaled_robot_image = None
+robot_sprites = None    # Rotated versions of the robot sprite, rendered on first use
+occupancy_grid = None   # Occupancy grid of the table, for collision checks of the path segments
+planner = None          # Planner around the obstacles
+font = None
+
+# The window, opened by open_window()
+screen = None
+
+# Rendered labels, reused until their text changes
+text_cache = TextCache()
+
+# Per-stage frame timers, shown by the profiling HUD (F3)
+profiler = FrameProfiler()
+
+# Connection to the robot controller (hil.RobotBridge), opened by main() with --robot
+bridge = None
+
+def load_assets():
+    """Load the images, the occupancy grid and the font, once."""
+    global scaled_map_image, scaled_robot_image, robot_sprites, occupancy_grid, planner, font
+    if scaled_map_image is not None:
+        return
+    pygame.font.init()
+    font = pygame.font.Font(None, 30)
+
+    # Scaled images, from the disk cache after the first run
+    map_image = load_scaled_image(MAP_IMAGE, (new_map_width, new_map_height))
+    # The map is always drawn over the background: flatten it once, opaque surfaces blit much faster
+    scaled_map_image = pygame.Surface(map_image.get_size())
+    scaled_map_image.fill(BACKGROUND_COLOR)
+    scaled_map_image.blit(map_image, (0, 0))
+    scaled_robot_image = load_scaled_image(ROBOT_IMAGE, (new_robot_width, new_robot_height))
+    robot_sprites = RotatedSpriteCache(scaled_robot_image)
+
+    occupancy_grid = OccupancyGrid.load(MAP_IMAGE)
+    # Search with the inscribed radius, the oriented footprint checks every segment
+    planner = Planner(occupancy_grid, clearance_mm=min(robot_width_mm, robot_length_mm) / 2,
+                      footprint=(robot_width_mm, robot_length_mm))
+
+def open_window():
+    """Open the fullscreen viewer window; only the display and font subsystems are initialised."""
+    global screen
+    pygame.display.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.FULLSCREEN)
+    pygame.display.set_caption("Robot Path Simulation with Controls")
+    return screen
+
+def render_text(text, color=BLACK):
+    """Render a label with the UI font, through the text cache."""
+    return text_cache.render(font, text, color)
 
 class Slider4State:
     def __init__(self, x, y, w, num_states=4, initial_state=0, title="Slider Title"):
@@ -69,10 +137,12 @@ class Slider4State:
         self.state_positions = [x + (w / (num_states - 1)) * i for i in range(num_states)]
         self.knob_pos = self.state_positions[self.state]
         self.title = title
+        # Area of the state knobs, for the event dispatcher
+        self.hit_rect = self.rect.inflate(30, 30)
 
     def draw(self, surface):
         # Draw the slider title above the slider
-        title_surface = font.render(self.title, True, BLACK)
+        title_surface = render_text(self.title)
         surface.blit(title_surface, (self.rect.x, self.rect.y - 30))  # Position the title above the slider
 
         # Draw the slider bar
@@ -83,16 +153,27 @@ class Slider4State:
 
         # Optional: Draw state labels below the slider
         for i, pos in enumerate(self.state_positions):
-            label = font.render(str(i), True, BLACK)
+            label = render_text(str(i))
             surface.blit(label, (pos - 5, self.rect.centery + 15))
 
+    def nearest_state(self, pos):
+        """State whose knob position is within 15 px of pos, or None."""
+        spacing = self.state_positions[1] - self.state_positions[0]
+        i = min(max(int(round((pos[0] - self.rect.x) / spacing)), 0), self.num_states - 1)
+        if math.hypot(pos[0] - self.state_positions[i], pos[1] - self.rect.centery) < 15:
+            return i
+        return None
+
+    def hit_test(self, pos):
+        return self.nearest_state(pos) is not None
+
     def handle_event(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN:
             # Check if click is near one of the state positions
-            for i, pos in enumerate(self.state_positions):
-                if math.sqrt((event.pos[0] - pos)**2 +(event.pos[1]-self.rect.centery)**2) < 15:
-                    self.state = i
-                    self.knob_pos = pos
+            i = self.nearest_state(event.pos)
+            if i is not None:
+                self.state = i
+                self.knob_pos = self.state_positions[i]
 
 class InputBox:
     def __init__(self, x, y, w, title="Input Box"):
@@ -102,21 +183,17 @@ class InputBox:
         self.title = title
         self.active = False
 
+    def set_focus(self, focused):
+        """Called by the event dispatcher when the box gains or loses the keyboard focus."""
+        self.active = focused
+        self.color = (0, 0, 255) if self.active else BLACK
+
     def handle_event(self, event):
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            if self.rect.collidepoint(event.pos):
-                self.active = not self.active
-            else:
-                self.active = False
-            self.color = (0, 0, 255) if self.active else BLACK
-        
         if event.type == pygame.KEYDOWN:
             if self.active:
                 if event.key == pygame.K_RETURN:
                     self.set_text(self.text)
-                    self.active=not self.active
-                    self.color = (0, 0, 255) if self.active else BLACK
-                    return True
+                    return True  # Entry committed, the dispatcher releases the focus
                 elif event.key == pygame.K_BACKSPACE:
                     self.text = self.text[:-1]
                 else:
@@ -125,11 +202,11 @@ class InputBox:
     def draw(self, surface):
         # Draw the input box and the title
         pygame.draw.rect(surface, self.color, self.rect, 2)
-        title_surface = font.render(self.title, True, BLACK)
+        title_surface = render_text(self.title)
         surface.blit(title_surface, (self.rect.x, self.rect.y - 20))
         
         # Draw the text
-        text_surface = font.render(self.text, True, BLACK)
+        text_surface = render_text(self.text)
         surface.blit(text_surface, (self.rect.x + 5, self.rect.y + 5))
 
     def set_text(self, new_text):
@@ -151,14 +228,13 @@ class ToggleSwitch:
         pygame.draw.circle(surface, BLACK, (switch_x + 15, self.rect.centery), 15)
 
         # Draw the title above the toggle
-        title_surface = font.render(self.title, True, BLACK)
+        title_surface = render_text(self.title)
         surface.blit(title_surface, (self.rect.x-150, self.rect.y))
 
     def handle_event(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN:
-            if self.rect.collidepoint(event.pos):
-                self.state = not self.state  # Toggle the state
-                robot.update_isForward()
+            self.state = not self.state  # Toggle the state
+            robot.update_isForward()
 
 class Button:
     def __init__(self, x, y, w, h, title):
@@ -173,12 +249,12 @@ class Button:
         pygame.draw.rect(surface, current_color, self.rect)
         
         # Draw the button title
-        title_surface = font.render(self.title, True, BLACK)
+        title_surface = render_text(self.title)
         title_rect = title_surface.get_rect(center=self.rect.center)
         surface.blit(title_surface, title_rect)
 
     def handle_event(self, event):
-        if event.type == pygame.MOUSEBUTTONDOWN and self.rect.collidepoint(event.pos):
+        if event.type == pygame.MOUSEBUTTONDOWN:
             self.clicked=True
             return True  # Indicate that the button was clicked
         return False
@@ -191,28 +267,20 @@ class Robot:
         self.robot_image=scaled_robot_image
         self.isForward=True
         self.is_dragging=False
+        # Screen pose last mirrored from the engine, to tell whether the user moved the robot since
+        self.synced_pose = None
         
-        # Movement control variables
-        self.is_moving = False
-        self.current_waypoint_index = 0
-        self.target_x = x
-        self.target_y = y
-        self.target_angle = 0
-        self.movement_speed = 2.0  # pixels per frame
-        self.rotation_speed = 3.0  # degrees per frame
+        # Headless engine that owns the kinematic state during path following
+        self.engine = SimulationEngine()
 
     def draw(self, surface:pygame.Surface):
         # Adjust the robot's position to the scaled map
         adjusted_x = self.x
         adjusted_y = self.y
         
-        rotated_robot_image=pygame.transform.rotate(scaled_robot_image, self.angle)
+        # Pre-rendered rotation of the robot sprite for the current angle
+        self.robot_image=robot_sprites.get(self.angle).surface
 
-        self.robot_image=rotated_robot_image
-
-        robot_edge_center_x, robot_edge_center_y=self.get_robot_edge_center()
-        # robot_x_projection=self.new_robot_diameter*math.cos(math.radians(self.angle)-math.atan2(new_robot_height,new_robot_width))
-        # robot_y_projection=self.new_robot_diameter*math.sin(math.radians(self.angle)+math.atan2(new_robot_height,new_robot_width))
         robot_center_x, robot_center_y=self.get_robot_center()
 
         # Draw the scaled robot image at the adjusted position
@@ -221,29 +289,12 @@ class Robot:
 
     def draw_arrows(self, surface):
         if len(path_points) > 1:
-            for i in range(len(path_points) - 1):
-                start = path_points[i][0:2]
-                end =  path_points[i+1][0:2]
-                
-                self.draw_arrow(surface, start, end)
-
-    def draw_arrow(self, surface, start, end):
-        start[0], start[1]=get_px_coordinates(start[0],start[1])
-        end[0], end[1]=get_px_coordinates(end[0],end[1])
-
-        # Calculate angle and draw arrow
-        pygame.draw.line(surface, BLACK, start, end, 3)  # Draw line
-        # Arrowhead drawing code
-        arrow_size = 10
-        angle = math.atan2(end[1] - start[1], end[0] - start[0])
-        arrow_start = end
-        pygame.draw.polygon(surface, BLACK, [
-            (arrow_start[0], arrow_start[1]),
-            (arrow_start[0] - arrow_size * math.cos(angle - 0.5), arrow_start[1] - arrow_size * math.sin(angle - 0.5)),
-            (arrow_start[0] - arrow_size * math.cos(angle + 0.5), arrow_start[1] - arrow_size * math.sin(angle + 0.5))
-        ])
-        
-    
+            # Screen positions of all the waypoints in one transform
+            points = table_frame.mm_to_px([point[0:2] for point in path_points]).tolist()
+            for i in range(len(points) - 1):
+                color = COLLISION_COLOR if i in colliding_segments else BLACK
+                draw_arrow(surface, points[i], points[i + 1], color)
+
     def update_position (self, new_x, new_y):
         self.x=new_x
         self.y=new_y
@@ -251,124 +302,141 @@ class Robot:
     def update_angle (self,new_angle):
         self.angle=new_angle
 
-    def rotate(self, angular_velocity, angular_acceleration):
-        pass
-        
-
     def update_isForward(self):
             self.angle=self.angle+180
     
     def start_path_following(self):
-        """Start following the planned path"""
-        if len(path_points) > 0:
-            self.is_moving = True
-            self.current_waypoint_index = 0
-            self.set_next_target()
+        """Start following the planned path, or resume a paused run"""
+        if self.engine.trajectory is not None and not self.engine.is_complete:
+            self.engine.resume()
+            send_to_robot(lambda: bridge.start_run())
+        elif len(path_points) > 0:
+            # The drawn pose is interpolated between physics steps: restart from
+            # the engine state unless the user has moved the robot since
+            if (self.x, self.y, self.angle) != self.synced_pose:
+                x_mm, y_mm = get_mm_coordinates(self.x, self.y)
+                self.engine.set_pose(x_mm, y_mm, self.angle)
+            self.engine.start()
+            # The real robot drives the same path from where it is
+            send_to_robot(lambda: bridge.send_path(path_points))
+            send_to_robot(lambda: bridge.start_run())
     
     def stop_movement(self):
         """Stop robot movement"""
-        self.is_moving = False
+        self.engine.pause()
+        send_to_robot(lambda: bridge.stop_run())
     
     def reset_to_start(self):
         """Reset robot to starting position"""
-        self.is_moving = False
-        self.current_waypoint_index = 0
+        self.engine.reset()
         if len(path_points) > 0:
-            start_point = path_points[0]
-            start_x, start_y = get_px_coordinates(start_point[0], start_point[1])
-            self.update_position(start_x, start_y)
-            self.update_angle(start_point[2])
+            self.sync_from_engine()
     
-    def set_next_target(self):
-        """Set the next waypoint as target"""
-        if self.current_waypoint_index < len(path_points):
-            waypoint = path_points[self.current_waypoint_index]
-            self.target_x, self.target_y = get_px_coordinates(waypoint[0], waypoint[1])
-            self.target_angle = waypoint[2]
+    def seek(self, t):
+        """Jump to time t (s) of the run"""
+        self.engine.seek(t)
+        self.sync_from_engine()
     
-    def update_movement(self):
-        """Update robot position during automatic movement"""
-        if not self.is_moving or len(path_points) == 0:
+    def sync_from_engine(self, alpha=1.0):
+        """Mirror the engine state (mm) into screen coordinates, alpha of the way from the previous step"""
+        state = self.engine.interpolated_state(alpha)
+        self.update_position(*get_px_coordinates(state.x, state.y))
+        self.update_angle(state.angle)
+        self.synced_pose = (self.x, self.y, self.angle)
+    
+    def update_movement(self, steps=1, alpha=1.0):
+        """Run up to steps physics steps of automatic movement"""
+        if not self.engine.is_moving:
             return
         
-        # Calculate distance to target
-        dx = self.target_x - self.x
-        dy = self.target_y - self.y
-        distance = math.sqrt(dx*dx + dy*dy)
-        
-        # Calculate angle difference
-        angle_diff = self.target_angle - self.angle
-        while angle_diff > 180:
-            angle_diff -= 360
-        while angle_diff < -180:
-            angle_diff += 360
-        
-        # Move towards target position
-        if distance > self.movement_speed:
-            # Normalize movement vector
-            move_x = (dx / distance) * self.movement_speed
-            move_y = (dy / distance) * self.movement_speed
-            self.update_position(self.x + move_x, self.y + move_y)
+        for _ in range(steps):
+            self.engine.step()
+            if not self.engine.is_moving:
+                break
+        if self.engine.is_complete:
+            self.sync_from_engine()
+            print("Path following completed!")
         else:
-            # Reached position target
-            self.update_position(self.target_x, self.target_y)
-        
-        # Rotate towards target angle
-        if abs(angle_diff) > self.rotation_speed:
-            if angle_diff > 0:
-                self.update_angle(self.angle + self.rotation_speed)
-            else:
-                self.update_angle(self.angle - self.rotation_speed)
-        else:
-            # Reached angle target
-            self.update_angle(self.target_angle)
-        
-        # Check if waypoint is reached
-        if distance <= self.movement_speed and abs(angle_diff) <= self.rotation_speed:
-            self.current_waypoint_index += 1
-            if self.current_waypoint_index < len(path_points):
-                self.set_next_target()
-            else:
-                # Path completed
-                self.is_moving = False
-                print("Path following completed!")
+            self.sync_from_engine(alpha)
 
 
+    def get_rect(self):
+        """Screen area covered by the robot sprite"""
+        sprite = robot_sprites.get(self.angle)
+        # One pixel margin covers the rounding of the blit position
+        return sprite.surface.get_rect(center=(int(self.x), int(self.y))).inflate(2, 2)
+    
+    def get_draw_key(self):
+        """Changes whenever the robot must be drawn again"""
+        return (self.x, self.y, robot_sprites.bucket(self.angle))
+    
     def get_robot_center(self):
-        bounding_rect=self.robot_image.get_rect()
-        robot_center_x,robot_center_y=bounding_rect.center
-
-        return robot_center_x,robot_center_y
+        return robot_sprites.get(self.angle).center
     
     def get_robot_edge_center(self):
-        
-        bounding_rect=self.robot_image.get_rect()
-        robot_center_x,robot_center_y=bounding_rect.center
-        
-        robot_edge_center_x=robot_center_x+(new_robot_height//2)*math.sin(math.radians(self.angle))
-        robot_edge_center_y=robot_center_y+(new_robot_height//2)*math.cos(math.radians(self.angle))
-        
-        return robot_edge_center_x,robot_edge_center_y
+        return robot_sprites.get(self.angle).edge_center
     
     
+    def hit_test(self, pos):
+        mouse_x, mouse_y = pos
+        robot_center_x, robot_center_y=self.get_robot_center()
+        distance = math.hypot(mouse_x - (-robot_center_x+self.x), mouse_y - (-robot_center_y+self.y))
+        return distance <= math.hypot(new_robot_height,new_robot_width)  # Click inside the robot
+
+    def move_to_target(self, pos):
+        """Move the robot to a screen position and make it the target in the input boxes"""
+        mouse_x, mouse_y = pos
+        self.update_position(mouse_x, mouse_y)
+        robot_x_mm, robot_y_mm=get_mm_coordinates(mouse_x,mouse_y)
+        target_x_box.set_text(str(round(robot_x_mm,3)))
+        target_y_box.set_text(str(round(robot_y_mm,3)))
+
     def handle_event(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN:
-            mouse_x, mouse_y = event.pos
-            robot_center_x, robot_center_y=self.get_robot_center()
-            distance = math.hypot(mouse_x - (-robot_center_x+self.x), mouse_y - (-robot_center_y+self.y))
-            if distance <= math.hypot(new_robot_height,new_robot_width):  # Click inside the robot
-                self.is_dragging = True
+            self.is_dragging = True
+            self.move_to_target(event.pos)
 
         elif event.type == pygame.MOUSEBUTTONUP:
             self.is_dragging = False
 
         elif event.type == pygame.MOUSEMOTION and self.is_dragging:
-            mouse_x, mouse_y = event.pos
-            self.update_position(mouse_x, mouse_y)
-            robot_x_mm, robot_y_mm=get_mm_coordinates(mouse_x,mouse_y)
-            target_x_box.set_text(str(round(robot_x_mm,3)))
-            target_y_box.set_text(str(round(robot_y_mm,3)))
+            self.move_to_target(event.pos)
+
+
+class TimelineBar:
+    def __init__(self, x, y, w):
+        self.rect = pygame.Rect(x, y, w, 10)
+        self.hit_rect = self.rect.inflate(0, 20)  # The bar and the knob
+        self.is_dragging = False
+
+    def draw(self, surface):
+        # Draw the timeline bar
+        pygame.draw.rect(surface, SLIDER_BAR_COLOR, self.rect)
+
+        # Draw the knob at the current run time
+        duration = robot.engine.duration
+        ratio = robot.engine.time / duration if duration > 0 else 0
+        knob_x = self.rect.x + ratio * self.rect.w
+        pygame.draw.circle(surface, SLIDER_COLOR, (int(knob_x), self.rect.centery), 8)
+
+        # Display the current time next to the bar
+        time_text = render_text("{:.1f}/{:.1f}s".format(robot.engine.time, duration))
+        surface.blit(time_text, (self.rect.right + 10, self.rect.y - 5))
+
+    def seek(self, mouse_x):
+        ratio = min(max((mouse_x - self.rect.x) / self.rect.w, 0), 1)
+        robot.seek(ratio * robot.engine.duration)
+
+    def handle_event(self, event):
+        if event.type == pygame.MOUSEBUTTONDOWN:  # Click on the bar or knob
+            self.is_dragging = True
+            self.seek(event.pos[0])
 
+        elif event.type == pygame.MOUSEBUTTONUP:
+            self.is_dragging = False
+
+        elif event.type == pygame.MOUSEMOTION and self.is_dragging:
+            self.seek(event.pos[0])
 
 class AngleWheel:
     def __init__(self, x, y, radius):
@@ -378,6 +446,8 @@ class AngleWheel:
         self.knob_radius = 10  # Small circle for the knob
         self.is_dragging = False
         self.angle = 0  # Initial angle
+        self.rect = pygame.Rect(0, 0, 2 * (radius + 10), 2 * (radius + 10))
+        self.rect.center = (x, y)
 
 
     def draw(self, surface):
@@ -390,19 +460,21 @@ class AngleWheel:
         pygame.draw.circle(surface, (255, 0, 0), (knob_x, knob_y), self.knob_radius)
 
         # Display the current angle as text
-        angle_text = font.render(f"Angle: {int(self.angle)}°", True, BLACK)
+        angle_text = render_text(f"Angle: {int(self.angle)}°")
         surface.blit(angle_text, (self.x - 40, self.y + self.radius + 20))
 
     def set_angle(self, angle):
         self.angle=angle
         robot.update_angle(self.angle)
 
+    def hit_test(self, pos):
+        mouse_x, mouse_y = pos
+        distance = math.hypot(mouse_x - self.x, mouse_y - self.y)
+        return distance <= self.radius+10  # Click inside the wheel
+
     def handle_event(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN:
-            mouse_x, mouse_y = event.pos
-            distance = math.hypot(mouse_x - self.x, mouse_y - self.y)
-            if distance <= self.radius+10:  # Click inside the wheel
-                self.is_dragging = True
+            self.is_dragging = True
 
         elif event.type == pygame.MOUSEBUTTONUP:
             self.is_dragging = False
@@ -412,116 +484,189 @@ class AngleWheel:
             rel_x, rel_y = mouse_x - self.x, mouse_y - self.y
             self.set_angle((math.degrees(math.atan2(-rel_y, rel_x)) + 360) % 360)
 
+class MapArea:
+    def __init__(self, frame):
+        self.frame = frame
+        self.rect = pygame.Rect(frame.viewport)
+
+    def hit_test(self, pos):
+        return self.frame.contains_px(*pos)
+
+    def handle_event(self, event):
+        # Clicking on the map sets the target point
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            robot.move_to_target(event.pos)
+
+def add_path_point(point):
+    """Append a waypoint, as one undoable edit."""
+    path_model.append(point)
+
+def on_path_changed(model, change):
+    """Update what is derived from the path, only around the waypoints that changed."""
+    points = model.points
+    first, old_stop, new_stop = change.first_segment, change.old_segment_stop, change.segment_stop
+    # Collision flags: keep the ones outside the change, shifted, and check the new segments
+    kept = {i if i < first else i + change.shift for i in colliding_segments if i < first or i >= old_stop}
+    for i in range(first, new_stop):
+        if occupancy_grid.segment_collides(points[i][0:3], points[i + 1], robot_width_mm, robot_length_mm):
+            kept.add(i)
+            if not change.replaces_all:
+                print("Warning: segment {} hits an obstacle".format(i))
+    colliding_segments.clear()
+    colliding_segments.update(kept)
+
+    colors = [COLLISION_COLOR if i in colliding_segments else BLACK for i in range(first, new_stop)]
+    if change.replaces_all:
+        path_overlay.rebuild(points, colors)
+    else:
+        # Draw only the changed segments into the cached path overlay
+        path_overlay.splice(points, change, colors)
+    # Rebuild only the motion profiles of the changed segments
+    robot.engine.splice_path(points, change)
+
 def save_path():
     """Function to save the path points to a file."""
     if path_points:
-        with open('path_points.json', 'w') as f:
-            json.dump(path_points, f, indent=4)
+        # JSON for reading and editing, binary for fast loading
+        write_json_stream('path_points.json', path_points)
+        save_binary('path_points.rpth', path_points)
         print("Path points saved!")
     else:
         print("No points to save.")
 
-def get_mm_coordinates(mouse_x, mouse_y):
-    if mouse_x<map_x:
-        x_mm_coordinates=0
-    else:
-        x_mm_coordinates=(min((abs((mouse_x-map_x)/new_map_width)*1800),1800))
-
-    if mouse_y>map_y+new_map_height:
-        y_mm_coordinates=0
-    else:
-        y_mm_coordinates=(min(abs(((mouse_y-map_y)/new_map_height*1200)-1200),1200))
+def load_saved_path():
+    """Load the saved path, from the binary file when there is one."""
+    for filename in ('path_points.rpth', 'path_points.json'):
+        if os.path.exists(filename):
+            set_path_points(load_path(filename))
+            print("Path points loaded from {}".format(filename))
+            return
+    print("No saved path.")
+
+def set_path_points(points):
+    """Replace the whole path, as one undoable edit, and put the robot on its start."""
+    path_model.replace(points)
+    robot.reset_to_start()
+
+def send_to_robot(command):
+    """Run a bridge command when a controller is connected, reporting failures without waiting."""
+    if bridge is None:
+        return
+    def report(future):
+        if future.exception() is not None:
+            print("Robot controller: {}".format(future.exception()))
+    command().add_done_callback(report)
 
-    return x_mm_coordinates,y_mm_coordinates
+def get_mm_coordinates(mouse_x, mouse_y):
+    """Table point (mm) under a screen position, clamped to the table."""
+    return table_frame.point_to_mm(mouse_x, mouse_y)
 
 def get_px_coordinates(x_mm_coordinates, y_mm_coordinates):
-    x_px_coordinates=(x_mm_coordinates/1800)*new_map_width+map_x
-    y_px_coordinates=(abs(1200-y_mm_coordinates)/1200)*new_map_height+map_y
+    """Screen position of a table point (mm)."""
+    return table_frame.point_to_px(x_mm_coordinates, y_mm_coordinates)
 
-    return x_px_coordinates,y_px_coordinates
+# Path arrows, drawn incrementally into an off-screen surface (created by create_widgets())
+path_overlay = None
 
 
-def draw_controls(mouse_x, mouse_y):
+def draw_controls(mouse_x, mouse_y, surface=None):
     """Draw the UI controls on the left side."""
+    if surface is None:
+        surface = screen
     # Set control section background
-    pygame.draw.rect(screen, (240, 240, 240), pygame.Rect(0, 0, CONTROL_WIDTH, HEIGHT))
+    pygame.draw.rect(surface, (240, 240, 240), pygame.Rect(0, 0, CONTROL_WIDTH, HEIGHT))
 
     # Draw UI elements like sliders, buttons, etc.
-    slider1.draw(screen)
-    slider2.draw(screen)
-    slider3.draw(screen)
-    slider4.draw(screen)
+    slider1.draw(surface)
+    slider2.draw(surface)
+    slider3.draw(surface)
+    slider4.draw(surface)
 
     # Draw the toggle for "Is it forward?"
-    toggle.draw(screen)
+    toggle.draw(surface)
 
     # Display current mouse coordinates
 
     x_mm_coordinates,y_mm_coordinates=get_mm_coordinates(mouse_x,mouse_y)
     #coord_text = font.render(f"Mouse X: {(mouse_x-300)*scale_px_to_mm}, Y: {(mouse_y-map_y)*scale_px_to_mm}", True, BLACK)
-    coord_text = font.render("Mouse X: {:.2f},       Y: {:.2f}".format(x_mm_coordinates,y_mm_coordinates),True,BLACK)
-    screen.blit(coord_text, (20, 660))  # Position text in the control panel
+    coord_text = render_text("Mouse X: {:.2f},       Y: {:.2f}".format(x_mm_coordinates,y_mm_coordinates))
+    surface.blit(coord_text, (20, 660))  # Position text in the control panel
 
     # Draw the input boxes
-    target_x_box.draw(screen)
-    target_y_box.draw(screen)
-    target_angle_box.draw(screen)
+    target_x_box.draw(surface)
+    target_y_box.draw(surface)
+    target_angle_box.draw(surface)
 
     # Draw the validation button
-    validate_button.draw(screen)
+    validate_button.draw(surface)
     
-    undo_button.draw(screen)
+    undo_button.draw(surface)
+    redo_button.draw(surface)
 
-    save_button.draw(screen)
+    save_button.draw(surface)
+
+    load_button.draw(surface)
+
+    plan_button.draw(surface)
 
     # Draw movement control buttons
-    play_button.draw(screen)
-    pause_button.draw(screen)
-    reset_button.draw(screen)
+    play_button.draw(surface)
+    pause_button.draw(surface)
+    reset_button.draw(surface)
+    speed_button.draw(surface)
 
     # Draw the angle selection wheel
-    angle_wheel.draw(screen)
+    angle_wheel.draw(surface)
+
+    # Draw the timeline scrub bar
+    timeline.draw(surface)
 
-def draw_map():
+def draw_map(surface=None):
     """Draw the map section on the right side of the screen."""
+    if surface is None:
+        surface = screen
     # Draw the scaled map image centered in the map section
-    screen.blit(scaled_map_image, (map_x, map_y))
+    surface.blit(scaled_map_image, (map_x, map_y))
     
     # Draw the robot on the map section
-    robot.draw(screen)
+    robot.draw(surface)
 
     # Draw arrows connecting the path points
-    robot.draw_arrows(screen)
+    robot.draw_arrows(surface)
+
+def undo_edit():
+    if path_model.undo() is None:
+        print("Nothing to undo.")
+
+def redo_edit():
+    if path_model.redo() is None:
+        print("Nothing to redo.")
 
 def handle_events(event):
     """Handle events like mouse clicks and key presses."""
-    slider1.handle_event(event)
-    slider2.handle_event(event)
-    slider3.handle_event(event)
-    slider4.handle_event(event)
-
-    target_x_entry= target_x_box.handle_event(event)
-    target_y_entry= target_y_box.handle_event(event)
-    target_angle_entry= target_angle_box.handle_event(event)
+    # Ctrl+Z / Ctrl+Y (or Ctrl+Shift+Z), unless an input box is being edited
+    if event.type == pygame.KEYDOWN and event.mod & pygame.KMOD_CTRL and dispatcher.focus is None:
+        if event.key == pygame.K_z and event.mod & pygame.KMOD_SHIFT or event.key == pygame.K_y:
+            redo_edit()
+            return
+        if event.key == pygame.K_z:
+            undo_edit()
+            return
 
+    # Only the widget under the cursor (or with the focus) sees the event
+    widget, result = dispatcher.dispatch(event)
+    if not result:
+        return
 
-    if target_x_entry:
-        
+    if widget is target_x_box:
         robot.update_position(get_px_coordinates(float(target_x_box.text),0)[0],robot.y)
-    if target_y_entry:
+    elif widget is target_y_box:
         robot.update_position(robot.x,get_px_coordinates(0,float(target_y_box.text))[1])
-
-    if target_angle_entry:
+    elif widget is target_angle_box:
         angle_wheel.set_angle(float(target_angle_box.text))
-    toggle.handle_event(event)  # Handle toggle events
 
-    angle_wheel.handle_event(event)
-
-    robot.handle_event(event)
-
-    if validate_button.handle_event(event):
+    elif widget is validate_button:
         # Get the target coordinates from input boxes
-        global path_points
         try:
             target_x= float(target_x_box.text)
             target_y = float(target_y_box.text)
@@ -540,48 +685,106 @@ def handle_events(event):
                              linear_acceleration_choice,
                              angular_acceleration_choice
                             ]  # Adjust for control width
-            path_points.append(clicked_point)
+            add_path_point(clicked_point)
             x_px_robot_coordinates, y_px_robot_coordinates=get_px_coordinates(target_x, target_y)
             robot.update_position(x_px_robot_coordinates,y_px_robot_coordinates)
-            robot.draw_arrows(screen)
             print(path_points)
 
         except ValueError:
             print("Invalid input. please validate trajectory")  # Optional error handling
 
-    if save_button.handle_event(event):
+    elif widget is plan_button:
+        # Plan around obstacles from the last waypoint to the target
+        try:
+            goal_pose = (float(target_x_box.text), float(target_y_box.text), float(angle_wheel.angle))
+            if len(path_points) == 0:
+                print("Validate a start point before planning.")
+            else:
+                levels = (int(slider1.state), int(slider2.state), int(slider3.state), int(slider4.state))
+                planned_points = planner.plan(path_points[-1][0:3], goal_pose, toggle.state, levels)
+                if planned_points is None:
+                    print("No path found to the target.")
+                else:
+                    # The whole planned route is one edit
+                    path_model.extend(planned_points)
+                    robot.update_position(*get_px_coordinates(goal_pose[0], goal_pose[1]))
+                    print(path_points)
+        except ValueError:
+            print("Invalid input. please validate trajectory")
+
+    elif widget is save_button:
         save_path()
 
-    if undo_button.handle_event(event):
-        path_points=path_points[:-1]
+    elif widget is load_button:
+        load_saved_path()
+
+    elif widget is undo_button:
+        undo_edit()
+
+    elif widget is redo_button:
+        redo_edit()
 
     # Handle movement control buttons
-    if play_button.handle_event(event):
+    elif widget is play_button:
         robot.start_path_following()
         print("Starting path following...")
     
-    if pause_button.handle_event(event):
+    elif widget is pause_button:
         robot.stop_movement()
         print("Movement paused.")
     
-    if reset_button.handle_event(event):
+    elif widget is speed_button:
+        # Cycle through the time scales
+        time_scale = TIME_SCALES[(TIME_SCALES.index(sim_clock.time_scale) + 1) % len(TIME_SCALES)]
+        sim_clock.set_time_scale(time_scale)
+        speed_button.title = "max" if time_scale is None else "{:g}x".format(time_scale)
+
+    elif widget is reset_button:
         robot.reset_to_start()
         print("Robot reset to start position.")
 
-    # Handle mouse click in the map area to set target_X and target_Y
-    if event.type == pygame.MOUSEBUTTONDOWN:
-        if map_x < event.pos[0] < map_x+new_map_width and map_y< event.pos[1]< map_y+new_map_height:  # Check if click is inside the map area
-            x_mm_coordinates,y_mm_coordinates=get_mm_coordinates(event.pos[0],event.pos[1])
-            target_x_box.set_text(str(round(x_mm_coordinates,3))) # Set X coordinate
-            target_y_box.set_text(str(round(y_mm_coordinates,3))) # Set Y coordinate
-
-            robot.update_position(event.pos[0], event.pos[1])
-
-def main():
-    clock = pygame.time.Clock()
+def update_frame(events, steps=1, alpha=1.0):
+    """Handle one frame of input events and run steps physics steps; False once the user quits."""
     running = True
-
-    global robot, slider1, slider2, slider3, slider4, target_x_box, target_y_box, toggle, validate_button,angle_wheel, save_button, undo_button, path_points, target_angle_box, play_button, pause_button, reset_button
+    # Drags update once per frame, however many motion events arrived
+    for event in coalesce_motion(events):
+        if event.type == pygame.QUIT:
+            running = False
+        elif event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_ESCAPE:  # Press ESC to exit fullscreen
+                running = False
+        handle_events(event)
+    profiler.mark("events")
+
+    # Update robot movement
+    robot.update_movement(steps, alpha)
+    profiler.mark("physics")
+    return running
+
+def replay(log, tolerance=1e-9):
+    """Replay a recording.SessionLog headless; returns the frames whose pose differs."""
+    create_widgets()
+    robot.engine.dt = log.dt
+    mismatches = []
+    for frame in range(len(log)):
+        update_frame(log.events(frame), log.steps(frame), log.alpha(frame))
+        t, x, y, angle, _ = log.pose(frame)
+        state = robot.engine.state
+        if (abs(state.x - x) > tolerance or abs(state.y - y) > tolerance or
+                abs((state.angle - angle + 180.0) % 360.0 - 180.0) > tolerance or
+                abs(robot.engine.time - t) > tolerance):
+            mismatches.append(frame)
+    return mismatches
+
+def create_widgets():
+    global robot, slider1, slider2, slider3, slider4, target_x_box, target_y_box, toggle, validate_button,angle_wheel, save_button, undo_button, path_points, target_angle_box, play_button, pause_button, reset_button, timeline, plan_button, load_button, speed_button, sim_clock, path_overlay, dispatcher, redo_button, path_model
+
+    load_assets()
+    path_overlay = PathOverlay((WIDTH, HEIGHT), table_frame)
+    path_model = PathModel()
+    path_model.subscribe(on_path_changed)
+    path_points = path_model.points
+    colliding_segments.clear()
 
     # Create sliders for velocity and acceleration choices
     slider1 = Slider4State(20, 60, 200, title="Linear Velocity")
@@ -597,14 +800,20 @@ def main():
     # Create toggle switch for "Is it forward?"
     toggle = ToggleSwitch(200, 620, title="Is it forward")
 
-    #Initialize the validate trajectory button (no angle)
-    undo_button=Button(20, 560, 100, 40, "UNDO")
+    # Undo and redo the last edit of the path
+    undo_button=Button(20, 560, 50, 40, "undo")
+    redo_button = Button(75, 560, 50, 40, "redo")
     
     #initialize the validation button
     validate_button = Button(130, 560, 100, 40, "Validate")
 
     save_button= Button(240, 560, 50, 40, "save")
 
+    load_button = Button(240, 505, 50, 40, "load")
+
+    # Plan around obstacles to the target
+    plan_button = Button(170, 505, 60, 40, "PLAN")
+
     # Movement control buttons
     play_button = Button(20, 620, 60, 30, "PLAY")
     pause_button = Button(90, 620, 60, 30, "PAUSE") 
@@ -613,39 +822,130 @@ def main():
     # Create an instance of AngleWheel
     angle_wheel = AngleWheel(215, 400, 50) 
 
+    # Timeline scrub bar for seeking along the run
+    timeline = TimelineBar(20, 700, 150)
+
+    # Simulation speed: 1x, 10x or as fast as possible
+    speed_button = Button(240, 50, 50, 30, "1x")
+
     # Initialize robot in the map area (starting from CONTROL_WIDTH for x-coordinate)
     robot = Robot(CONTROL_WIDTH + MAP_WIDTH // 2, HEIGHT // 2)
 
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:  # Press ESC to exit fullscreen
-                    running = False
-            handle_events(event)
+    # Fixed-rate physics, independent of the display frame rate
+    sim_clock = SimulationClock(robot.engine.dt)
+
+    # Mouse events go to the widget under the cursor, later widgets on top
+    dispatcher = EventDispatcher()
+    dispatcher.add(MapArea(table_frame))
+    dispatcher.add(robot, rect=table_frame.viewport)
+    for slider in (slider1, slider2, slider3, slider4):
+        dispatcher.add(slider, rect=slider.hit_rect)
+    dispatcher.add(toggle)
+    for box in (target_x_box, target_y_box, target_angle_box):
+        dispatcher.add(box, focusable=True)
+    for button in (validate_button, undo_button, redo_button, save_button, load_button, plan_button,
+                   play_button, pause_button, reset_button, speed_button):
+        dispatcher.add(button)
+    dispatcher.add(angle_wheel)
+    dispatcher.add(timeline, rect=timeline.hit_rect)
+
+def main(robot_address=None):
+    """Run the viewer; robot_address ("host:port" or "loopback") connects to a robot controller."""
+    global bridge
+    open_window()
+    clock = pygame.time.Clock()
+    running = True
 
-        # Drawing
-        screen.fill(BACKGROUND_COLOR)
+    create_widgets()
 
-        # Get current mouse position
-        mouse_x, mouse_y = pygame.mouse.get_pos()
+    # Pose reported by the robot controller, drawn over the simulated robot
+    pose_marker = None
+    if robot_address is not None:
+        from hil import connect
+        bridge = connect(robot_address, get_mm_coordinates(robot.x, robot.y) + (robot.angle,))
+        pose_marker = PoseMarker(table_frame, robot_width_mm, robot_length_mm)
 
-        # Drawing
-        screen.fill(BACKGROUND_COLOR)
-        
-        # Draw the control panel with mouse coordinates
-        draw_controls(mouse_x, mouse_y)
+    # Every session is recorded for replay (see recording.py)
+    recorder = Recorder(session_filename(), robot.engine.dt)
 
-        # Update robot movement
-        robot.update_movement()
-        
-        # Draw the map and the robot
-        draw_map()
-        pygame.display.flip()
+    # Layered renderer: only the parts of the screen that changed are redrawn
+    renderer = LayeredRenderer(screen, BACKGROUND_COLOR, scaled_map_image, (map_x, map_y),
+                               (0, 0, CONTROL_WIDTH, HEIGHT), path_overlay)
+    idle = False
+
+    # Profiling HUD in the top right corner: F3 shows it, F4 profiles the next frames
+    hud = ProfilerHUD(profiler, pygame.font.Font(None, 22), (screen.get_width() - 10, 10))
+
+    def draw_panel(surface):
+        profiler.mark("compose")
+        draw_controls(mouse_x, mouse_y, surface)
+        profiler.mark("controls")
+
+    while running:
+        profiler.begin_frame()
+        events = pygame.event.get()
+        if not events and idle:
+            # Nothing is changing: sleep until the next input event
+            event = pygame.event.wait(IDLE_WAIT_MS)
+            events = [event] if event.type != pygame.NOEVENT else []
+        profiler.mark("input")
+
+        for event in events:
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                profiler.toggle()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                print("Profiling the next frames...")
+                profiler.start_capture()
+
+        # Physics steps due for the real time since the last frame. No time
+        # accumulates while the robot stands still, so a run starts from zero
+        # instead of catching up with the idle time
+        if robot.engine.is_moving:
+            steps = sim_clock.frame_steps(clock.get_time() / 1000.0)
+        else:
+            sim_clock.reset()
+            steps = 0
+        was_moving = robot.engine.is_moving
+        physics_start = time.perf_counter()
+        alpha = sim_clock.alpha
+        running = update_frame(events, steps, alpha)
+        if was_moving:
+            sim_clock.measure(steps, time.perf_counter() - physics_start)
+        if events:
+            renderer.invalidate_ui()
+
+        # Get current mouse position
+        mouse_x, mouse_y = pygame.mouse.get_pos()
+        recorder.record_frame(events, robot.engine, (mouse_x, mouse_y), steps, alpha)
+        profiler.mark("record")
+
+        if robot.engine.is_moving:
+            renderer.invalidate_ui()  # Timeline readout
+
+        # Latest pose from the controller; the telemetry is read by the bridge thread
+        overlays = []
+        real_pose = bridge.latest() if bridge is not None else None
+        if real_pose is not None:
+            pose_marker.set_pose(*real_pose[1:])
+            overlays.append(pose_marker)
+
+        # Draw the control panel, the path arrows and the robot where needed
+        if profiler.enabled:
+            hud.update()
+            overlays.append(hud)
+        drawn = renderer.render(draw_panel, robot.draw, robot.get_rect(), robot.get_draw_key(), overlays)
+        profiler.mark("compose")
+        idle = not drawn and not robot.engine.is_moving
         clock.tick(60)
+        profiler.mark("sleep")
 
+    recorder.close()
+    if bridge is not None:
+        bridge.close()
     pygame.quit()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Robot path simulation")
+    parser.add_argument("--robot", metavar="ADDRESS",
+                        help='robot controller to drive with the path, "host:port" or "loopback" (see hil.py)')
+    main(parser.parse_args().robot)
\ No newline at end of file
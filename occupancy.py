@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""Occupancy grid of the table and swept-footprint collision checks.
+
+The map image is rasterised into a bit-packed grid in table millimetres (one
+bit per cell, 1 = obstacle). Game elements are the saturated colours of the
+drawing (pillars, blocks, markers); a companion "<map>_obstacles.png" layer,
+when present, is used instead, with every opaque non-white pixel an obstacle.
+Everything outside the table counts as occupied.
+
+Grids are cached to disk keyed by the image hash, so the image is only
+rasterised once.
+"""
+import hashlib
+import math
+import os
+
+import numpy as np
+import pygame
+
+from motion_profile import SegmentProfile
+from simulation import TABLE_WIDTH_MM, TABLE_HEIGHT_MM
+from trajectory import sample_trapezoid
+
+# Size of a grid cell (mm)
+RESOLUTION_MM = 10.0
+
+# A pixel is a game element when max(R, G, B) - min(R, G, B) exceeds this
+SATURATION_THRESHOLD = 100
+# Fraction of obstacle pixels needed to mark a cell, filters thin drawing lines
+CELL_FILL_THRESHOLD = 0.3
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+CACHE_VERSION = 1
+
+
+def obstacle_layer_path(image_path):
+    """Path of the optional companion obstacle layer for a map image."""
+    stem, ext = os.path.splitext(image_path)
+    return stem + "_obstacles" + ext
+
+
+def _pixel_obstacles(image_path, companion):
+    """Boolean (rows, cols) obstacle mask at image resolution, row 0 at the top."""
+    image = pygame.image.load(image_path)
+    rgb = pygame.surfarray.array3d(image).transpose(1, 0, 2).astype(np.int16)
+    try:
+        alpha = pygame.surfarray.array_alpha(image).T
+    except ValueError:
+        alpha = np.full(rgb.shape[:2], 255)
+
+    if companion:
+        return (alpha > 127) & (rgb.min(axis=2) < 200)
+    saturation = rgb.max(axis=2) - rgb.min(axis=2)
+    return (alpha > 127) & (saturation > SATURATION_THRESHOLD)
+
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class OccupancyGrid:
+    """Bit-packed occupancy grid in table millimetres.
+
+    Row r covers y in [r * resolution, (r + 1) * resolution), y growing upwards
+    like the table frame; column c covers x likewise.
+    """
+
+    def __init__(self, packed, rows, cols, resolution=RESOLUTION_MM,
+                 width_mm=TABLE_WIDTH_MM, height_mm=TABLE_HEIGHT_MM):
+        self.packed = packed
+        self.rows = rows
+        self.cols = cols
+        self.resolution = resolution
+        self.width_mm = width_mm
+        self.height_mm = height_mm
+
+    @classmethod
+    def from_mask(cls, mask, resolution=RESOLUTION_MM, width_mm=TABLE_WIDTH_MM, height_mm=TABLE_HEIGHT_MM):
+        """Build a grid from a boolean (rows, cols) array."""
+        mask = np.asarray(mask, dtype=bool)
+        return cls(np.packbits(mask, axis=1), mask.shape[0], mask.shape[1], resolution, width_mm, height_mm)
+
+    @classmethod
+    def from_image(cls, image_path, resolution=RESOLUTION_MM):
+        """Rasterise a map image (or its companion obstacle layer) into a grid."""
+        layer = obstacle_layer_path(image_path)
+        companion = os.path.exists(layer)
+        pixels = _pixel_obstacles(layer if companion else image_path, companion)
+        height_px, width_px = pixels.shape
+
+        rows = int(math.ceil(TABLE_HEIGHT_MM / resolution))
+        cols = int(math.ceil(TABLE_WIDTH_MM / resolution))
+
+        # Cell of every pixel centre (image rows grow downwards, table y upwards)
+        x_mm = (np.arange(width_px) + 0.5) / width_px * TABLE_WIDTH_MM
+        y_mm = (1.0 - (np.arange(height_px) + 0.5) / height_px) * TABLE_HEIGHT_MM
+        cell_cols = np.minimum((x_mm / resolution).astype(int), cols - 1)
+        cell_rows = np.minimum((y_mm / resolution).astype(int), rows - 1)
+        flat_cells = (cell_rows[:, None] * cols + cell_cols[None, :]).ravel()
+
+        hits = np.bincount(flat_cells, weights=pixels.ravel(), minlength=rows * cols)
+        counts = np.bincount(flat_cells, minlength=rows * cols)
+        filled = hits >= CELL_FILL_THRESHOLD * np.maximum(counts, 1)
+        # Cells without any pixel centre take their nearest pixel's value
+        empty = counts == 0
+        if empty.any():
+            empty_rows, empty_cols = np.divmod(np.nonzero(empty)[0], cols)
+            px = np.minimum(((empty_cols + 0.5) * resolution / TABLE_WIDTH_MM * width_px).astype(int), width_px - 1)
+            py = np.minimum(((1.0 - (empty_rows + 0.5) * resolution / TABLE_HEIGHT_MM) * height_px).astype(int),
+                            height_px - 1)
+            filled[empty] = pixels[py, px]
+        return cls.from_mask(filled.reshape(rows, cols), resolution)
+
+    @classmethod
+    def load(cls, image_path, resolution=RESOLUTION_MM, cache_dir=CACHE_DIR):
+        """Load the grid of a map image from the disk cache, building it if needed."""
+        layer = obstacle_layer_path(image_path)
+        key = _file_hash(image_path)
+        if os.path.exists(layer):
+            key += _file_hash(layer)
+        key = hashlib.sha1("{}:{}:{}".format(CACHE_VERSION, resolution, key).encode()).hexdigest()
+        cache_path = os.path.join(cache_dir, "occupancy_{}.npz".format(key))
+
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as data:
+                return cls(data["packed"], int(data["rows"]), int(data["cols"]), float(data["resolution"]))
+
+        grid = cls.from_image(image_path, resolution)
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = cache_path + ".tmp.npz"
+        np.savez(temp_path, packed=grid.packed, rows=grid.rows, cols=grid.cols, resolution=grid.resolution)
+        os.replace(temp_path, cache_path)
+        return grid
+
+    def to_mask(self):
+        """Unpacked boolean (rows, cols) array."""
+        return np.unpackbits(self.packed, axis=1, count=self.cols).astype(bool)
+
+    def is_occupied(self, x_mm, y_mm):
+        """Vectorized occupancy test for points in mm; outside the table is occupied."""
+        x_mm = np.asarray(x_mm, dtype=float)
+        y_mm = np.asarray(y_mm, dtype=float)
+        cols = np.floor(x_mm / self.resolution).astype(int)
+        rows = np.floor(y_mm / self.resolution).astype(int)
+        inside = (cols >= 0) & (cols < self.cols) & (rows >= 0) & (rows < self.rows)
+        cols = np.where(inside, cols, 0)
+        rows = np.where(inside, rows, 0)
+        bits = (self.packed[rows, cols >> 3] >> (7 - (cols & 7))) & 1
+        return ~inside | (bits == 1)
+
+    def footprint_points(self, width_mm, length_mm, interior=True):
+        """Sample points of a width x length rectangle centred on the robot (angle 0).
+
+        width runs along x and length along y at angle 0, like the robot sprite.
+        Points are spaced by at most one cell so no obstacle cell slips between them.
+        """
+        nx = int(math.ceil(width_mm / self.resolution)) + 1
+        ny = int(math.ceil(length_mm / self.resolution)) + 1
+        xs = np.linspace(-width_mm / 2, width_mm / 2, nx)
+        ys = np.linspace(-length_mm / 2, length_mm / 2, ny)
+        if interior:
+            grid_x, grid_y = np.meshgrid(xs, ys)
+            return np.column_stack([grid_x.ravel(), grid_y.ravel()])
+        return np.concatenate([
+            np.column_stack([xs, np.full(nx, ys[0])]),
+            np.column_stack([xs, np.full(nx, ys[-1])]),
+            np.column_stack([np.full(ny - 2, xs[0]), ys[1:-1]]),
+            np.column_stack([np.full(ny - 2, xs[-1]), ys[1:-1]]),
+        ])
+
+    def poses_collide(self, poses, points):
+        """For each (x, y, angle) pose, whether the footprint points hit an obstacle."""
+        poses = np.atleast_2d(np.asarray(poses, dtype=float))
+        angle = np.radians(poses[:, 2])[:, None]
+        cos, sin = np.cos(angle), np.sin(angle)
+        x = poses[:, 0:1] + points[:, 0] * cos - points[:, 1] * sin
+        y = poses[:, 1:2] + points[:, 0] * sin + points[:, 1] * cos
+        return self.is_occupied(x, y).any(axis=1)
+
+    def segment_poses(self, segment, radius):
+        """Poses along a SegmentProfile, dense enough that the footprint moves under half a cell."""
+        step = self.resolution / 2
+        count = int(math.ceil(max(segment.length / step, math.radians(abs(segment.rotation)) * radius / step)))
+        # The profiles peak at up to twice their average speed
+        t = np.linspace(0.0, segment.duration, 2 * count + 2)
+        distance, _ = sample_trapezoid(segment.translation, t)
+        rotation, _ = sample_trapezoid(segment.turn, t)
+        return np.column_stack([segment.start_x + segment.direction[0] * distance,
+                                segment.start_y + segment.direction[1] * distance,
+                                segment.start_angle + rotation])
+
+    def segment_collides(self, start_pose, waypoint, width_mm, length_mm):
+        """Whether driving from start_pose (x, y, angle) to waypoint hits an obstacle."""
+        segment = SegmentProfile(start_pose, waypoint)
+        points = self.footprint_points(width_mm, length_mm, interior=False)
+        radius = math.hypot(width_mm, length_mm) / 2
+        poses = self.segment_poses(segment, radius)
+        if self.poses_collide(poses, points).any():
+            return True
+        # The outline sweep cannot see an obstacle lying entirely inside the footprint
+        interior = self.footprint_points(width_mm, length_mm)
+        return bool(self.poses_collide(poses[[0, -1]], interior).any())
+
+    def path_collisions(self, path_points, width_mm, length_mm):
+        """Indices i of the segments (waypoint i -> i + 1) that hit an obstacle."""
+        return [i for i in range(len(path_points) - 1)
+                if self.segment_collides(path_points[i][:3], path_points[i + 1], width_mm, length_mm)]
+
+    def reject_colliding(self, paths, width_mm, length_mm):
+        """Boolean array, True for every path (list of path_points) that collides."""
+        return np.array([len(self.path_collisions(path, width_mm, length_mm)) > 0 for path in paths], dtype=bool)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""Path optimizer: visiting order and via-point smoothing.
+
+Reordering treats every waypoint after the first as a place to visit and runs
+2-opt and Or-opt local search on a table of segment durations between every
+pair of waypoints. The table is computed once with the vectorized model of
+batch.py (so it matches the simulator exactly) and all moves are scored from
+it with prefix sums, never by re-simulating the path.
+
+Smoothing works on via points, the waypoints that only face their direction of
+travel (as the planner emits them): nearly collinear ones are dropped, which
+removes a stop, and the others keep facing their direction of travel
+(backwards when not is_forward) from the waypoint now before them: the real
+robot is a differential drive and cannot move sideways. For a holonomic
+robot, retime_headings (--retime-headings) instead chooses every heading so
+the rotation overlaps the two adjacent translations.
+
+Usage:
+    python optimizer.py path_points.json -o path_points_optimized.json
+"""
+import argparse
+import math
+
+import numpy as np
+
+from batch import segment_durations
+from motion_profile import X, Y, ANGLE, IS_FORWARD, PathProfile, normalize_angle
+
+# A waypoint whose angle is within this of its arrival heading is a via point (degrees)
+VIA_ANGLE_TOLERANCE = 1.0
+# Via points closer than this to the line through their neighbours are dropped (mm)
+COLLINEAR_TOLERANCE_MM = 5.0
+# Headings tried for every via point
+HEADING_CANDIDATES = 360
+# Segment duration added for a segment where the robot hits an obstacle (s)
+COLLISION_PENALTY = 1e6
+
+# Smallest improvement a move must bring (s)
+EPSILON = 1e-9
+MAX_ITERATIONS = 10000
+OR_OPT_BLOCK_SIZES = (1, 2, 3)
+
+
+class SegmentCostTable:
+    """Memoized durations (s) of the segments between every pair of waypoints.
+
+    durations[i, j] is the time to drive from waypoint i to waypoint j. With
+    an occupancy grid and a footprint, segments that hit an obstacle cost
+    COLLISION_PENALTY more; this checks every pair once, so it is the slow part
+    for long paths.
+    """
+
+    def __init__(self, path_points, grid=None, footprint=None):
+        self.points = np.array([[float(value) for value in point] for point in path_points])
+        self.durations = segment_durations(self.points[:, None, :], self.points[None, :, :])[0]
+        if grid is not None:
+            width_mm, length_mm = footprint
+            count = len(path_points)
+            for i in range(count):
+                for j in range(count):
+                    if i != j and grid.segment_collides(path_points[i][:3], path_points[j], width_mm, length_mm):
+                        self.durations[i, j] += COLLISION_PENALTY
+
+    def route_cost(self, route):
+        route = np.asarray(route)
+        return float(self.durations[route[:-1], route[1:]].sum())
+
+
+class OptimizationResult:
+    """Optimized path with the estimated time it saves."""
+
+    def __init__(self, path_points, order, original_time, optimized_time):
+        self.path_points = path_points        # New path_points list
+        self.order = order                    # Original index of every waypoint kept
+        self.original_time = original_time    # s
+        self.optimized_time = optimized_time  # s
+
+    @property
+    def saved_time(self):
+        return self.original_time - self.optimized_time
+
+    def __repr__(self):
+        return "OptimizationResult({} waypoints, {:.3f} s -> {:.3f} s, saves {:.3f} s)".format(
+            len(self.path_points), self.original_time, self.optimized_time, self.saved_time)
+
+
+def _respects(route, precedence):
+    if not precedence:
+        return True
+    position = {node: i for i, node in enumerate(route)}
+    return all(position[before] < position[after] for before, after in precedence)
+
+
+def _first_valid(deltas, candidates, apply, precedence):
+    """Apply the most improving move that keeps the precedence constraints."""
+    improving = np.nonzero(deltas < -EPSILON)[0]
+    for k in improving[np.argsort(deltas[improving], kind="stable")]:
+        route = apply(*candidates[k])
+        if _respects(route, precedence):
+            return route
+    return None
+
+
+def two_opt_move(costs, route, fixed_end, precedence=()):
+    """Best improving segment reversal, or None.
+
+    costs is padded with a zero-cost virtual end node, the last entry of route.
+    """
+    a = np.asarray(route)
+    m = len(a) - 1                       # Real waypoints
+    last = m - 2 if fixed_end else m - 1
+    if last < 2:
+        return None
+    forward = np.concatenate([[0.0], np.cumsum(costs[a[:-1], a[1:]])])
+    backward = np.concatenate([[0.0], np.cumsum(costs[a[1:], a[:-1]])])
+
+    i, j = np.triu_indices(last + 1, 1)
+    keep = i >= 1
+    i, j = i[keep], j[keep]
+    deltas = (costs[a[i - 1], a[j]] - costs[a[i - 1], a[i]]
+              + (backward[j] - backward[i]) - (forward[j] - forward[i])
+              + costs[a[i], a[j + 1]] - costs[a[j], a[j + 1]])
+
+    def apply(i, j):
+        return list(a[:i]) + list(a[i:j + 1][::-1]) + list(a[j + 1:])
+
+    return _first_valid(deltas, np.column_stack([i, j]), apply, precedence)
+
+
+def or_opt_move(costs, route, fixed_end, precedence=()):
+    """Best improving move of a block of 1 to 3 waypoints elsewhere in the route, or None."""
+    a = np.asarray(route)
+    m = len(a) - 1
+    last = m - 2 if fixed_end else m - 1
+    last_insert = m - 2 if fixed_end else m - 1
+    best_deltas, best_moves = [], []
+    for size in OR_OPT_BLOCK_SIZES:
+        starts = np.arange(1, last - size + 2)
+        if len(starts) == 0:
+            continue
+        s, t = np.meshgrid(starts, np.arange(0, last_insert + 1), indexing="ij")
+        s, t = s.ravel(), t.ravel()
+        e = s + size - 1
+        keep = (t < s - 1) | (t > e)
+        s, t, e = s[keep], t[keep], e[keep]
+        removal = costs[a[s - 1], a[e + 1]] - costs[a[s - 1], a[s]] - costs[a[e], a[e + 1]]
+        insertion = costs[a[t], a[s]] + costs[a[e], a[t + 1]] - costs[a[t], a[t + 1]]
+        best_deltas.append(removal + insertion)
+        best_moves.append(np.column_stack([s, e, t]))
+    if not best_deltas:
+        return None
+
+    def apply(s, e, t):
+        block = list(a[s:e + 1])
+        rest = list(a[:s]) + list(a[e + 1:])
+        position = t + 1 if t < s else t - (e - s + 1) + 1
+        return rest[:position] + block + rest[position:]
+
+    return _first_valid(np.concatenate(best_deltas), np.concatenate(best_moves), apply, precedence)
+
+
+def reorder(table, fixed_end=False, precedence=()):
+    """Visiting order (list of waypoint indices) found by 2-opt and Or-opt from the given order."""
+    count = len(table.points)
+    if count < 3:
+        return list(range(count))
+    # Virtual end node: routes may end anywhere at no cost
+    costs = np.zeros((count + 1, count + 1))
+    costs[:count, :count] = table.durations
+    route = list(range(count)) + [count]
+    for _ in range(MAX_ITERATIONS):
+        moved = two_opt_move(costs, route, fixed_end, precedence)
+        if moved is None:
+            moved = or_opt_move(costs, route, fixed_end, precedence)
+        if moved is None:
+            break
+        route = [int(node) for node in moved]
+    return route[:-1]
+
+
+def travel_heading(previous, point):
+    """Heading (degrees) a waypoint faces when driving to it from previous."""
+    heading = math.degrees(math.atan2(point[Y] - previous[Y], point[X] - previous[X]))
+    if not point[IS_FORWARD]:
+        heading += 180.0
+    return heading % 360.0
+
+
+def is_via_point(previous, point):
+    """Whether a waypoint only faces its direction of travel from the previous one."""
+    if previous[X] == point[X] and previous[Y] == point[Y]:
+        return False
+    return abs(normalize_angle(point[ANGLE] - travel_heading(previous, point))) <= VIA_ANGLE_TOLERANCE
+
+
+def _point_to_line(point, start, end):
+    dx, dy = end[X] - start[X], end[Y] - start[Y]
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return math.hypot(point[X] - start[X], point[Y] - start[Y])
+    return abs(dx * (point[Y] - start[Y]) - dy * (point[X] - start[X])) / length
+
+
+def _duration(start, waypoint):
+    return float(segment_durations(np.asarray(start, dtype=float), np.asarray(waypoint, dtype=float))[0])
+
+
+def via_points(path_points):
+    """Whether each waypoint is a via point; the first and the last never are."""
+    return [False] + [is_via_point(path_points[k - 1], path_points[k])
+                      for k in range(1, len(path_points) - 1)] + [False]
+
+
+def smooth(path_points, order=None, grid=None, footprint=None, retime_headings=False, via=None):
+    """Drop collinear via points and realign (or, with retime_headings, retime) the others.
+
+    via flags the via points of path_points (see via_points, the default);
+    after reordering, pass the flags of the original path so that waypoints
+    with a new predecessor are recognised. Returns (path_points, order) where
+    order maps every kept waypoint to its index in the input (or in the given
+    order).
+    """
+    points = [list(point) for point in path_points]
+    order = list(order) if order is not None else list(range(len(points)))
+    via = list(via) if via is not None else via_points(points)
+    if points:
+        via[0] = via[-1] = False
+
+    def collides(start, waypoint):
+        return grid is not None and grid.segment_collides(start[:3], waypoint, *footprint)
+
+    # Collinear via points only add a stop
+    k = 1
+    while k < len(points) - 1:
+        previous, point, following = points[k - 1], points[k], points[k + 1]
+        if (via[k] and _point_to_line(point, previous, following) <= COLLINEAR_TOLERANCE_MM
+                and _duration(previous, following) < _duration(previous, point) + _duration(point, following)):
+            del points[k], order[k], via[k]
+        else:
+            k += 1
+
+    # Remaining via points face their direction of travel from their new predecessor
+    if not retime_headings:
+        for k in range(1, len(points) - 1):
+            if not via[k]:
+                continue
+            previous, point, following = points[k - 1], points[k], points[k + 1]
+            candidate = point[:ANGLE] + [travel_heading(previous, point)] + point[ANGLE + 1:]
+            if not collides(previous, candidate) and not collides(candidate, following):
+                points[k] = candidate
+        return points, order
+
+    # Holonomic robot: overlap the rotation of every via point with the translations
+    candidates = np.linspace(0.0, 360.0, HEADING_CANDIDATES, endpoint=False)
+    for k in range(1, len(points) - 1):
+        if not via[k]:
+            continue
+        previous, point, following = points[k - 1], points[k], points[k + 1]
+        options = np.tile(np.asarray(point, dtype=float), (len(candidates), 1))
+        options[:, ANGLE] = candidates
+        total = (segment_durations(np.asarray(previous, dtype=float), options)[0] +
+                 segment_durations(options, np.asarray(following, dtype=float))[0])
+        current = _duration(previous, point) + _duration(point, following)
+        for index in np.argsort(total, kind="stable")[:10]:
+            if total[index] >= current - EPSILON:
+                break
+            candidate = point[:ANGLE] + [float(candidates[index])] + point[ANGLE + 1:]
+            if not collides(previous, candidate) and not collides(candidate, following):
+                points[k] = candidate
+                break
+    return points, order
+
+
+def optimize_path(path_points, reorder_visits=True, smooth_path=True, fixed_end=False, precedence=(),
+                  grid=None, footprint=None, retime_headings=False):
+    """Optimize a path and return an OptimizationResult.
+
+    The first waypoint (the start) always stays first; fixed_end also keeps
+    the last one last. precedence lists (before, after) waypoint index pairs
+    that must keep their relative order. With an occupancy grid and a
+    (width_mm, length_mm) footprint, new segments that collide are avoided.
+    retime_headings lets via points face any direction (see smooth).
+    """
+    path_points = [list(point) for point in path_points]
+    original_time = PathProfile(path_points).duration
+    order = list(range(len(path_points)))
+
+    if reorder_visits and len(path_points) > 2:
+        table = SegmentCostTable(path_points, grid, footprint)
+        candidate = reorder(table, fixed_end, precedence)
+        # Keep the original order unless the new one is really faster
+        if table.route_cost(candidate) < table.route_cost(order) - EPSILON:
+            order = candidate
+    points = [path_points[i] for i in order]
+
+    if smooth_path:
+        via = via_points(path_points)
+        points, order = smooth(points, order, grid, footprint, retime_headings, [via[i] for i in order])
+
+    return OptimizationResult(points, order, original_time, PathProfile(points).duration)
+
+
+def main():
+    from pathfile import load_path, save_binary, write_json_stream
+
+    parser = argparse.ArgumentParser(description="Reorder and smooth a saved path to reduce its duration")
+    parser.add_argument("path", nargs="?", default="path_points.json", help="path file (.json or .rpth)")
+    parser.add_argument("-o", "--output", default="path_points_optimized.json")
+    parser.add_argument("--fixed-end", action="store_true", help="keep the last waypoint last")
+    parser.add_argument("--no-reorder", action="store_true", help="keep the visiting order")
+    parser.add_argument("--no-smooth", action="store_true", help="keep every waypoint and heading")
+    parser.add_argument("--retime-headings", action="store_true",
+                        help="let via points face any direction (holonomic robot only)")
+    args = parser.parse_args()
+
+    result = optimize_path(load_path(args.path), not args.no_reorder, not args.no_smooth, args.fixed_end,
+                           retime_headings=args.retime_headings)
+    if args.output.endswith(".json"):
+        write_json_stream(args.output, result.path_points)
+    else:
+        save_binary(args.output, result.path_points)
+    print(result)
+    print("Order: {}".format(result.order))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Editable path with undo/redo and change notifications.
+
+Every edit of a PathModel is a Splice command: replace the waypoints in a
+range [index, index + removed) by a list of new ones. Inserting, moving and
+deleting a waypoint, appending a planned route or loading a whole path are
+all splices, and undoing one is the reverse splice, so undo and redo cost
+as much as the edit itself. The path is never copied: the viewer and the
+simulation engine share the live list. An edit at the end of the path costs
+as much as the waypoints it touches; elsewhere the waypoints after it are
+shifted in the list and the start times of the later motion-profile segments
+are recomputed.
+
+After every change the listeners get a PathChange with the waypoint range
+that changed and the range of segments (waypoint i -> i + 1) whose ends
+changed, so caches derived from the path (arrow overlay, motion profiles,
+collision flags) are only updated there.
+"""
+from collections import deque
+
+# Edits kept for undo
+MAX_UNDO = 1000
+
+
+class PathChange:
+    """Waypoints [index, index + removed) were replaced by inserted new ones.
+
+    Segments [first_segment, old_segment_stop) of the old path are replaced by
+    segments [first_segment, segment_stop) of the new one; segments after them
+    are shifted by shift.
+    """
+
+    def __init__(self, index, removed, inserted, old_count):
+        self.index = index
+        self.removed = removed
+        self.inserted = inserted
+        self.old_count = old_count
+        self.count = old_count - removed + inserted
+        self.shift = inserted - removed
+        self.first_segment = max(index - 1, 0)
+        self.old_segment_stop = max(min(index + removed, old_count - 1), self.first_segment)
+        self.segment_stop = max(min(index + inserted, self.count - 1), self.first_segment)
+
+    @property
+    def at_end(self):
+        """Whether the change only touches the end of the path (append, truncate)."""
+        return self.index + self.removed == self.old_count
+
+    @property
+    def replaces_all(self):
+        return self.index == 0 and self.removed == self.old_count
+
+    def __repr__(self):
+        return "PathChange(index={}, removed={}, inserted={}, count={})".format(
+            self.index, self.removed, self.inserted, self.count)
+
+
+class Splice:
+    """Command replacing the waypoints [index, index + len(removed)) by inserted."""
+
+    def __init__(self, index, removed, inserted, name):
+        self.index = index
+        self.removed = removed
+        self.inserted = inserted
+        self.name = name
+
+    def inverse(self):
+        return Splice(self.index, self.inserted, self.removed, self.name)
+
+
+class PathModel:
+    """List of waypoints edited through undoable commands.
+
+    points is the live list of waypoints; it is modified in place, so other
+    code may keep a reference to it, but it should only be changed through the
+    model.
+    """
+
+    def __init__(self, points=(), max_undo=MAX_UNDO):
+        self.points = [list(point) for point in points]
+        self.undo_stack = deque(maxlen=max_undo)
+        self.redo_stack = []
+        self.listeners = []
+
+    def __len__(self):
+        return len(self.points)
+
+    def __getitem__(self, index):
+        return self.points[index]
+
+    def __iter__(self):
+        return iter(self.points)
+
+    def subscribe(self, listener):
+        """Call listener(model, change) after every change."""
+        self.listeners.append(listener)
+
+    def _apply(self, splice):
+        old_count = len(self.points)
+        end = splice.index + len(splice.removed)
+        if end == old_count:
+            # At the end of the path: no shifting of the other waypoints
+            del self.points[splice.index:]
+            self.points.extend(splice.inserted)
+        else:
+            self.points[splice.index:end] = splice.inserted
+        change = PathChange(splice.index, len(splice.removed), len(splice.inserted), old_count)
+        for listener in self.listeners:
+            listener(self, change)
+        return change
+
+    def splice(self, index, removed, inserted, name="edit"):
+        """Replace removed waypoints at index by the inserted ones, as one undoable edit."""
+        if not 0 <= index <= len(self.points) or index + removed > len(self.points):
+            raise IndexError("splice of {} waypoints at {} in a path of {}".format(removed, index, len(self.points)))
+        command = Splice(index, self.points[index:index + removed], [list(point) for point in inserted], name)
+        self.undo_stack.append(command)
+        self.redo_stack.clear()
+        return self._apply(command)
+
+    def insert(self, index, point):
+        return self.splice(index, 0, [point], "insert")
+
+    def append(self, point):
+        return self.splice(len(self.points), 0, [point], "append")
+
+    def extend(self, points):
+        return self.splice(len(self.points), 0, points, "append")
+
+    def move(self, index, point):
+        """Replace the waypoint at index (new position, angle or levels)."""
+        return self.splice(index, 1, [point], "move")
+
+    def delete(self, index):
+        return self.splice(index, 1, [], "delete")
+
+    def replace(self, points):
+        """Replace the whole path, e.g. when loading a file."""
+        return self.splice(0, len(self.points), points, "replace")
+
+    @property
+    def can_undo(self):
+        return len(self.undo_stack) > 0
+
+    @property
+    def can_redo(self):
+        return len(self.redo_stack) > 0
+
+    def undo(self):
+        """Revert the last edit; returns its PathChange, or None when there is nothing to undo."""
+        if not self.undo_stack:
+            return None
+        command = self.undo_stack.pop()
+        self.redo_stack.append(command)
+        return self._apply(command.inverse())
+
+    def redo(self):
+        """Apply the last undone edit again; returns its PathChange, or None."""
+        if not self.redo_stack:
+            return None
+        command = self.redo_stack.pop()
+        self.undo_stack.append(command)
+        return self._apply(command)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Path files: compact binary format and streaming JSON.
+
+Binary layout (little endian), version 1:
+    header      32 bytes: magic b"RPTH", version u16, flags u16,
+                waypoint count u32, sample count u32, sample rate f64, padding
+    waypoints   32-byte records: x, y, angle (f64), is_forward and the four
+                slider levels (u8), padding
+    samples     optional trajectory table, sample count x 6 f64
+                (t, x, y, theta, v, omega, see trajectory.py)
+
+Binary files are read with np.memmap, so opening even a large strategy
+library is zero-copy. JSON files keep the path_points.json layout and are read
+and written one waypoint at a time.
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"RPTH"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIId8x")
+FLAG_SAMPLES = 0x1
+
+WAYPOINT_DTYPE = np.dtype({
+    "names": ["x", "y", "angle", "is_forward", "linear_velocity", "angular_velocity",
+              "linear_acceleration", "angular_acceleration"],
+    "formats": ["<f8", "<f8", "<f8", "u1", "u1", "u1", "u1", "u1"],
+    "offsets": [0, 8, 16, 24, 25, 26, 27, 28],
+    "itemsize": 32,
+})
+SAMPLE_COLUMNS = 6
+
+JSON_CHUNK_SIZE = 1 << 16
+
+
+class PathFile:
+    """Contents of a binary path file; arrays may be memory-mapped."""
+
+    def __init__(self, waypoints, samples=None, sample_rate=0.0):
+        self.waypoints = waypoints      # structured array, WAYPOINT_DTYPE
+        self.samples = samples          # (n, 6) array or None
+        self.sample_rate = sample_rate
+
+    def __len__(self):
+        return len(self.waypoints)
+
+    def path_points(self):
+        """The waypoints as a path_points list."""
+        return records_to_path_points(self.waypoints)
+
+
+def path_points_to_records(path_points):
+    """Pack a path_points list into a structured array."""
+    records = np.zeros(len(path_points), dtype=WAYPOINT_DTYPE)
+    for i, name in enumerate(WAYPOINT_DTYPE.names):
+        records[name] = [point[i] for point in path_points]
+    return records
+
+
+def records_to_path_points(records):
+    """Unpack a structured array into a path_points list."""
+    columns = [records[name].tolist() for name in WAYPOINT_DTYPE.names]
+    columns[3] = [bool(value) for value in columns[3]]
+    return [list(point) for point in zip(*columns)]
+
+
+def save_binary(filename, path_points, trajectory=None):
+    """Write path_points, and optionally a Trajectory's samples, to a binary file."""
+    records = path_points if isinstance(path_points, np.ndarray) else path_points_to_records(path_points)
+    samples = None
+    sample_rate = 0.0
+    if trajectory is not None:
+        samples = np.ascontiguousarray(trajectory.samples, dtype="<f8")
+        duration = trajectory.duration
+        sample_rate = (len(samples) - 1) / duration if duration > 0 else 0.0
+
+    flags = FLAG_SAMPLES if samples is not None else 0
+    temp_name = filename + ".tmp"
+    with open(temp_name, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, flags, len(records),
+                            len(samples) if samples is not None else 0, sample_rate))
+        f.write(records.astype(WAYPOINT_DTYPE, copy=False).tobytes())
+        if samples is not None:
+            f.write(samples.tobytes())
+    os.replace(temp_name, filename)
+
+
+def load_binary(filename, mmap=True):
+    """Open a binary path file; with mmap the arrays are views on the file."""
+    with open(filename, "rb") as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("{}: truncated path file".format(filename))
+    magic, version, flags, count, sample_count, sample_rate = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("{}: not a binary path file".format(filename))
+    if version > VERSION:
+        raise ValueError("{}: unsupported path file version {}".format(filename, version))
+
+    samples_offset = HEADER.size + count * WAYPOINT_DTYPE.itemsize
+    if mmap:
+        waypoints = (np.memmap(filename, dtype=WAYPOINT_DTYPE, mode="r", offset=HEADER.size, shape=(count,))
+                     if count else np.zeros(0, dtype=WAYPOINT_DTYPE))
+        samples = None
+        if flags & FLAG_SAMPLES and sample_count:
+            samples = np.memmap(filename, dtype="<f8", mode="r", offset=samples_offset,
+                                shape=(sample_count, SAMPLE_COLUMNS))
+    else:
+        with open(filename, "rb") as f:
+            f.seek(HEADER.size)
+            waypoints = np.fromfile(f, dtype=WAYPOINT_DTYPE, count=count)
+            samples = None
+            if flags & FLAG_SAMPLES and sample_count:
+                samples = np.fromfile(f, dtype="<f8", count=sample_count * SAMPLE_COLUMNS)
+                samples = samples.reshape(sample_count, SAMPLE_COLUMNS)
+    return PathFile(waypoints, samples, sample_rate)
+
+
+def iter_json_waypoints(filename, chunk_size=JSON_CHUNK_SIZE):
+    """Yield the waypoints of a path_points.json file one at a time."""
+    decoder = json.JSONDecoder()
+    with open(filename, "r") as f:
+        buffer = f.read(chunk_size)
+        position = _skip(buffer, 0)
+        if buffer[position:position + 1] != "[":
+            raise ValueError("{}: expected a JSON list of waypoints".format(filename))
+        position += 1
+        eof = False
+        while True:
+            position = _skip(buffer, position)
+            if buffer.startswith("]", position):
+                return
+            try:
+                waypoint, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The waypoint continues in the next chunk
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield waypoint
+
+
+def _skip(text, position):
+    """Index of the next character that is not whitespace or a comma."""
+    while position < len(text) and text[position] in " \t\r\n,":
+        position += 1
+    return position
+
+
+def write_json_stream(filename, waypoints):
+    """Write waypoints (any iterable) as a JSON list, one waypoint per line."""
+    temp_name = filename + ".tmp"
+    with open(temp_name, "w") as f:
+        f.write("[")
+        separator = "\n"
+        for waypoint in waypoints:
+            f.write(separator)
+            f.write("    " + json.dumps(list(waypoint)))
+            separator = ",\n"
+        f.write("\n]\n")
+    os.replace(temp_name, filename)
+
+
+def is_binary(filename):
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_path(filename):
+    """Load a path_points list from a binary or JSON path file."""
+    if is_binary(filename):
+        return load_binary(filename).path_points()
+    return list(iter_json_waypoints(filename))
+
+
+def convert(source, destination, trajectory=None):
+    """Convert between JSON and binary, choosing the format from the extension."""
+    path_points = load_path(source)
+    if destination.endswith(".json"):
+        write_json_stream(destination, path_points)
+    else:
+        save_binary(destination, path_points, trajectory)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""Automatic path planner over the table.
+
+A* on the occupancy grid, inflated by the robot clearance with a precomputed
+Euclidean distance transform. Octile heuristics are cached per goal cell so
+repeated queries towards the same goal (strategy generation, clicking around a
+target) reuse them. Raw grid paths are shortened with line-of-sight checks and
+returned as path_points waypoints.
+
+The clearance is meant to be the inscribed radius of the robot (half its
+smallest side): the circumscribed radius would close most of the table. The
+search then only guarantees the robot fits sideways, so when a footprint is
+given every segment is checked with the oriented rectangle
+(OccupancyGrid.segment_collides): shortcuts that hit an obstacle are not
+taken, and a plan that still collides is rejected.
+"""
+import heapq
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+# Number of goal heuristics kept in memory
+HEURISTIC_CACHE_SIZE = 64
+
+SQRT2 = math.sqrt(2.0)
+
+
+def distance_transform(occupied):
+    """Exact Euclidean distance (in cells) from every cell to the nearest occupied cell.
+
+    Cells outside the array count as occupied, so the table border is an obstacle.
+    """
+    rows, cols = occupied.shape
+    padded = np.ones((rows + 2, cols + 2), dtype=bool)
+    padded[1:-1, 1:-1] = occupied
+
+    # Pass 1: distance to the nearest obstacle in the same column
+    index = np.arange(rows + 2)[:, None]
+    above = np.where(padded, index, -np.inf)
+    np.maximum.accumulate(above, axis=0, out=above)
+    below = np.where(padded, index, np.inf)
+    below = np.minimum.accumulate(below[::-1], axis=0)[::-1]
+    column_distance = np.minimum(index - above, below - index)
+
+    # Pass 2: combine columns along each row, d² = min over x' of (x - x')² + g(x')²
+    x = np.arange(cols + 2)
+    offsets = (x[:, None] - x[None, :]) ** 2
+    squared = np.min(offsets[None, :, :] + column_distance[:, None, :] ** 2, axis=2)
+    return np.sqrt(squared[1:-1, 1:-1])
+
+
+def travel_waypoint(previous, point, is_forward, levels):
+    """path_points waypoint at point, facing the direction of travel from previous."""
+    heading = math.degrees(math.atan2(point[1] - previous[1], point[0] - previous[0]))
+    if not is_forward:
+        heading += 180.0
+    return [round(point[0], 3), round(point[1], 3), heading % 360.0, is_forward] + list(levels)
+
+
+class Planner:
+    """Grid planner for poses in the 1800x1200 mm table frame."""
+
+    def __init__(self, grid, clearance_mm, footprint=None):
+        self.grid = grid
+        self.clearance_mm = clearance_mm
+        # (width_mm, length_mm) of the robot rectangle, None to check the clearance only
+        self.footprint = footprint
+        self.resolution = grid.resolution
+
+        # Distance to the nearest obstacle (mm) at every cell centre
+        self.distance_field = distance_transform(grid.to_mask()) * self.resolution
+        free = self.distance_field > clearance_mm
+
+        # Flat, padded layout so neighbours never need bounds checks
+        self.rows, self.cols = free.shape
+        self.stride = self.cols + 2
+        padded = np.zeros((self.rows + 2, self.stride), dtype=bool)
+        padded[1:-1, 1:-1] = free
+        self.free = padded.ravel().tolist()
+        s = self.stride
+        self.neighbours = [(1, 1.0), (-1, 1.0), (s, 1.0), (-s, 1.0),
+                           (s + 1, SQRT2), (s - 1, SQRT2), (-s + 1, SQRT2), (-s - 1, SQRT2)]
+
+        self.heuristics = OrderedDict()
+
+    def cell_index(self, x_mm, y_mm):
+        """Flat padded index of the cell containing a point."""
+        col = min(max(int(x_mm / self.resolution), 0), self.cols - 1)
+        row = min(max(int(y_mm / self.resolution), 0), self.rows - 1)
+        return (row + 1) * self.stride + col + 1
+
+    def cell_center(self, index):
+        """Centre (x_mm, y_mm) of a flat padded cell index."""
+        row, col = divmod(index, self.stride)
+        return (col - 0.5) * self.resolution, (row - 0.5) * self.resolution
+
+    def is_free(self, x_mm, y_mm):
+        return self.free[self.cell_index(x_mm, y_mm)]
+
+    def heuristic(self, goal):
+        """Octile distance from every cell to goal, cached per goal cell."""
+        if goal in self.heuristics:
+            self.heuristics.move_to_end(goal)
+            return self.heuristics[goal]
+
+        goal_row, goal_col = divmod(goal, self.stride)
+        rows = np.abs(np.arange(self.rows + 2) - goal_row)[:, None]
+        cols = np.abs(np.arange(self.stride) - goal_col)[None, :]
+        octile = np.maximum(rows, cols) + (SQRT2 - 1) * np.minimum(rows, cols)
+        table = octile.ravel().tolist()
+
+        self.heuristics[goal] = table
+        if len(self.heuristics) > HEURISTIC_CACHE_SIZE:
+            self.heuristics.popitem(last=False)
+        return table
+
+    def line_is_free(self, start, end):
+        """Whether the straight segment between two points keeps the clearance."""
+        length = math.hypot(end[0] - start[0], end[1] - start[1])
+        count = int(length / (self.resolution / 2)) + 2
+        xs = np.linspace(start[0], end[0], count)
+        ys = np.linspace(start[1], end[1], count)
+        cols = np.clip((xs / self.resolution).astype(int), 0, self.cols - 1)
+        rows = np.clip((ys / self.resolution).astype(int), 0, self.rows - 1)
+        return bool(np.all(self.distance_field[rows, cols] > self.clearance_mm))
+
+    def segment_is_free(self, start_pose, waypoint):
+        """Whether driving from start_pose to waypoint keeps the clearance and the footprint clear."""
+        if not self.line_is_free(start_pose[0:2], waypoint[0:2]):
+            return False
+        if self.footprint is None:
+            return True
+        return not self.grid.segment_collides(start_pose, waypoint, *self.footprint)
+
+    def search(self, start, goal):
+        """A* between two flat cell indices, returns the list of cells or None."""
+        free = self.free
+        h = self.heuristic(goal)
+        neighbours = self.neighbours
+        cost = {start: 0.0}
+        parent = {start: None}
+        heap = [(h[start], 0.0, start)]
+        closed = set()
+
+        while heap:
+            _, g, current = heapq.heappop(heap)
+            if current == goal:
+                cells = []
+                while current is not None:
+                    cells.append(current)
+                    current = parent[current]
+                return cells[::-1]
+            if current in closed:
+                continue
+            closed.add(current)
+
+            for offset, step in neighbours:
+                neighbour = current + offset
+                if not free[neighbour] or neighbour in closed:
+                    continue
+                new_cost = g + step
+                if new_cost < cost.get(neighbour, math.inf):
+                    cost[neighbour] = new_cost
+                    parent[neighbour] = current
+                    heapq.heappush(heap, (new_cost + h[neighbour], new_cost, neighbour))
+        return None
+
+    def shorten(self, start_pose, points, goal_pose, is_forward, levels):
+        """Greedy shortcutting of a polyline starting at start_pose into waypoints.
+
+        Intermediate waypoints face their direction of travel (backwards when
+        not is_forward), the last one is goal_pose. Returns the waypoints and
+        whether every segment is free.
+        """
+        last = len(points) - 1
+
+        def waypoint(previous, j):
+            if j == last:
+                return [goal_pose[0], goal_pose[1], goal_pose[2], is_forward] + list(levels)
+            return travel_waypoint(previous, points[j], is_forward, levels)
+
+        waypoints = []
+        free = True
+        pose = tuple(start_pose)
+        i = 0
+        while i < last:
+            j = last
+            candidate = waypoint(points[i], j)
+            while j > i + 1 and not self.segment_is_free(pose, candidate):
+                j -= 1
+                candidate = waypoint(points[i], j)
+            if j == i + 1:
+                free = free and self.segment_is_free(pose, candidate)
+            waypoints.append(candidate)
+            pose = tuple(candidate[0:3])
+            i = j
+        return waypoints, free
+
+    def plan(self, start_pose, goal_pose, is_forward=True, levels=(0, 0, 0, 0)):
+        """Plan from start_pose to goal_pose, both (x_mm, y_mm, angle).
+
+        Returns the path_points waypoints after the start (the last one is the
+        goal pose), or None if the goal cannot be reached with the clearance
+        or, with a footprint, without the robot rectangle hitting an obstacle.
+        Intermediate waypoints face their direction of travel.
+        """
+        start_xy = (start_pose[0], start_pose[1])
+        goal_xy = (goal_pose[0], goal_pose[1])
+        if not self.is_free(*goal_xy):
+            return None
+
+        head = []
+        start = self.cell_index(*start_xy)
+        if not self.free[start]:
+            # Start inside the inflated obstacles: first leave to the nearest free cell,
+            # the robot is already where it is so that move is not checked
+            start = self.escape(start)
+            if start is None:
+                return None
+            head = [travel_waypoint(start_xy, self.cell_center(start), is_forward, levels)]
+            start_pose = head[0][0:3]
+
+        points = [start_pose[0:2], goal_xy]
+        waypoints, free = self.shorten(start_pose, points, goal_pose, is_forward, levels)
+        if not free:
+            cells = self.search(start, self.cell_index(*goal_xy))
+            if cells is None:
+                return None
+            # Keep only the cells where the grid path changes direction
+            corners = [cells[i] for i in range(1, len(cells) - 1)
+                       if cells[i] - cells[i - 1] != cells[i + 1] - cells[i]]
+            points = [start_pose[0:2]] + [self.cell_center(c) for c in corners] + [goal_xy]
+            waypoints, free = self.shorten(start_pose, points, goal_pose, is_forward, levels)
+            if not free:
+                return None
+        return head + waypoints
+
+    def escape(self, start):
+        """Nearest free cell to a blocked start cell (breadth-first), or None."""
+        seen = {start}
+        frontier = [start]
+        limit = len(self.free)
+        while frontier:
+            next_frontier = []
+            for cell in frontier:
+                for offset, _ in self.neighbours:
+                    neighbour = cell + offset
+                    if 0 <= neighbour < limit and neighbour not in seen:
+                        if self.free[neighbour]:
+                            return neighbour
+                        seen.add(neighbour)
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        return None
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Per-stage frame timing and the profiling HUD.
+
+The viewer marks the end of each stage of a frame (event handling, physics,
+control panel, compositing...) on a FrameProfiler. While the profiler is
+disabled a mark is a single attribute test, so the timers can stay in the main
+loop. Enabled, it keeps the last HISTORY_FRAMES frame times and stage times in
+ring buffers for the HUD percentiles; the buffers and the dict of the current
+frame's stage times are reused, only a stage seen for the first time gets a new
+buffer.
+
+A capture runs cProfile over the next N frames and writes the statistics to a
+.prof file (read it with pstats or snakeviz).
+"""
+import cProfile
+import os
+import time
+
+import numpy as np
+import pygame
+
+# Frames kept for the statistics
+HISTORY_FRAMES = 300
+
+# Frames profiled by a capture
+CAPTURE_FRAMES = 120
+PROFILES_DIR = "profiles"
+
+# Seconds between two refreshes of the HUD text, so the numbers stay readable
+HUD_REFRESH = 0.25
+HUD_BACKGROUND = (0, 0, 0, 170)
+HUD_COLOR = (255, 255, 255)
+
+PERCENTILES = (50, 95, 99)
+
+
+class FrameProfiler:
+    """Lightweight timers for the stages of every frame."""
+
+    def __init__(self, history=HISTORY_FRAMES):
+        self.enabled = False
+        self.history = history
+        self.frame_times = np.zeros(history)
+        self.stage_times = {}       # stage name -> ring buffer of seconds per frame
+        self.count = 0              # Frames recorded so far
+        self.current = {}
+        self.frame_start = None
+        self.last_mark = 0.0
+
+        self.capture = None         # cProfile.Profile while capturing
+        self.capture_remaining = 0
+        self.capture_filename = None
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.frame_start = None
+        self.current.clear()
+
+    def begin_frame(self):
+        """Start timing a new frame; ends the previous one."""
+        if self.capture is not None:
+            self._capture_frame()
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            index = self.count % self.history
+            self.frame_times[index] = now - self.frame_start
+            for stage, seconds in self.current.items():
+                if stage not in self.stage_times:
+                    self.stage_times[stage] = np.zeros(self.history)
+                self.stage_times[stage][index] = seconds
+            for stage, times in self.stage_times.items():
+                if stage not in self.current:
+                    times[index] = 0.0
+            self.count += 1
+        self.current.clear()
+        self.frame_start = now
+        self.last_mark = now
+
+    def mark(self, stage):
+        """Charge the time since the previous mark to a stage."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.current[stage] = self.current.get(stage, 0.0) + now - self.last_mark
+        self.last_mark = now
+
+    def start_capture(self, frames=CAPTURE_FRAMES, filename=None):
+        """Profile the next frames with cProfile; returns the file the stats will be written to."""
+        if filename is None:
+            filename = os.path.join(PROFILES_DIR, time.strftime("frames_%Y%m%d_%H%M%S.prof"))
+        self.capture_filename = filename
+        self.capture_remaining = frames
+        self.capture = cProfile.Profile()
+        self.capture.enable()
+        return filename
+
+    def _capture_frame(self):
+        self.capture_remaining -= 1
+        if self.capture_remaining > 0:
+            return
+        self.capture.disable()
+        directory = os.path.dirname(self.capture_filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.capture.dump_stats(self.capture_filename)
+        self.capture = None
+        print("Profile of the last frames written to {}".format(self.capture_filename))
+
+    def statistics(self):
+        """FPS, frame time percentiles and mean stage times (ms) over the history."""
+        filled = min(self.count, self.history)
+        if filled == 0:
+            return None
+        frame_times = self.frame_times[:filled]
+        mean = frame_times.mean()
+        return {
+            "fps": 1.0 / mean if mean > 0 else 0.0,
+            "frame_ms": dict(zip(PERCENTILES, np.percentile(frame_times, PERCENTILES) * 1000.0)),
+            "stages_ms": {stage: times[:filled].mean() * 1000.0 for stage, times in self.stage_times.items()},
+        }
+
+
+class ProfilerHUD:
+    """Semi-transparent panel with the profiler statistics."""
+
+    def __init__(self, profiler, font, topright):
+        self.profiler = profiler
+        self.font = font
+        self.topright = topright
+        self.surface = None
+        self.updated = 0.0
+
+    @property
+    def rect(self):
+        if self.surface is None:
+            return pygame.Rect(self.topright, (0, 0))
+        return self.surface.get_rect(topright=self.topright)
+
+    def lines(self):
+        stats = self.profiler.statistics()
+        if stats is None:
+            return ["Profiler: collecting..."]
+        lines = ["FPS {:.1f}".format(stats["fps"]),
+                 "frame " + "  ".join("p{} {:.1f}".format(p, ms) for p, ms in stats["frame_ms"].items()) + " ms"]
+        for stage, ms in stats["stages_ms"].items():
+            lines.append("  {:<10} {:6.2f} ms".format(stage, ms))
+        if self.profiler.capture is not None:
+            lines.append("capturing, {} frames left".format(self.profiler.capture_remaining))
+        return lines
+
+    def update(self):
+        """Re-render the panel at most every HUD_REFRESH seconds."""
+        now = time.perf_counter()
+        if self.surface is not None and now - self.updated < HUD_REFRESH:
+            return
+        self.updated = now
+        rendered = [self.font.render(line, True, HUD_COLOR) for line in self.lines()]
+        width = max(text.get_width() for text in rendered) + 12
+        height = sum(text.get_height() for text in rendered) + 10
+        self.surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        self.surface.fill(HUD_BACKGROUND)
+        y = 5
+        for text in rendered:
+            self.surface.blit(text, (6, y))
+            y += text.get_height()
+
+    def draw(self, surface):
+        surface.blit(self.surface, self.rect)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""Session recording and deterministic replay.
+
+Every frame of the viewer appends one record per pygame input event, followed
+by one pose record with the number of physics steps of the frame, the
+interpolation factor the robot was drawn with and the robot state after it, to
+an append-only log of fixed-size records:
+    header      24 bytes: magic b"RLOG", version u16, record size u16,
+                timestep f64, padding
+    records     RECORD_DTYPE, 88 bytes each (80 bytes, without alpha, in
+                version 2 logs)
+
+Logs are opened with np.memmap, so any frame can be looked up without reading
+the whole session. Replaying feeds the recorded events through
+new_sim.handle_events headless and at full speed, and compares the robot pose
+with the recorded one every frame. Usage:
+    python recording.py recordings/session_20260101_120000.rlog
+"""
+import argparse
+import os
+import struct
+import time
+
+import numpy as np
+import pygame
+
+MAGIC = b"RLOG"
+VERSION = 3
+HEADER = struct.Struct("<4sHHd8x")
+
+RECORDINGS_DIR = "recordings"
+
+# Record kinds
+KIND_EVENT = 1
+KIND_POSE = 2
+
+# Pose record flags
+FLAG_MOVING = 0x1
+
+# Frames between two flushes of the log file
+FLUSH_FRAMES = 60
+
+RECORD_DTYPE = np.dtype({
+    "names": ["frame", "kind", "flags", "event_type", "pos_x", "pos_y", "button", "key", "mod", "unicode",
+              "rel_x", "rel_y", "time", "x", "y", "angle", "steps", "alpha"],
+    "formats": ["<u4", "u1", "u1", "<u2", "<i4", "<i4", "<i4", "<i4", "<i4", "<i4",
+                "<i4", "<i4", "<f8", "<f8", "<f8", "<f8", "<u4", "<f8"],
+    "offsets": [0, 4, 5, 6, 8, 12, 16, 20, 24, 28, 32, 36, 40, 48, 56, 64, 72, 80],
+    "itemsize": 88,
+})
+# Version 2 records: no alpha, the robot was replayed as drawn at alpha 1
+RECORD_DTYPE_V2 = np.dtype({
+    "names": list(RECORD_DTYPE.names[:-1]),
+    "formats": [RECORD_DTYPE.fields[name][0] for name in RECORD_DTYPE.names[:-1]],
+    "offsets": [RECORD_DTYPE.fields[name][1] for name in RECORD_DTYPE.names[:-1]],
+    "itemsize": 80,
+})
+
+
+def session_filename(directory=RECORDINGS_DIR):
+    """Timestamped name for a new session log."""
+    return os.path.join(directory, time.strftime("session_%Y%m%d_%H%M%S.rlog"))
+
+
+def encode_event(record, event):
+    """Store the attributes of a pygame event that the viewer uses."""
+    attributes = event.dict
+    record["event_type"] = event.type
+    if "pos" in attributes:
+        record["pos_x"], record["pos_y"] = attributes["pos"]
+    if "rel" in attributes:
+        record["rel_x"], record["rel_y"] = attributes["rel"]
+    if event.type == pygame.MOUSEWHEEL:
+        record["rel_x"], record["rel_y"] = attributes["x"], attributes["y"]
+    if "button" in attributes:
+        record["button"] = attributes["button"]
+    if "buttons" in attributes:
+        record["button"] = sum(1 << i for i, pressed in enumerate(attributes["buttons"]) if pressed)
+    record["key"] = attributes.get("key", 0)
+    record["mod"] = attributes.get("mod", 0)
+    text = attributes.get("unicode") or attributes.get("text") or ""
+    record["unicode"] = ord(text[0]) if text else 0
+
+
+def decode_event(record):
+    """Rebuild a pygame event from an event record."""
+    event_type = int(record["event_type"])
+    pos = (int(record["pos_x"]), int(record["pos_y"]))
+    text = chr(record["unicode"]) if record["unicode"] else ""
+    if event_type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP):
+        attributes = {"pos": pos, "button": int(record["button"])}
+    elif event_type == pygame.MOUSEMOTION:
+        buttons = int(record["button"])
+        attributes = {"pos": pos, "rel": (int(record["rel_x"]), int(record["rel_y"])),
+                      "buttons": tuple((buttons >> i) & 1 for i in range(3))}
+    elif event_type == pygame.MOUSEWHEEL:
+        attributes = {"x": int(record["rel_x"]), "y": int(record["rel_y"])}
+    elif event_type in (pygame.KEYDOWN, pygame.KEYUP):
+        attributes = {"key": int(record["key"]), "mod": int(record["mod"]), "unicode": text}
+    elif event_type == pygame.TEXTINPUT:
+        attributes = {"text": text}
+    else:
+        attributes = {}
+    return pygame.event.Event(event_type, attributes)
+
+
+class Recorder:
+    """Appends frames to a session log."""
+
+    def __init__(self, filename, dt):
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.filename = filename
+        self.file = open(filename, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD_DTYPE.itemsize, dt))
+        self.frame = 0
+
+    def record_frame(self, events, engine, mouse_pos, steps=1, alpha=1.0):
+        """Log the input events of one frame, its physics steps, alpha and the robot state after it."""
+        records = np.zeros(len(events) + 1, dtype=RECORD_DTYPE)
+        records["frame"] = self.frame
+        records["kind"][:-1] = KIND_EVENT
+        for record, event in zip(records[:-1], events):
+            encode_event(record, event)
+
+        pose = records[-1]
+        pose["kind"] = KIND_POSE
+        pose["flags"] = FLAG_MOVING if engine.is_moving else 0
+        pose["pos_x"], pose["pos_y"] = mouse_pos
+        pose["steps"] = steps
+        pose["alpha"] = alpha
+        pose["time"] = engine.time
+        pose["x"], pose["y"], pose["angle"] = engine.state.x, engine.state.y, engine.state.angle
+
+        self.file.write(records.tobytes())
+        self.frame += 1
+        if self.frame % FLUSH_FRAMES == 0:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SessionLog:
+    """Memory-mapped, read-only view of a session log."""
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError("{}: truncated session log".format(filename))
+        magic, version, record_size, self.dt = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("{}: not a session log".format(filename))
+        dtype = RECORD_DTYPE if version >= 3 else RECORD_DTYPE_V2
+        if version > VERSION or version < 2 or record_size != dtype.itemsize:
+            raise ValueError("{}: unsupported session log version {}".format(filename, version))
+
+        # A session that did not exit cleanly may end with a partial record
+        count = (os.path.getsize(filename) - HEADER.size) // dtype.itemsize
+        self.records = (np.memmap(filename, dtype=dtype, mode="r", offset=HEADER.size, shape=(count,))
+                        if count else np.zeros(0, dtype=dtype))
+        # Every complete frame ends with its pose record
+        self.pose_index = np.nonzero(self.records["kind"] == KIND_POSE)[0]
+
+    def __len__(self):
+        """Number of complete frames."""
+        return len(self.pose_index)
+
+    def events(self, frame):
+        """pygame events of a frame, in the order they were handled."""
+        end = self.pose_index[frame]
+        start = self.pose_index[frame - 1] + 1 if frame > 0 else 0
+        return [decode_event(record) for record in self.records[start:end]]
+
+    def pose(self, frame):
+        """(time, x, y, angle, is_moving) of the robot after a frame."""
+        record = self.records[self.pose_index[frame]]
+        return (float(record["time"]), float(record["x"]), float(record["y"]), float(record["angle"]),
+                bool(record["flags"] & FLAG_MOVING))
+
+    def steps(self, frame):
+        """Physics steps run during a frame."""
+        return int(self.records["steps"][self.pose_index[frame]])
+
+    def alpha(self, frame):
+        """Interpolation factor the robot was drawn with after a frame (1 in version 2 logs)."""
+        if "alpha" not in self.records.dtype.names:
+            return 1.0
+        return float(self.records["alpha"][self.pose_index[frame]])
+
+    def mouse_pos(self, frame):
+        record = self.records[self.pose_index[frame]]
+        return int(record["pos_x"]), int(record["pos_y"])
+
+    def poses(self):
+        """(frames, 4) array of time, x, y, angle, for plotting and scrubbing."""
+        poses = self.records[self.pose_index]
+        return np.column_stack([poses["time"], poses["x"], poses["y"], poses["angle"]])
+
+
+def replay(filename, tolerance=1e-9):
+    """Replay a session headless; returns the frames whose pose differs from the log."""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import new_sim
+
+    return new_sim.replay(SessionLog(filename), tolerance)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded session headless")
+    parser.add_argument("log", help="session log (.rlog)")
+    parser.add_argument("--tolerance", type=float, default=1e-9, help="largest pose difference (mm, degrees)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    mismatches = replay(args.log, args.tolerance)
+    elapsed = time.perf_counter() - start
+    frames = len(SessionLog(args.log))
+    print("{} frames replayed in {:.2f} s".format(frames, elapsed))
+    if mismatches:
+        print("Pose differs from the recording in {} frames, first at frame {}".format(
+            len(mismatches), mismatches[0]))
+    else:
+        print("Replay matches the recording.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Caches for surfaces that are expensive to rebuild every frame."""
+import math
+from collections import OrderedDict
+
+import pygame
+
+# Rotated sprites: angle resolution and number of surfaces kept in memory
+ROTATION_BUCKETS = 720
+ROTATION_CACHE_SIZE = 128
+
+# Rendered text: memory budget of the cached surfaces
+TEXT_CACHE_BYTES = 4 * 1024 * 1024
+
+
+class RotatedSprite:
+    """A pre-rendered rotation of a sprite with its hit-test geometry."""
+
+    def __init__(self, surface, angle, half_length):
+        self.surface = surface
+        self.center = surface.get_rect().center
+        # Centre of the sprite's front edge, relative to the rotated surface
+        self.edge_center = (self.center[0] + half_length * math.sin(math.radians(angle)),
+                            self.center[1] + half_length * math.cos(math.radians(angle)))
+
+
+class RotatedSpriteCache:
+    """Rotation atlas of one sprite, built lazily and bounded by an LRU.
+
+    Angles are quantised to ROTATION_BUCKETS steps per turn and entries are
+    keyed by (scale, angle bucket), so drawing an unchanged angle is a lookup.
+    """
+
+    def __init__(self, image, buckets=ROTATION_BUCKETS, max_size=ROTATION_CACHE_SIZE):
+        self.image = image
+        self.buckets = buckets
+        self.max_size = max_size
+        self.scaled_images = {1.0: image}
+        self.sprites = OrderedDict()
+
+    def bucket(self, angle):
+        return int(round(angle * self.buckets / 360.0)) % self.buckets
+
+    def scaled(self, scale):
+        if scale not in self.scaled_images:
+            width, height = self.image.get_size()
+            self.scaled_images[scale] = pygame.transform.smoothscale(
+                self.image, (max(int(width * scale), 1), max(int(height * scale), 1)))
+        return self.scaled_images[scale]
+
+    def get(self, angle, scale=1.0):
+        """RotatedSprite for an angle in degrees (counter-clockwise)."""
+        key = (scale, self.bucket(angle))
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            return sprite
+
+        image = self.scaled(scale)
+        bucket_angle = key[1] * 360.0 / self.buckets
+        sprite = RotatedSprite(pygame.transform.rotate(image, bucket_angle), bucket_angle,
+                               image.get_height() // 2)
+        self.sprites[key] = sprite
+        if len(self.sprites) > self.max_size:
+            self.sprites.popitem(last=False)
+        return sprite
+
+
+class TextCache:
+    """Rendered text surfaces keyed by (string, colour, font).
+
+    Labels that do not change are rendered once; the least recently used
+    surfaces are evicted when the cache exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes=TEXT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.surfaces = OrderedDict()
+
+    def render(self, font, text, color, antialias=True):
+        key = (text, tuple(color), font, antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+
+        surface = font.render(text, antialias, color)
+        self.surfaces[key] = surface
+        self.size += self.surface_bytes(surface)
+        while self.size > self.max_bytes and len(self.surfaces) > 1:
+            _, evicted = self.surfaces.popitem(last=False)
+            self.size -= self.surface_bytes(evicted)
+        return surface
+
+    @staticmethod
+    def surface_bytes(surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""Layered renderer with dirty-rectangle updates.
+
+The screen is composed from four layers, bottom to top:
+    static  background colour and the scaled map, drawn once
+    ui      the control panel, redrawn only when invalidated
+    robot   the robot sprite, redrawn where it was and where it is now
+    path    the path arrows, kept in a PathOverlay
+Overlays (the profiling HUD, the pose reported by the robot) are drawn over
+everything. Only the rectangles that changed are recomposed and passed to
+pygame.display.update(); when nothing changed no frame is drawn at all.
+"""
+import math
+
+import numpy as np
+import pygame
+
+# Path arrows
+ARROW_SIZE = 10
+ARROW_LINE_WIDTH = 3
+ARROW_MARGIN = ARROW_SIZE + ARROW_LINE_WIDTH
+
+# Pose reported by the robot controller (see hil.py)
+POSE_MARKER_COLOR = (0, 150, 255)
+POSE_MARKER_WIDTH = 2
+
+
+def draw_arrow(surface, start, end, color):
+    """Draw a path arrow between two screen points."""
+    pygame.draw.line(surface, color, start, end, ARROW_LINE_WIDTH)
+    angle = math.atan2(end[1] - start[1], end[0] - start[0])
+    pygame.draw.polygon(surface, color, [
+        (end[0], end[1]),
+        (end[0] - ARROW_SIZE * math.cos(angle - 0.5), end[1] - ARROW_SIZE * math.sin(angle - 0.5)),
+        (end[0] - ARROW_SIZE * math.cos(angle + 0.5), end[1] - ARROW_SIZE * math.sin(angle + 0.5))
+    ])
+
+
+class PathOverlay:
+    """Path arrows rendered once into an off-screen surface.
+
+    Appending a waypoint draws only the new segment. Removing segments clears
+    their area and redraws just the remaining segments that cross it, found
+    with a vectorized bounding-box test, so the cost does not grow with the
+    length of the path.
+    """
+
+    def __init__(self, size, frame):
+        self.surface = pygame.Surface(size, pygame.SRCALPHA)
+        self.frame = frame          # table_frame.TableFrame, mm -> screen
+        self.points = []            # Screen position of every waypoint
+        self.colors = []            # Colour of every segment
+        self.boxes = np.empty((64, 4))  # Segment bounding boxes (x0, y0, x1, y1)
+        self.scratch = None
+        self.dirty_rects = []
+
+    def __len__(self):
+        return len(self.colors)
+
+    def clear(self):
+        self.surface.fill((0, 0, 0, 0))
+        self.points = []
+        self.colors = []
+        self.dirty_rects.append(self.surface.get_rect())
+
+    def rebuild(self, path_points, colors):
+        """Redraw the whole overlay; colors holds one colour per segment."""
+        self.clear()
+        if len(path_points) == 0:
+            return
+        # Transform every waypoint and bound every segment in one go
+        points = self.frame.mm_to_px([point[0:2] for point in path_points])
+        starts, ends = points[:-1], points[1:]
+        boxes = np.concatenate([np.minimum(starts, ends) - ARROW_MARGIN, np.maximum(starts, ends) + ARROW_MARGIN],
+                               axis=1)
+        self.points = [tuple(point) for point in points.tolist()]
+        self.colors = list(colors)
+        self.boxes = np.empty((max(64, 2 * len(boxes)), 4))
+        self.boxes[:len(boxes)] = boxes
+        for i, color in enumerate(self.colors):
+            draw_arrow(self.surface, self.points[i], self.points[i + 1], color)
+
+    def append(self, point, color):
+        """Add a waypoint (mm); color is the colour of the segment reaching it."""
+        self.points.append(self.frame.point_to_px(point[0], point[1]))
+        if len(self.points) < 2:
+            return
+        start, end = self.points[-2], self.points[-1]
+        index = len(self.colors)
+        self.colors.append(color)
+        if index >= len(self.boxes):
+            self.boxes = np.concatenate([self.boxes, np.empty_like(self.boxes)])
+        box = (min(start[0], end[0]) - ARROW_MARGIN, min(start[1], end[1]) - ARROW_MARGIN,
+               max(start[0], end[0]) + ARROW_MARGIN, max(start[1], end[1]) + ARROW_MARGIN)
+        self.boxes[index] = box
+        draw_arrow(self.surface, start, end, color)
+        self.dirty_rects.append(self.box_rect(box))
+
+    def splice(self, path_points, change, colors):
+        """Follow a path_model.PathChange of the path; path_points is the path after it.
+
+        colors are the colours of the segments [change.first_segment,
+        change.segment_stop). Changes at the end of the path truncate and
+        append; others redraw only the area of the old and new segments.
+        """
+        inserted = path_points[change.index:change.index + change.inserted]
+        if change.at_end:
+            self.truncate(change.index)
+            segment_colors = ([None] if change.index == 0 else []) + list(colors)
+            for point, color in zip(inserted, segment_colors):
+                self.append(point, color)
+            return
+
+        first, old_stop, new_stop = change.first_segment, change.old_segment_stop, change.segment_stop
+        old_boxes = self.boxes[first:old_stop]
+        inserted_mm = np.array([point[0:2] for point in inserted], dtype=float).reshape(-1, 2)
+        points = [tuple(point) for point in self.frame.mm_to_px(inserted_mm).tolist()]
+        self.points[change.index:change.index + change.removed] = points
+
+        starts = np.array(self.points[first:new_stop], dtype=float).reshape(-1, 2)
+        ends = np.array(self.points[first + 1:new_stop + 1], dtype=float).reshape(-1, 2)
+        new_boxes = np.concatenate([np.minimum(starts, ends) - ARROW_MARGIN, np.maximum(starts, ends) + ARROW_MARGIN],
+                                   axis=1)
+        boxes = np.concatenate([self.boxes[:first], new_boxes, self.boxes[old_stop:len(self.colors)]])
+        self.colors[first:old_stop] = list(colors)
+        self.boxes = np.empty((max(64, 2 * len(boxes)), 4))
+        self.boxes[:len(boxes)] = boxes
+
+        changed = np.concatenate([old_boxes, new_boxes])
+        if len(changed):
+            self.redraw_area(self.box_rect((changed[:, 0].min(), changed[:, 1].min(),
+                                            changed[:, 2].max(), changed[:, 3].max())))
+
+    def truncate(self, count):
+        """Keep only the first count waypoints."""
+        if count >= len(self.points):
+            return
+        removed = self.boxes[max(count - 1, 0):len(self.colors)]
+        self.points = self.points[:count]
+        self.colors = self.colors[:max(count - 1, 0)]
+        if len(removed):
+            x0, y0 = removed[:, 0].min(), removed[:, 1].min()
+            x1, y1 = removed[:, 2].max(), removed[:, 3].max()
+            self.redraw_area(self.box_rect((x0, y0, x1, y1)))
+
+    def redraw_area(self, rect):
+        """Clear a rectangle and redraw the segments that cross it, in order."""
+        rect = rect.clip(self.surface.get_rect())
+        count = len(self.colors)
+        boxes = self.boxes[:count]
+        hits = np.nonzero((boxes[:, 0] < rect.right) & (boxes[:, 2] > rect.left) &
+                          (boxes[:, 1] < rect.bottom) & (boxes[:, 3] > rect.top))[0]
+
+        # Draw the crossing segments whole on a scratch surface: clipping a thick
+        # line changes its rasterisation, so drawing clipped would not match
+        if self.scratch is None:
+            self.scratch = pygame.Surface(self.surface.get_size(), pygame.SRCALPHA)
+        area = rect.unionall([self.box_rect(boxes[i]) for i in hits]) if len(hits) else rect
+        self.scratch.fill((0, 0, 0, 0), area)
+        for i in hits:
+            draw_arrow(self.scratch, self.points[i], self.points[i + 1], self.colors[i])
+
+        self.surface.fill((0, 0, 0, 0), rect)
+        self.surface.blit(self.scratch, rect, rect)
+        self.dirty_rects.append(rect)
+
+    def take_dirty_rects(self):
+        rects = self.dirty_rects
+        self.dirty_rects = []
+        return rects
+
+    @staticmethod
+    def box_rect(box):
+        x0, y0, x1, y1 = (int(math.floor(box[0])), int(math.floor(box[1])),
+                          int(math.ceil(box[2])), int(math.ceil(box[3])))
+        return pygame.Rect(x0, y0, x1 - x0 + 1, y1 - y0 + 1)
+
+
+class PoseMarker:
+    """Footprint outline and heading of a robot at a table pose, drawn as a renderer overlay.
+
+    width runs along x and length along y at angle 0, like the robot sprite.
+    """
+
+    def __init__(self, frame, width_mm, length_mm, color=POSE_MARKER_COLOR):
+        self.frame = frame
+        half_w, half_l = width_mm / 2, length_mm / 2
+        # Corners, then the centre and the heading tip
+        self.outline = np.array([(-half_w, -half_l), (half_w, -half_l), (half_w, half_l), (-half_w, half_l),
+                                 (0.0, 0.0), (max(half_w, half_l), 0.0)])
+        self.color = color
+        self.points = None
+
+    def set_pose(self, x, y, angle):
+        a = math.radians(angle)
+        cos, sin = math.cos(a), math.sin(a)
+        rotated = self.outline @ np.array([[cos, sin], [-sin, cos]]) + (x, y)
+        self.points = [tuple(point) for point in self.frame.mm_to_px(rotated).tolist()]
+
+    @property
+    def rect(self):
+        if self.points is None:
+            return pygame.Rect(0, 0, 0, 0)
+        xs, ys = [p[0] for p in self.points], [p[1] for p in self.points]
+        return PathOverlay.box_rect((min(xs), min(ys), max(xs), max(ys))).inflate(2 * POSE_MARKER_WIDTH,
+                                                                                   2 * POSE_MARKER_WIDTH)
+
+    def draw(self, surface):
+        if self.points is None:
+            return
+        pygame.draw.polygon(surface, self.color, self.points[:4], POSE_MARKER_WIDTH)
+        pygame.draw.line(surface, self.color, self.points[4], self.points[5], POSE_MARKER_WIDTH)
+
+
+class LayeredRenderer:
+    def __init__(self, screen, background_color, map_image, map_pos, ui_rect, path_overlay):
+        self.screen = screen
+        self.ui_rect = pygame.Rect(ui_rect)
+        self.path_overlay = path_overlay
+
+        # Static layer: background and map
+        self.static_layer = pygame.Surface(screen.get_size()).convert()
+        self.static_layer.fill(background_color)
+        self.static_layer.blit(map_image, map_pos)
+
+        self.ui_layer = pygame.Surface(self.ui_rect.size).convert()
+
+        self.robot_rect = None
+        self.robot_key = None
+        self.overlay_rects = []
+        self.ui_dirty = True
+        self.dirty_rects = [screen.get_rect()]
+
+    def invalidate(self):
+        """Redraw everything on the next frame."""
+        self.ui_dirty = True
+        self.dirty_rects.append(self.screen.get_rect())
+
+    def invalidate_ui(self):
+        self.ui_dirty = True
+
+    def render(self, draw_ui, draw_robot, robot_rect, robot_key, overlays=()):
+        """Recompose the dirty parts of the screen and update the display.
+
+        draw_ui and draw_robot draw their layer onto the surface they are
+        given; the path overlay reports the areas it changed itself.
+        robot_rect is the screen area of the robot sprite and robot_key
+        anything that changes when the sprite must be redrawn. overlays have
+        a rect and a draw(surface) method and are redrawn on top every frame,
+        in order. Returns False when nothing had to be drawn.
+        """
+        dirty = self.dirty_rects
+        self.dirty_rects = []
+
+        if self.ui_dirty:
+            self.ui_dirty = False
+            self.ui_layer.blit(self.static_layer, (0, 0), self.ui_rect)
+            draw_ui(self.ui_layer)
+            dirty.append(self.ui_rect)
+
+        dirty.extend(self.path_overlay.take_dirty_rects())
+
+        robot_rect = pygame.Rect(robot_rect)
+        if robot_key != self.robot_key or robot_rect != self.robot_rect:
+            if self.robot_rect is not None and self.robot_rect.colliderect(robot_rect):
+                # Small moves: one rectangle covering both positions
+                dirty.append(self.robot_rect.union(robot_rect))
+            else:
+                if self.robot_rect is not None:
+                    dirty.append(self.robot_rect)
+                dirty.append(robot_rect)
+            self.robot_rect = robot_rect
+            self.robot_key = robot_key
+
+        # Overlays change every frame and may shrink or move: redraw where they were and where they are
+        dirty.extend(self.overlay_rects)
+        self.overlay_rects = [pygame.Rect(overlay.rect) for overlay in overlays]
+        dirty.extend(self.overlay_rects)
+
+        if not dirty:
+            return False
+
+        screen_rect = self.screen.get_rect()
+        if screen_rect in dirty:
+            dirty = [screen_rect]
+        else:
+            dirty = [rect.clip(screen_rect) for rect in dirty]
+        for rect in dirty:
+            self.compose(rect, draw_robot)
+        for overlay in overlays:
+            overlay.draw(self.screen)
+        pygame.display.update(dirty)
+        return True
+
+    def compose(self, rect, draw_robot):
+        """Redraw one screen rectangle from the layers."""
+        screen = self.screen
+        screen.set_clip(rect)
+        screen.blit(self.static_layer, rect, rect)
+        ui_part = rect.clip(self.ui_rect)
+        if ui_part.width and ui_part.height:
+            screen.blit(self.ui_layer, ui_part, ui_part.move(-self.ui_rect.x, -self.ui_rect.y))
+        if rect.colliderect(self.robot_rect):
+            draw_robot(screen)
+        screen.blit(self.path_overlay.surface, rect, rect)
+        screen.set_clip(None)
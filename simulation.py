@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""Headless robot simulation engine.
+
+Holds the robot kinematic state and the planned path in table millimetres and
+advances it with a fixed timestep. Nothing in here touches pygame or a display,
+so a whole match can be simulated much faster than real time.
+
+Motion follows the trapezoidal profiles of motion_profile.py, precomputed when
+the path is set and compiled into a trajectory table when a run starts. Each
+step, seek or pause/reset is then a binary-search lookup in that table.
+
+Physics runs at a fixed rate in SI units (mm, degrees, seconds). A
+SimulationClock converts the variable real time between displayed frames into
+a whole number of physics steps at the chosen time scale, and the viewer draws
+the robot interpolated between the last two physics states.
+"""
+from motion_profile import PathProfile, normalize_angle
+from trajectory import Trajectory
+
+# Table dimensions (mm)
+TABLE_WIDTH_MM = 1800
+TABLE_HEIGHT_MM = 1200
+
+# Default physics rate (Hz) and fixed timestep (s)
+DEFAULT_PHYSICS_RATE = 1000.0
+DEFAULT_DT = 1.0 / DEFAULT_PHYSICS_RATE
+
+# Simulated seconds per real second offered by the viewer; None runs as fast as possible
+TIME_SCALES = (1.0, 10.0, None)
+
+# Longest real frame time simulated at once (s), so a stall does not snowball
+MAX_FRAME_TIME = 0.25
+# Real time per frame spent on physics when running as fast as possible (s)
+FAST_FRAME_BUDGET = 0.012
+
+# Safety limit for run_until_complete (s of simulated time)
+MAX_SIMULATION_TIME = 1000.0
+
+
+class RobotState:
+    """Kinematic state of the robot in table coordinates."""
+
+    def __init__(self, x=TABLE_WIDTH_MM / 2, y=TABLE_HEIGHT_MM / 2, angle=0.0, is_forward=True):
+        self.x = x            # mm
+        self.y = y            # mm
+        self.angle = angle    # degrees, 0 = East, counter-clockwise
+        self.is_forward = is_forward
+
+    def copy(self):
+        return RobotState(self.x, self.y, self.angle, self.is_forward)
+
+    def __repr__(self):
+        return "RobotState(x={:.2f}, y={:.2f}, angle={:.2f}, is_forward={})".format(
+            self.x, self.y, self.angle, self.is_forward)
+
+
+class SimulationEngine:
+    """Fixed-timestep path follower, independent of any display."""
+
+    def __init__(self, path_points=None, state=None, dt=DEFAULT_DT):
+        self.state = state if state is not None else RobotState()
+        self.dt = dt
+        self.time = 0.0
+        self.velocity = 0.0          # mm/s along the current segment
+        self.angular_velocity = 0.0  # deg/s
+        self.previous_state = None   # State before the last step, for interpolation
+
+        # Path following
+        self.is_moving = False
+        self.is_complete = False
+        self.current_waypoint_index = 0
+        self.active_profile = None
+        self.trajectory = None
+        self.set_path(path_points or [])
+
+    def set_path(self, path_points):
+        """Replace the planned path (list of waypoints in mm) and precompute its profile."""
+        self.path_points = list(path_points)
+        self._use_profile(PathProfile(self.path_points))
+
+    def splice_path(self, path_points, change):
+        """Like set_path after a path_model.PathChange, rebuilding only the segments that changed.
+
+        path_points is kept, not copied: it is the live list of the path model.
+        """
+        self.path_points = path_points
+        self.profile.splice(path_points, change)
+        self._use_profile(self.profile)
+
+    def _use_profile(self, profile):
+        self.profile = profile
+        self.active_profile = None
+        self.trajectory = None
+        self.is_moving = False
+        self.is_complete = False
+        self.current_waypoint_index = 0
+
+    def set_pose(self, x, y, angle):
+        """Teleport the robot to a pose in mm / degrees."""
+        self.state.x = x
+        self.state.y = y
+        self.state.angle = angle
+
+    def prepare(self):
+        """Compile the run from the current pose to the end of the path, without moving."""
+        state = self.state
+        self.active_profile = self.profile.with_start((state.x, state.y, state.angle))
+        self.trajectory = Trajectory.from_profile(self.active_profile)
+        self.is_complete = False
+        self.time = 0.0
+        self.current_waypoint_index = 0
+        self.previous_state = None
+
+    def start(self):
+        """Start (or restart) following the path from the current pose."""
+        if len(self.path_points) > 0:
+            self.prepare()
+            self.is_moving = True
+
+    def pause(self):
+        """Stop advancing the robot, keeping the progress along the path."""
+        self.is_moving = False
+        self.velocity = 0.0
+        self.angular_velocity = 0.0
+
+    def resume(self):
+        """Continue following the path after a pause."""
+        if self.trajectory is not None and not self.is_complete:
+            self.is_moving = True
+
+    def reset(self):
+        """Put the robot back on the first waypoint."""
+        self.pause()
+        self.is_complete = False
+        self.active_profile = None
+        self.trajectory = None
+        self.time = 0.0
+        self.current_waypoint_index = 0
+        self.previous_state = None
+        if len(self.path_points) > 0:
+            start_point = self.path_points[0]
+            self.set_pose(start_point[0], start_point[1], start_point[2])
+
+    @property
+    def duration(self):
+        """Duration (s) of the active run, or of the path itself when idle."""
+        if self.trajectory is not None:
+            return self.trajectory.duration
+        return self.profile.duration
+
+    def interpolated_state(self, alpha):
+        """State a fraction alpha (0-1) of the way from the previous step to the current one."""
+        previous = self.previous_state
+        state = self.state
+        if previous is None or alpha >= 1.0:
+            return state.copy()
+        return RobotState(previous.x + (state.x - previous.x) * alpha,
+                          previous.y + (state.y - previous.y) * alpha,
+                          (previous.angle + normalize_angle(state.angle - previous.angle) * alpha) % 360.0,
+                          state.is_forward)
+
+    def state_at(self, t):
+        """(x, y, angle, v, omega) of the active run at time t, without changing the state."""
+        if self.trajectory is None:
+            return None
+        return self.trajectory.state_at(t)
+
+    def seek(self, t):
+        """Jump to time t of the run, compiling it from the current pose if needed."""
+        if len(self.path_points) == 0:
+            return
+        if self.trajectory is None:
+            self.prepare()
+        self.time = min(max(t, 0.0), self.trajectory.duration)
+        self._apply_time()
+        self.previous_state = None
+
+    def step(self, dt=None):
+        """Advance the simulation by dt seconds (defaults to the fixed timestep)."""
+        if dt is None:
+            dt = self.dt
+        if not self.is_moving:
+            return
+
+        self.previous_state = self.state.copy()
+        self.time = min(self.time + dt, self.trajectory.duration)
+        self._apply_time()
+
+    def _apply_time(self):
+        x, y, angle, self.velocity, self.angular_velocity = self.trajectory.state_at(self.time)
+        self.set_pose(x, y, angle % 360.0)
+        self.current_waypoint_index = self.active_profile.segment_index(self.time)
+
+        if self.time >= self.trajectory.duration:
+            # Path completed
+            self.current_waypoint_index = len(self.path_points)
+            self.is_moving = False
+            self.is_complete = True
+        else:
+            self.is_complete = False
+
+    def run_until_complete(self, max_time=MAX_SIMULATION_TIME):
+        """Run the whole path headless and return the simulated duration (s)."""
+        if not self.is_moving and not self.is_complete:
+            self.start()
+        while self.is_moving and self.time < max_time:
+            self.step()
+        return self.time
+
+
+class SimulationClock:
+    """Turns real frame times into fixed physics steps.
+
+    With a time scale, real time is accumulated and consumed in whole steps;
+    the remainder gives the interpolation factor alpha for drawing. With
+    time_scale None the simulation runs as fast as possible: each frame gets
+    as many steps as fit in FAST_FRAME_BUDGET, estimated from the measured
+    cost of a step.
+    """
+
+    def __init__(self, dt=DEFAULT_DT, time_scale=1.0):
+        self.dt = dt
+        self.time_scale = time_scale
+        self.accumulator = 0.0
+        self.fast_steps = 100
+        self.step_cost = None   # Measured real seconds per step
+
+    def set_time_scale(self, time_scale):
+        self.time_scale = time_scale
+        self.accumulator = 0.0
+
+    def reset(self):
+        """Drop the accumulated time, e.g. while nothing moves."""
+        self.accumulator = 0.0
+
+    def frame_steps(self, real_elapsed):
+        """Number of physics steps to run for a frame after real_elapsed seconds."""
+        if self.time_scale is None:
+            self.accumulator = 0.0
+            return self.fast_steps
+        self.accumulator += min(real_elapsed, MAX_FRAME_TIME) * self.time_scale
+        steps = int(self.accumulator / self.dt)
+        self.accumulator -= steps * self.dt
+        return steps
+
+    def measure(self, steps, elapsed):
+        """Record how long steps physics steps took, to size the fast-mode frames."""
+        if steps <= 0 or elapsed <= 0:
+            return
+        cost = elapsed / steps
+        self.step_cost = cost if self.step_cost is None else 0.8 * self.step_cost + 0.2 * cost
+        self.fast_steps = max(int(FAST_FRAME_BUDGET / self.step_cost), 1)
+
+    @property
+    def alpha(self):
+        """Fraction of a step between the last physics state and the frame time."""
+        if self.time_scale is None:
+            return 1.0
+        return min(self.accumulator / self.dt, 1.0)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""Monte Carlo robustness sweep of a path.
+
+Runs thousands of headless executions of one path with a perturbed start pose,
+randomly drawn speed and acceleration levels, wheel slip and per-step odometry
+noise, spread over all cores with a process pool, and reports completion-time
+and final-pose-error statistics.
+
+Execution is open loop, like the simulator: the robot plays back the
+trajectory table of the path (see trajectory.py), but every commanded
+displacement is scaled by the slip and noise of that run and rotated by the
+heading error accumulated so far. Start-pose errors are carried through the
+whole run.
+
+Runs are split into fixed-size chunks, each seeded from its own child of one
+np.random.SeedSequence, so a sweep gives the same result whatever the number
+of workers. Usage:
+    python sweep.py path_points.json --runs 5000 --seed 1
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from motion_profile import (
+    X, Y, ANGLE, LINEAR_VELOCITY, ANGULAR_VELOCITY, LINEAR_ACCELERATION, ANGULAR_ACCELERATION, normalize_angle,
+)
+from trajectory import Trajectory, X as SAMPLE_X, Y as SAMPLE_Y, THETA
+
+# Runs simulated by one task of the pool
+DEFAULT_CHUNK_SIZE = 250
+
+# Trajectory samples per second used for the noise integration
+SWEEP_SAMPLE_RATE = 100.0
+
+PERCENTILES = (50, 95, 99)
+
+# path_points fields of the levels drawn per run, in SweepConfig order
+LEVEL_FIELDS = (LINEAR_VELOCITY, ANGULAR_VELOCITY, LINEAR_ACCELERATION, ANGULAR_ACCELERATION)
+
+
+class SweepConfig:
+    """Distributions of the perturbations applied to every run.
+
+    Standard deviations are of normal distributions. The level tuples list the
+    slider levels drawn uniformly for each run and applied to every waypoint;
+    None keeps the levels stored in the path.
+    """
+
+    def __init__(self, start_xy_std=10.0, start_angle_std=1.0,
+                 linear_velocity_levels=None, angular_velocity_levels=None,
+                 linear_acceleration_levels=None, angular_acceleration_levels=None,
+                 slip_mean=0.0, slip_std=0.01, wheel_noise=0.02, sample_rate=SWEEP_SAMPLE_RATE):
+        self.start_xy_std = start_xy_std        # mm, on x and y
+        self.start_angle_std = start_angle_std  # degrees
+        self.linear_velocity_levels = linear_velocity_levels
+        self.angular_velocity_levels = angular_velocity_levels
+        self.linear_acceleration_levels = linear_acceleration_levels
+        self.angular_acceleration_levels = angular_acceleration_levels
+        self.slip_mean = slip_mean              # fraction of every displacement lost, per run
+        self.slip_std = slip_std
+        self.wheel_noise = wheel_noise          # relative error of each sampled step
+        self.sample_rate = sample_rate
+
+
+class SweepResult:
+    """Per-run outcomes of a sweep, in run order."""
+
+    def __init__(self, completion_time, final_pose, target_pose):
+        self.completion_time = completion_time  # s, shape (N,)
+        self.final_pose = final_pose            # (x, y, angle), shape (N, 3)
+        self.target_pose = target_pose          # last waypoint (x, y, angle)
+        self.position_error = np.hypot(final_pose[:, 0] - target_pose[0], final_pose[:, 1] - target_pose[1])
+        self.angle_error = normalize_angle(final_pose[:, 2] - target_pose[2])
+
+    def __len__(self):
+        return len(self.completion_time)
+
+    def summary(self):
+        """Mean, standard deviation, percentiles and maximum of every metric."""
+        metrics = {
+            "completion_time_s": self.completion_time,
+            "position_error_mm": self.position_error,
+            "angle_error_deg": np.abs(self.angle_error),
+        }
+        summary = {}
+        for name, values in metrics.items():
+            stats = {"mean": float(values.mean()), "std": float(values.std())}
+            for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                stats["p{}".format(p)] = float(value)
+            stats["max"] = float(values.max())
+            summary[name] = stats
+        return summary
+
+
+def _nominal_steps(path_points, levels, sample_rate):
+    """Commanded start pose, duration and per-step displacements for one level choice.
+
+    levels holds one level per LEVEL_FIELDS entry, None to keep the path's own.
+    """
+    points = [list(point) for point in path_points]
+    for point in points:
+        for field, level in zip(LEVEL_FIELDS, levels):
+            if level is not None:
+                point[field] = level
+    trajectory = Trajectory.from_path(points, sample_rate=sample_rate)
+    samples = trajectory.samples
+    start = samples[0, [SAMPLE_X, SAMPLE_Y, THETA]]
+    steps = np.diff(samples[:, [SAMPLE_X, SAMPLE_Y, THETA]], axis=0)
+    return start, trajectory.duration, steps
+
+
+def _simulate(start, steps, start_error, slip, rng, wheel_noise):
+    """Final poses of a group of runs sharing the same commanded steps (vectorized)."""
+    runs = len(slip)
+    translation_noise = 1.0 + wheel_noise * rng.standard_normal((runs, len(steps)))
+    rotation_noise = 1.0 + wheel_noise * rng.standard_normal((runs, len(steps)))
+
+    # Heading error before every step: start error plus the rotation errors so far
+    rotation_error = steps[:, 2] * (rotation_noise - 1.0)
+    heading_error = np.empty((runs, len(steps)))
+    heading_error[:, 0] = start_error[:, 2]
+    heading_error[:, 1:] = start_error[:, 2:3] + np.cumsum(rotation_error[:, :-1], axis=1)
+    cos = np.cos(np.radians(heading_error))
+    sin = np.sin(np.radians(heading_error))
+
+    scale = (1.0 - slip)[:, None] * translation_noise
+    dx = scale * (steps[:, 0] * cos - steps[:, 1] * sin)
+    dy = scale * (steps[:, 0] * sin + steps[:, 1] * cos)
+
+    final = np.empty((runs, 3))
+    final[:, 0] = start[0] + start_error[:, 0] + dx.sum(axis=1)
+    final[:, 1] = start[1] + start_error[:, 1] + dy.sum(axis=1)
+    final[:, 2] = (start[2] + start_error[:, 2] + steps[:, 2].sum() + rotation_error.sum(axis=1)) % 360.0
+    return final
+
+
+def _choices(rng, levels, count):
+    if levels is None:
+        return [None] * count
+    return rng.choice(levels, size=count).tolist()
+
+
+def run_chunk(path_points, config, seed_sequence, count):
+    """Simulate count runs; returns (completion_time, final_pose) arrays."""
+    rng = np.random.default_rng(seed_sequence)
+    start_error = np.column_stack([rng.normal(0.0, config.start_xy_std, (count, 2)),
+                                   rng.normal(0.0, config.start_angle_std, count)])
+    slip = rng.normal(config.slip_mean, config.slip_std, count)
+    levels = zip(_choices(rng, config.linear_velocity_levels, count),
+                 _choices(rng, config.angular_velocity_levels, count),
+                 _choices(rng, config.linear_acceleration_levels, count),
+                 _choices(rng, config.angular_acceleration_levels, count))
+
+    completion_time = np.empty(count)
+    final_pose = np.empty((count, 3))
+    # Runs drawing the same levels share one trajectory and are simulated together
+    groups = {}
+    for i, key in enumerate(levels):
+        groups.setdefault(key, []).append(i)
+    for key, runs in groups.items():
+        runs = np.array(runs)
+        start, duration, steps = _nominal_steps(path_points, key, config.sample_rate)
+        completion_time[runs] = duration
+        if len(steps):
+            final_pose[runs] = _simulate(start, steps, start_error[runs], slip[runs], rng, config.wheel_noise)
+        else:
+            final_pose[runs] = start + start_error[runs]
+    return completion_time, final_pose
+
+
+def run_sweep(path_points, runs=1000, config=None, seed=0, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Run a Monte Carlo sweep of path_points and return a SweepResult.
+
+    workers is the number of processes (default: all cores); with 1 the
+    chunks run in this process.
+    """
+    if len(path_points) == 0:
+        raise ValueError("cannot sweep an empty path")
+    config = config if config is not None else SweepConfig()
+    path_points = [list(point) for point in path_points]
+
+    counts = [min(chunk_size, runs - start) for start in range(0, runs, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    results = [None] * len(counts)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(counts) <= 1:
+        for i, (seed_sequence, count) in enumerate(zip(seeds, counts)):
+            results[i] = run_chunk(path_points, config, seed_sequence, count)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(counts))) as pool:
+            futures = {pool.submit(run_chunk, path_points, config, seed_sequence, count): i
+                       for i, (seed_sequence, count) in enumerate(zip(seeds, counts))}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+    completion_time = np.concatenate([result[0] for result in results]) if results else np.empty(0)
+    final_pose = np.concatenate([result[1] for result in results]) if results else np.empty((0, 3))
+    last = path_points[-1]
+    return SweepResult(completion_time, final_pose, (last[X], last[Y], last[ANGLE]))
+
+
+def main():
+    from pathfile import load_path
+
+    parser = argparse.ArgumentParser(description="Monte Carlo robustness sweep of a saved path")
+    parser.add_argument("path", nargs="?", default="path_points.json", help="path file (.json or .rpth)")
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--start-xy-std", type=float, default=10.0, help="mm")
+    parser.add_argument("--start-angle-std", type=float, default=1.0, help="degrees")
+    parser.add_argument("--slip-mean", type=float, default=0.0)
+    parser.add_argument("--slip-std", type=float, default=0.01)
+    parser.add_argument("--wheel-noise", type=float, default=0.02)
+    parser.add_argument("--linear-levels", type=int, nargs="+", default=None,
+                        help="linear velocity levels drawn per run")
+    parser.add_argument("--angular-levels", type=int, nargs="+", default=None,
+                        help="angular velocity levels drawn per run")
+    parser.add_argument("--linear-acceleration-levels", type=int, nargs="+", default=None,
+                        help="linear acceleration levels drawn per run")
+    parser.add_argument("--angular-acceleration-levels", type=int, nargs="+", default=None,
+                        help="angular acceleration levels drawn per run")
+    args = parser.parse_args()
+
+    config = SweepConfig(args.start_xy_std, args.start_angle_std, args.linear_levels, args.angular_levels,
+                         args.linear_acceleration_levels, args.angular_acceleration_levels,
+                         args.slip_mean, args.slip_std, args.wheel_noise)
+    result = run_sweep(load_path(args.path), args.runs, config, args.seed, args.workers)
+    print("{} runs of {}".format(len(result), args.path))
+    for name, stats in result.summary().items():
+        print("  {:<20} ".format(name) + "  ".join("{} {:.3f}".format(k, v) for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
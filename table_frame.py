@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Transforms between table millimetres and screen pixels.
+
+The table frame has its origin in the bottom left corner with y growing
+upwards; the screen has its origin in the top left corner with y growing
+downwards. A TableFrame maps the whole table onto a viewport rectangle of the
+screen, optionally zoomed in around a point of the table, as a pair of affine
+matrices (mm -> px and px -> mm) computed once. Arrays of points of any shape
+(..., 2) are converted in one NumPy call; point_to_px and point_to_mm are the
+scalar versions for single points.
+"""
+import numpy as np
+
+from simulation import TABLE_WIDTH_MM, TABLE_HEIGHT_MM
+
+MIN_ZOOM = 1.0
+MAX_ZOOM = 20.0
+
+
+class TableFrame:
+    """Affine mm <-> px transform of a table shown in a screen viewport.
+
+    viewport is the (x, y, width, height) screen rectangle the whole table
+    fills at zoom 1. Zooming keeps the viewport and shows a smaller part of
+    the table, centred on center_mm.
+    """
+
+    def __init__(self, viewport, width_mm=TABLE_WIDTH_MM, height_mm=TABLE_HEIGHT_MM):
+        self.viewport = tuple(float(value) for value in viewport)
+        self.width_mm = float(width_mm)
+        self.height_mm = float(height_mm)
+        self.zoom = 1.0
+        self.center_mm = (self.width_mm / 2, self.height_mm / 2)
+        self._update()
+
+    def _update(self):
+        x, y, width, height = self.viewport
+        sx = width / self.width_mm * self.zoom
+        sy = height / self.height_mm * self.zoom
+        # px = A @ mm + b, with the y axis flipped
+        self.mm_to_px_matrix = np.array([[sx, 0.0, x + width / 2 - sx * self.center_mm[0]],
+                                         [0.0, -sy, y + height / 2 + sy * self.center_mm[1]],
+                                         [0.0, 0.0, 1.0]])
+        self.px_to_mm_matrix = np.linalg.inv(self.mm_to_px_matrix)
+        # Coefficients of the scalar versions
+        self._sx, self._sy = sx, sy
+        self._bx, self._by = float(self.mm_to_px_matrix[0, 2]), float(self.mm_to_px_matrix[1, 2])
+
+    @property
+    def px_per_mm(self):
+        """(x, y) scale of the transform, positive."""
+        return self._sx, self._sy
+
+    def set_view(self, zoom=1.0, center_mm=None):
+        """Zoom (1 = whole table) around a table point, clamped so the view stays on the table."""
+        self.zoom = min(max(float(zoom), MIN_ZOOM), MAX_ZOOM)
+        if center_mm is None:
+            center_mm = self.center_mm
+        half_w = self.width_mm / (2 * self.zoom)
+        half_h = self.height_mm / (2 * self.zoom)
+        self.center_mm = (min(max(float(center_mm[0]), half_w), self.width_mm - half_w),
+                          min(max(float(center_mm[1]), half_h), self.height_mm - half_h))
+        self._update()
+
+    def zoom_at(self, factor, px):
+        """Multiply the zoom by factor, keeping the table point under the screen point px fixed."""
+        before = self.point_to_mm(px[0], px[1], clamp=False)
+        zoom = min(max(self.zoom * factor, MIN_ZOOM), MAX_ZOOM)
+        # Centre such that before maps to px again at the new zoom
+        x, y, width, height = self.viewport
+        sx = width / self.width_mm * zoom
+        sy = height / self.height_mm * zoom
+        self.set_view(zoom, (before[0] - (px[0] - x - width / 2) / sx,
+                             before[1] + (px[1] - y - height / 2) / sy))
+
+    def pan(self, dx_px, dy_px):
+        """Move the view so the table follows a drag of (dx_px, dy_px) pixels."""
+        self.set_view(self.zoom, (self.center_mm[0] - dx_px / self._sx, self.center_mm[1] + dy_px / self._sy))
+
+    def mm_to_px(self, points):
+        """Screen positions of an (..., 2) array of table points (mm)."""
+        points = np.asarray(points, dtype=float)
+        matrix = self.mm_to_px_matrix
+        return points @ matrix[:2, :2].T + matrix[:2, 2]
+
+    def px_to_mm(self, points, clamp=True):
+        """Table points (mm) of an (..., 2) array of screen positions, clamped to the table."""
+        points = np.asarray(points, dtype=float)
+        matrix = self.px_to_mm_matrix
+        mm = points @ matrix[:2, :2].T + matrix[:2, 2]
+        if clamp:
+            np.clip(mm, 0.0, (self.width_mm, self.height_mm), out=mm)
+        return mm
+
+    def point_to_px(self, x_mm, y_mm):
+        """Screen position (x, y) of one table point."""
+        return self._sx * x_mm + self._bx, self._by - self._sy * y_mm
+
+    def point_to_mm(self, x_px, y_px, clamp=True):
+        """Table point (x_mm, y_mm) of one screen position, clamped to the table."""
+        x_mm = (x_px - self._bx) / self._sx
+        y_mm = (self._by - y_px) / self._sy
+        if clamp:
+            x_mm = min(max(x_mm, 0.0), self.width_mm)
+            y_mm = min(max(y_mm, 0.0), self.height_mm)
+        return x_mm, y_mm
+
+    def table_rect(self):
+        """(x, y, width, height) of the whole table on the screen."""
+        x0, y0 = self.point_to_px(0.0, self.height_mm)
+        x1, y1 = self.point_to_px(self.width_mm, 0.0)
+        return x0, y0, x1 - x0, y1 - y0
+
+    def contains_px(self, x_px, y_px):
+        """Whether a screen position lies inside the viewport."""
+        x, y, width, height = self.viewport
+        return x < x_px < x + width and y < y_px < y + height
+
+    def __repr__(self):
+        return "TableFrame(viewport={}, table={:g}x{:g} mm, zoom={:g}, center={})".format(
+            self.viewport, self.width_mm, self.height_mm, self.zoom, self.center_mm)
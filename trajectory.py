@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Time-indexed trajectory table.
+
+A path profile compiled into NumPy arrays of (t, x_mm, y_mm, theta, v, omega)
+samples. Any time can be looked up with a binary search and a linear
+interpolation, so seeking, scrubbing and replaying never re-simulate the path.
+"""
+import numpy as np
+
+from motion_profile import PathProfile
+
+# Samples per second of simulated time
+DEFAULT_SAMPLE_RATE = 200.0
+
+# Column indices of the table
+T, X, Y, THETA, V, OMEGA = range(6)
+COLUMNS = ("t", "x", "y", "theta", "v", "omega")
+
+
+def sample_trapezoid(profile, t):
+    """Vectorized TrapezoidProfile.sample(): (position, velocity) arrays for times t."""
+    a = profile.max_acceleration
+    t_accel = profile.accel_time
+    t_brake = profile.accel_time + profile.cruise_time
+    remaining = profile.duration - t
+    length = abs(profile.distance)
+
+    position = np.select(
+        [t <= 0, t < t_accel, t < t_brake, t < profile.duration],
+        [0.0, 0.5 * a * t * t, profile.accel_distance + profile.peak_velocity * (t - t_accel),
+         length - 0.5 * a * remaining * remaining],
+        length)
+    velocity = np.select(
+        [t <= 0, t < t_accel, t < t_brake, t < profile.duration],
+        [0.0, a * t, profile.peak_velocity, a * remaining],
+        0.0)
+    return profile.sign * position, profile.sign * velocity
+
+
+def segment_samples(segment, sample_rate=DEFAULT_SAMPLE_RATE):
+    """Sample table of one SegmentProfile, times relative to the segment start.
+
+    The table is cached on the segment, so segments shared between runs
+    (see PathProfile.with_start) are only sampled once.
+    """
+    cache = segment.sample_cache
+    if sample_rate in cache:
+        return cache[sample_rate]
+
+    count = max(int(np.ceil(segment.duration * sample_rate)), 1)
+    t = np.linspace(0.0, segment.duration, count + 1)
+    distance, v = sample_trapezoid(segment.translation, t)
+    rotation, omega = sample_trapezoid(segment.turn, t)
+
+    table = np.empty((len(t), 6))
+    table[:, T] = t
+    table[:, X] = segment.start_x + segment.direction[0] * distance
+    table[:, Y] = segment.start_y + segment.direction[1] * distance
+    table[:, THETA] = segment.start_angle + rotation
+    table[:, V] = v
+    table[:, OMEGA] = omega
+    # Land exactly on the waypoint
+    table[-1, X:THETA + 1] = segment.end_x, segment.end_y, segment.start_angle + segment.rotation
+
+    cache[sample_rate] = table
+    return table
+
+
+class Trajectory:
+    """Immutable table of trajectory samples with O(log n) lookup by time."""
+
+    def __init__(self, samples):
+        self.samples = np.ascontiguousarray(samples, dtype=float)
+        self.times = self.samples[:, T]
+
+    @classmethod
+    def from_profile(cls, profile, sample_rate=DEFAULT_SAMPLE_RATE):
+        """Compile a PathProfile into a trajectory table."""
+        if len(profile.segments) == 0:
+            x, y, theta, v, omega = profile.sample(0.0) or (0.0, 0.0, 0.0, 0.0, 0.0)
+            return cls(np.array([[0.0, x, y, theta, v, omega]]))
+
+        tables = []
+        for index, (segment, start_time) in enumerate(zip(profile.segments, profile.start_times)):
+            table = segment_samples(segment, sample_rate)
+            # Drop the first sample of later segments: it duplicates the previous end
+            table = table if index == 0 else table[1:]
+            table = table.copy()
+            table[:, T] += start_time
+            tables.append(table)
+        samples = np.concatenate(tables)
+
+        # Waypoint angles are not unwrapped between segments; make theta continuous
+        samples[:, THETA] = np.degrees(np.unwrap(np.radians(samples[:, THETA])))
+        return cls(samples)
+
+    @classmethod
+    def from_path(cls, path_points, start_pose=None, sample_rate=DEFAULT_SAMPLE_RATE):
+        """Compile path_points, optionally starting from start_pose (x, y, angle)."""
+        profile = PathProfile(path_points)
+        if start_pose is not None:
+            profile = profile.with_start(start_pose)
+        return cls.from_profile(profile, sample_rate)
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def duration(self):
+        return float(self.times[-1])
+
+    def index_at(self, t):
+        """Index of the last sample at or before time t."""
+        index = int(np.searchsorted(self.times, t, side="right")) - 1
+        return min(max(index, 0), len(self.samples) - 1)
+
+    def state_at(self, t):
+        """Interpolated (x, y, theta, v, omega) at time t (clamped to the trajectory)."""
+        index = self.index_at(t)
+        if index >= len(self.samples) - 1:
+            row = self.samples[-1]
+            return float(row[X]), float(row[Y]), float(row[THETA]), float(row[V]), float(row[OMEGA])
+
+        before = self.samples[index]
+        after = self.samples[index + 1]
+        span = after[T] - before[T]
+        alpha = (t - before[T]) / span if span > 0 else 0.0
+        alpha = min(max(alpha, 0.0), 1.0)
+        row = before + (after - before) * alpha
+        return float(row[X]), float(row[Y]), float(row[THETA]), float(row[V]), float(row[OMEGA])
+
+    def states_at(self, times):
+        """Interpolated states for an array of times, shape (len(times), 5)."""
+        times = np.clip(np.asarray(times, dtype=float), self.times[0], self.times[-1])
+        return np.column_stack([np.interp(times, self.times, self.samples[:, column])
+                                for column in (X, Y, THETA, V, OMEGA)])
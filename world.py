@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Headless multi-robot world.
+
+Holds several robots, each with its own path and SimulationEngine, steps them
+together and reports robot-robot contacts. Candidate pairs come from a uniform
+grid spatial hash whose cells are as large as the contact range, so each robot
+is only tested against the robots in its own and the adjacent cells instead of
+every other robot. Candidates are then tested exactly: the gap between the
+bounding circles for proximity, and a separating-axis test of the two
+footprint rectangles for collisions.
+"""
+import math
+
+from simulation import SimulationEngine, RobotState, DEFAULT_DT, MAX_SIMULATION_TIME
+
+# Default robot footprint (mm), width along x and length along y at angle 0
+ROBOT_WIDTH_MM = 400.0
+ROBOT_LENGTH_MM = 370.0
+
+# Bounding-circle gap under which two robots are reported as close (mm)
+PROXIMITY_MM = 100.0
+
+# Neighbour cells visited from each cell; the other half is visited from the neighbours
+_FORWARD_CELLS = ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+
+
+class WorldRobot:
+    """One robot of the world: a name, a team, a footprint and its engine."""
+
+    def __init__(self, name, engine, width_mm=ROBOT_WIDTH_MM, length_mm=ROBOT_LENGTH_MM, team=None):
+        self.name = name
+        self.engine = engine
+        self.width_mm = width_mm
+        self.length_mm = length_mm
+        self.team = team
+        self.radius = math.hypot(width_mm, length_mm) / 2
+
+    @property
+    def state(self):
+        return self.engine.state
+
+    def corners(self):
+        """Footprint corners (x, y) in table millimetres."""
+        state = self.engine.state
+        cos = math.cos(math.radians(state.angle))
+        sin = math.sin(math.radians(state.angle))
+        half_w, half_l = self.width_mm / 2, self.length_mm / 2
+        return [(state.x + dx * cos - dy * sin, state.y + dx * sin + dy * cos)
+                for dx, dy in ((-half_w, -half_l), (half_w, -half_l), (half_w, half_l), (-half_w, half_l))]
+
+    def __repr__(self):
+        return "WorldRobot({!r}, {})".format(self.name, self.engine.state)
+
+
+class Contact:
+    """Two robots within the proximity range of each other at some time."""
+
+    def __init__(self, time, first, second, gap, colliding):
+        self.time = time
+        self.first = first          # WorldRobot
+        self.second = second
+        self.gap = gap              # mm between the bounding circles, negative when they overlap
+        self.colliding = colliding  # footprints intersect
+
+    def __repr__(self):
+        return "Contact(t={:.3f}, {!r}, {!r}, gap={:.1f}, colliding={})".format(
+            self.time, self.first.name, self.second.name, self.gap, self.colliding)
+
+
+class SpatialHash:
+    """Uniform grid of cells mapping to the robots whose centre lies inside."""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def rebuild(self, robots):
+        cells = {}
+        size = self.cell_size
+        for robot in robots:
+            state = robot.engine.state
+            cells.setdefault((int(math.floor(state.x / size)), int(math.floor(state.y / size))), []).append(robot)
+        self.cells = cells
+
+    def candidate_pairs(self):
+        """Every pair of robots in the same or adjacent cells, once."""
+        cells = self.cells
+        for (cx, cy), robots in cells.items():
+            for dx, dy in _FORWARD_CELLS:
+                if dx == 0 and dy == 0:
+                    for i in range(len(robots)):
+                        for j in range(i + 1, len(robots)):
+                            yield robots[i], robots[j]
+                    continue
+                others = cells.get((cx + dx, cy + dy))
+                if others:
+                    for robot in robots:
+                        for other in others:
+                            yield robot, other
+
+
+def _projection(corners, axis):
+    values = [x * axis[0] + y * axis[1] for x, y in corners]
+    return min(values), max(values)
+
+
+def footprints_overlap(first, second):
+    """Separating-axis test of two robot footprints (oriented rectangles)."""
+    corners = (first.corners(), second.corners())
+    for rectangle in corners:
+        for i in (0, 1):
+            edge = (rectangle[i + 1][0] - rectangle[i][0], rectangle[i + 1][1] - rectangle[i][1])
+            axis = (-edge[1], edge[0])
+            min_a, max_a = _projection(corners[0], axis)
+            min_b, max_b = _projection(corners[1], axis)
+            if max_a < min_b or max_b < min_a:
+                return False
+    return True
+
+
+class World:
+    """Several robots following their own paths on the same table."""
+
+    def __init__(self, dt=DEFAULT_DT, proximity_mm=PROXIMITY_MM):
+        self.dt = dt
+        self.proximity_mm = proximity_mm
+        self.time = 0.0
+        self.robots = []
+        self.spatial_hash = SpatialHash(1.0)
+        self.contacts = []      # Contacts of the last step
+        self.collisions = {}    # (name, name) -> time of the first collision
+
+    def add_robot(self, name, path_points, start_pose=None, width_mm=ROBOT_WIDTH_MM,
+                  length_mm=ROBOT_LENGTH_MM, team=None):
+        """Add a robot; it starts on its first waypoint unless start_pose (x, y, angle) is given."""
+        if start_pose is None and len(path_points) > 0:
+            start_pose = path_points[0][0:3]
+        state = RobotState(*start_pose) if start_pose is not None else RobotState()
+        robot = WorldRobot(name, SimulationEngine(path_points, state, self.dt), width_mm, length_mm, team)
+        self.robots.append(robot)
+        # Cells as large as the contact range: contacts only span adjacent cells
+        self.spatial_hash.cell_size = 2 * max(r.radius for r in self.robots) + self.proximity_mm
+        return robot
+
+    def robot(self, name):
+        for robot in self.robots:
+            if robot.name == name:
+                return robot
+        raise KeyError(name)
+
+    def start(self):
+        for robot in self.robots:
+            robot.engine.start()
+
+    @property
+    def is_moving(self):
+        return any(robot.engine.is_moving for robot in self.robots)
+
+    def step(self, dt=None):
+        """Advance every robot by dt (defaults to the world timestep) and return the contacts."""
+        dt = self.dt if dt is None else dt
+        for robot in self.robots:
+            robot.engine.step(dt)
+        self.time += dt
+        self.contacts = self.find_contacts()
+        for contact in self.contacts:
+            key = tuple(sorted((contact.first.name, contact.second.name)))
+            if contact.colliding and key not in self.collisions:
+                self.collisions[key] = self.time
+        return self.contacts
+
+    def find_contacts(self):
+        """Robot pairs closer than the proximity range, at the current poses."""
+        self.spatial_hash.rebuild(self.robots)
+        contacts = []
+        for first, second in self.spatial_hash.candidate_pairs():
+            a, b = first.engine.state, second.engine.state
+            gap = math.hypot(a.x - b.x, a.y - b.y) - first.radius - second.radius
+            if gap <= self.proximity_mm:
+                colliding = gap < 0 and footprints_overlap(first, second)
+                contacts.append(Contact(self.time, first, second, gap, colliding))
+        return contacts
+
+    def run(self, max_time=MAX_SIMULATION_TIME):
+        """Start every robot and step until all have finished; returns the first collision times."""
+        self.start()
+        while self.is_moving and self.time < max_time:
+            self.step()
+        return self.collisions